@@ -1,5 +1,7 @@
 from typing_extensions import Self
-from typing import List, Dict, Union, Literal, Collection, Tuple, Any
+from typing import List, Dict, Union, Literal, Collection, Tuple, Any, Type
+import copy
+import functools
 import yaml
 import json
 import jsonref
@@ -39,12 +41,22 @@ class EventsMapper(BaseModel):
         return json.dumps(events_mapper, indent=4, ensure_ascii=False) if return_str else events_mapper
 
 
+@functools.cache
+def get_model_json_schema(model_class: Type[BaseModel], mode: Literal['validation', 'serialization'] = 'serialization') -> dict:
+    """
+    Pydantic json schema is generated once per model class and mode.
+    Result is shared, so it should be copied before any change
+    """
+    return model_class.model_json_schema(mode=mode)
+
+
 class CustomBaseModel(BaseModel):
 
     @classmethod
     def update_json_schema_for_field(cls, field_name, data_to_update: Dict[str, Any]):
         """
-        Method to update json_schema_extra for a particular field
+        Method to update json_schema_extra for a particular field.
+        It changes model class itself, so for schema generation dump_schema(field_overrides=...) is used
         """
         if field_name in cls.model_fields:
             field = cls.model_fields[field_name]
@@ -67,16 +79,32 @@ class CustomBaseModel(BaseModel):
         return d
 
     @classmethod
-    def dump_schema(cls, mode: Literal['validation', 'serialization'] = 'serialization', return_str: bool = False, drop_keys: Union[Tuple, List] = ("$defs", "$ref")) -> Union[str, dict]:
+    def dump_schema(
+            cls,
+            mode: Literal['validation', 'serialization'] = 'serialization',
+            return_str: bool = False,
+            drop_keys: Union[Tuple, List] = ("$defs", "$ref"),
+            field_overrides: Dict[Type[BaseModel], Dict[str, Dict[str, Any]]] = None
+    ) -> Union[str, dict]:
 
         """
         Create schema for frontend generator https://github.com/json-editor/json-editor
         It's kinda looks like pydantic model_json_schema, but:
         - some needed for json-editor fields will be added in json_schema_extra
         - some unwanted for json-editor fields will be filtered here
+        - dynamic data (e.g. enums) is injected with field_overrides {model class: {field name: data}}
+          into copy of generated schema, so model classes aren't changed
         """
 
-        schema_raw = cls.model_json_schema(mode=mode)
+        schema_raw = copy.deepcopy(get_model_json_schema(cls, mode=mode))
+        for model_class, fields in (field_overrides or {}).items():
+            model_schema = schema_raw if model_class is cls else schema_raw.get("$defs", {}).get(model_class.__name__)
+            if model_schema is None:
+                continue
+            for field_name, data_to_update in fields.items():
+                if field_name in model_schema.get("properties", {}):
+                    model_schema["properties"][field_name].update(data_to_update)
+
         schema_clean = jsonref.replace_refs(schema_raw).copy()
 
         # recursive delete
@@ -96,6 +124,12 @@ class Status(Enum):
     works_on_prod = 'Works on prod'
 
 
+class ImageMode(Enum):
+    """How images are passed to pages: inlined as base64 data uri, or as url of /image endpoint"""
+    base64 = 'base64'
+    url = 'url'
+
+
 class Image(BaseModel):
 
     model_config = ConfigDict(
@@ -287,6 +321,10 @@ class AssignmentBase(CustomBaseModel):
 
 
 class AssignmentSchema(BaseModel):
+    """
+    Schema and events mapper are kept in schema store by hash (see services.schema),
+    documents saved before it have them embedded
+    """
 
     assignment_ui_schema: Union[str, SkipJsonSchema[None]] = Field(
         default=None,
@@ -296,6 +334,10 @@ class AssignmentSchema(BaseModel):
         default=None,
         json_schema_extra={"title": "Events Mapper", "type": "string", "readonly": True, "propertyOrder": 100103}
     )
+    events_mapper_hash: Union[str, SkipJsonSchema[None]] = Field(
+        default=None,
+        json_schema_extra={"title": "Events Mapper Hash", "type": "string", "readonly": True, "propertyOrder": 100104}
+    )
 
 
 class AssignmentSchemaHash(BaseModel):
@@ -306,6 +348,42 @@ class AssignmentSchemaHash(BaseModel):
     )
 
 
+class ImageManifestEntry(BaseModel):
+    """Where image is in document (dotted path, e.g. blocks.0.events.1.images.0) and what it is in s3"""
+
+    path: str
+    key: str
+    size: Union[int, None] = None
+    hash: Union[str, None] = None
+
+
+class AssignmentImageManifest(BaseModel):
+    """
+    Flat list of all images of document, maintained on every write,
+    so images can be found without walking the whole document tree. Not shown in UI.
+    """
+
+    image_manifest: Union[List[ImageManifestEntry], SkipJsonSchema[None]] = Field(default=None)
+
+
+class PatchOperation(BaseModel):
+    """JSON Patch (RFC 6902) operation"""
+
+    model_config = ConfigDict(populate_by_name=True)
+
+    op: Literal['add', 'remove', 'replace', 'move', 'copy', 'test']
+    path: str
+    value: Any = None
+    from_: Union[str, None] = Field(default=None, alias='from')
+
+
+class AssignmentPatch(BaseModel):
+    """Incremental save: operations over document with save_counter, that client has changed"""
+
+    save_counter: int
+    operations: List[PatchOperation]
+
+
 # Represents an ObjectId field in the database.
 # It will be represented as a `str` on the model so that it can be serialized to JSON.
 PyObjectId = Annotated[str, BeforeValidator(str)]
@@ -336,16 +414,16 @@ class AssignmentInUI(AssignmentID, AssignmentSchemaHash, AssignmentBase):
     pass
 
 
-class AssignmentWithFullSchema(AssignmentSchema, AssignmentSchemaHash, AssignmentBase):
+class AssignmentWithFullSchema(AssignmentImageManifest, AssignmentSchema, AssignmentSchemaHash, AssignmentBase):
     """
-    Base + SchemaHash + Schema
+    Base + SchemaHash + Schema + ImageManifest
     """
     pass
 
 
 class AssignmentInDB(AssignmentID, AssignmentWithFullSchema):
     """
-    Base + SchemaHash + Schema + ID
+    Base + SchemaHash + Schema + ImageManifest + ID
     """
     pass
 
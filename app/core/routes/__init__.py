@@ -4,6 +4,8 @@ from .general import router as general_router
 from .assignment import router as assignment_router
 from .user import router as user_router
 from .service import router as service_router
+from .image import router as image_router
+from .schema import router as schema_router
 
 core_router = APIRouter()
 
@@ -11,3 +13,5 @@ core_router.include_router(general_router)
 core_router.include_router(assignment_router)
 core_router.include_router(user_router)
 core_router.include_router(service_router)
+core_router.include_router(image_router)
+core_router.include_router(schema_router)
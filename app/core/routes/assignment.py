@@ -1,24 +1,29 @@
 from typing import Callable, Any
 import json
 import datetime as dt
+from urllib.parse import urlencode
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Query
 from fastapi.templating import Jinja2Templates
 from starlette.requests import Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, Response
 from motor.motor_asyncio import AsyncIOMotorCollection
 
 import app.core.services.database as db
 import app.core.services.s3 as s3
 from app.core.services.auth import get_current_user, require_authenticated_user
 from app.core.services.assignment import (
-    get_assignment_data_with_images, get_all_assignments_data, group_assignments_data,
-    update_assignment_in_db, duplicate_assignment, update_assignment_size_total,
-    get_actual_model_schema_data, create_new_assignment,
-    upload_images_from_assignment_to_s3_with_clean, del_assignment_with_images,
+    get_assignment_data_with_images, duplicate_assignment, save_assignment, save_coalescer,
+    get_actual_model_schema_data, create_new_assignment, del_assignment_with_images,
     del_group_of_assignments_with_images
 )
-from app.core.models.assignment import AssignmentWithFullSchema, AssignmentInUI, Event
+from app.core.services.schema import get_assignment_schema_hashes
+import app.core.services.serialization as serialization
+import app.core.services.listing as listing
+import app.core.services.executors as executors
+import app.core.services.groups as groups
+from app.core.services.patch import patch_assignment_in_db
+from app.core.models.assignment import AssignmentWithFullSchema, AssignmentInUI, AssignmentPatch, Event, ImageMode, Status
 from app.core.models.user import UserInDB
 from app.settings import settings
 from app.logger import logger
@@ -27,6 +32,9 @@ prefix = 'assignment'
 router = APIRouter(prefix=f'/{prefix}')
 templates = Jinja2Templates(directory="app/templates")
 
+# fields of document with schema (embedded in old documents) and its hashes
+SCHEMA_FIELDS = ('assignment_ui_schema', 'assignment_ui_schema_hash', 'events_mapper', 'events_mapper_hash')
+
 
 
 @router.get("/", response_class=HTMLResponse)
@@ -37,22 +45,60 @@ async def assignment_route(request: Request, current_user: UserInDB = Depends(re
 @router.get("/list")
 async def list_assignments_route(
         request: Request,
+        status: str | None = None,
+        author: str | None = None,
+        issue: str | None = None,
+        name: str | None = None,
+        cursor: str | None = None,
+        limit: int = Query(default=settings.app_list_page_size, ge=1, le=settings.app_list_max_page_size),
         current_user: UserInDB = Depends(get_current_user),  # we let any user see that
         collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection))
     ):
+    """Page of groups of assignments, filters are applied to versions (name is prefix of name)"""
 
-    all_assignments_data = await get_all_assignments_data(collection=collection)
-    grouped_assignments = group_assignments_data(all_assignments_data)
+    query = listing.build_assignments_query(status=status, author=author, issue=issue, name_prefix=name)
+    grouped_assignments, next_cursor = await listing.list_assignment_groups(collection, query, limit=limit, cursor=cursor)
     _, actual_assignment_ui_schema_hash, _ = await get_actual_model_schema_data()
 
+    filters = {"status": status, "author": author, "issue": issue, "name": name}
+    next_url = None
+    if next_cursor:
+        next_params = {key: value for key, value in filters.items() if value}
+        next_url = f"/{prefix}/list?{urlencode({**next_params, 'cursor': next_cursor, 'limit': limit})}"
+
     return templates.TemplateResponse(f"{prefix}/list.html", {
         "request": request,
         "current_user": current_user,
         "grouped_assignments": grouped_assignments,
+        "filters": filters,
+        "statuses": [status.value for status in Status],
+        "next_url": next_url,
         "actual_assignment_ui_schema_hash": actual_assignment_ui_schema_hash
     })
 
 
+@router.get("/list/data")
+async def list_assignments_data_route(
+        status: str | None = None,
+        author: str | None = None,
+        issue: str | None = None,
+        name: str | None = None,
+        cursor: str | None = None,
+        limit: int = Query(default=settings.app_list_page_size, ge=1, le=settings.app_list_max_page_size),
+        current_user: UserInDB = Depends(require_authenticated_user),
+        collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection))
+    ):
+    """
+    Page of assignments (not grouped), newest updates first. next_cursor is passed as cursor to get the next page.
+    n.b! Placed above /{assignment_id}/data, because "list" can be considered as assignment_id.
+    """
+
+    query = listing.build_assignments_query(status=status, author=author, issue=issue, name_prefix=name)
+    assignments, next_cursor = await listing.list_assignments(collection, query, limit=limit, cursor=cursor)
+
+    return JSONResponse(content={"items": assignments, "next_cursor": next_cursor})
+
+
 @router.post("/new")
 async def create_new_assignment_route(
         current_user: UserInDB = Depends(require_authenticated_user),
@@ -66,8 +112,9 @@ async def create_new_assignment_route(
     assignment = await create_new_assignment(AssignmentWithFullSchema)
     assignment.author = current_user.username
 
-    result = await db.create_obj(assignment, collection)
+    result = await db.create_obj(assignment, collection, model_dump_kwargs={"exclude": {"assignment_ui_schema", "events_mapper"}})
     assignment_id = str(result['_id'])
+    await groups.recompute_group(assignment.group_id, collection)
 
     return JSONResponse(content={"id": assignment_id})  # we will redirect to get /assignment/{assignment_id} on frontend
 
@@ -76,24 +123,68 @@ async def create_new_assignment_route(
 async def get_assignment_route(
         request: Request,
         assignment_id: str,
+        image_mode: ImageMode = ImageMode(settings.app_images_edit_mode),
         current_user: UserInDB = Depends(require_authenticated_user),
         collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection)),
     ):
+    """
+    Editor page is just a shell: data, schema and events_mapper are loaded by page with separate requests
+    (schema and events_mapper are cached by browser, see /schema/{hash})
+    """
 
-    assignment_data = await get_assignment_data_with_images(assignment_id=assignment_id, collection=collection, rename_mongo_id=True)
-    # Pop schema and events_mapper, to pass separately, to not show them in UI data itself
-    assignment_ui_schema = json.loads(assignment_data.pop('assignment_ui_schema'))
-    events_mapper = json.loads(assignment_data.pop('events_mapper'))
+    assignment_data = await db.get_obj_by_fields({"_id": assignment_id}, collection, filter_cols=SCHEMA_FIELDS)
+    if not assignment_data:
+        raise HTTPException(status_code=404, detail=f"Assignment {assignment_id} not found")
+
+    assignment_ui_schema_hash, events_mapper_hash = await get_assignment_schema_hashes(assignment_data)
 
     return templates.TemplateResponse(f"{prefix}/edit.html", {
         "request": request,
         "current_user": current_user,
-        "assignment_data": assignment_data,
-        "assignment_ui_schema": assignment_ui_schema,
-        "events_mapper": events_mapper
+        "assignment_id": assignment_id,
+        "assignment_data_url": f"/{prefix}/{assignment_id}/data?image_mode={ImageMode(image_mode).value}",
+        "assignment_ui_schema_url": f"/schema/{assignment_ui_schema_hash}",
+        "events_mapper_url": f"/schema/{events_mapper_hash}"
     })
 
 
+@router.get("/{assignment_id}/data")
+async def get_assignment_data_route(
+        assignment_id: str,
+        image_mode: ImageMode = ImageMode(settings.app_images_edit_mode),
+        if_none_match: str | None = Header(default=None),
+        accept_encoding: str | None = Header(default=None),
+        current_user: UserInDB = Depends(require_authenticated_user),
+        collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection)),
+    ):
+    """Assignment data for editor. Document changes only with save, so save_counter is enough for ETag"""
+
+    assignment_version = await db.get_obj_by_fields({"_id": assignment_id}, collection, filter_cols=('save_counter', ))
+    if not assignment_version:
+        raise HTTPException(status_code=404, detail=f"Assignment {assignment_id} not found")
+
+    etag = f'W/"{assignment_id}-{assignment_version.get('save_counter')}-{ImageMode(image_mode).value}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept-Encoding"}
+
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    assignment_data = await get_assignment_data_with_images(assignment_id=assignment_id, collection=collection, rename_mongo_id=True, image_mode=image_mode)
+    # schema, events_mapper and manifest are not shown in UI data itself (only schema hash is)
+    for field in ('assignment_ui_schema', 'events_mapper', 'events_mapper_hash', 'image_manifest'):
+        assignment_data.pop(field, None)
+
+    body = serialization.dumps(assignment_data)
+    # zlib releases GIL, so big bodies are compressed in thread pool
+    body, content_encoding = await executors.offload(
+        'compress', serialization.compress, body, accept_encoding, size=len(body)
+    )
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
 @router.post("/{assignment_id}")
 async def save_assignment_route(
         assignment_id: str,
@@ -102,13 +193,44 @@ async def save_assignment_route(
         collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection)),
     ):
 
-    updated_assignment = update_assignment_size_total(data=assignment_update)
-    updated_assignment = await upload_images_from_assignment_to_s3_with_clean(assignment_data=updated_assignment, assignment_id=assignment_id)
-    updated_assignment = await update_assignment_in_db(assignment_id=assignment_id, data_update=updated_assignment, collection=collection)
+    # rapid saves of the same document are coalesced: only the latest state is written
+    updated_assignment, upload_stats = await save_coalescer.save(
+        assignment_id, lambda: save_assignment(assignment_id=assignment_id, assignment_update=assignment_update, collection=collection)
+    )
+
+    if updated_assignment:
+        updated_assignment['images_uploaded'] = upload_stats['uploaded']
+        updated_assignment['images_skipped'] = upload_stats['skipped']
 
     return updated_assignment
 
 
+@router.patch("/{assignment_id}")
+async def patch_assignment_route(
+        assignment_id: str,
+        assignment_patch: AssignmentPatch,
+        current_user: UserInDB = Depends(require_authenticated_user),
+        collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection)),
+    ):
+    """Incremental save with JSON Patch operations. 409, if document was saved after client has loaded it"""
+
+    # patch is made over the latest state of document
+    await save_coalescer.flush(assignment_id)
+
+    upload_stats = {"uploaded": 0, "skipped": 0}
+    result = await patch_assignment_in_db(
+        assignment_id=assignment_id,
+        save_counter=assignment_patch.save_counter,
+        operations=assignment_patch.operations,
+        collection=collection,
+        upload_stats=upload_stats
+    )
+    result['images_uploaded'] = upload_stats['uploaded']
+    result['images_skipped'] = upload_stats['skipped']
+
+    return result
+
+
 @router.post("/{assignment_id}/create_new_version")
 async def create_assignment_new_version_route(
         assignment_id: str,
@@ -142,12 +264,13 @@ async def delete_assignment_route(
 async def view_assignment_route(
         request: Request,
         assignment_id: str,
+        image_mode: ImageMode = ImageMode(settings.app_images_view_mode),
         # we don't want to let any user see that, because they can be confused. Only latest version availiable with group endpoint
         current_user: UserInDB = Depends(require_authenticated_user),
         collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection))
 ):
 
-    assignment_data = await get_assignment_data_with_images(assignment_id, collection, rename_mongo_id=True)
+    assignment_data = await get_assignment_data_with_images(assignment_id, collection, rename_mongo_id=True, image_mode=image_mode)
 
     return templates.TemplateResponse(f"{prefix}/view.html", {
         "request": request,
@@ -161,12 +284,14 @@ async def view_assignment_route(
 async def view_latest_assignment_route(
         request: Request,
         group_id: str,
+        image_mode: ImageMode = ImageMode(settings.app_images_view_mode),
         current_user: UserInDB = Depends(get_current_user),  # we let any user see that
         collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection))
 ):
 
-    latest_assignment_id, _ = await db.max_value_in_group(group_field='group_id', group_val=group_id, find_max_in_field='version', collection=collection, additional_filter = {"status": {"$ne": "Design"}})
-    assignment_data = await get_assignment_data_with_images(latest_assignment_id, collection, rename_mongo_id=True) if latest_assignment_id else None
+    group = await groups.get_group(group_id, collection)
+    latest_assignment_id = group and group.get('latest_published_id')
+    assignment_data = await get_assignment_data_with_images(latest_assignment_id, collection, rename_mongo_id=True, image_mode=image_mode) if latest_assignment_id else None
 
     return templates.TemplateResponse(f"{prefix}/view.html", {
         "request": request,
@@ -1,4 +1,5 @@
 from typing import Optional
+import math
 
 from app.core.services.auth import create_access_token
 
@@ -8,7 +9,7 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from starlette.templating import Jinja2Templates
 
-from app.core.services.auth import authenticate_user, get_current_user
+from app.core.services.auth import authenticate_user, get_current_user, login_limiter
 from app.core.models.user import UserInDB
 from app.settings import settings
 from app.logger import logger
@@ -46,9 +47,22 @@ async def logout_route():
 
 @router.post("/token")
 async def token_route(request: Request, form_data: OAuth2PasswordRequestForm = Depends()):
+    attempt_key = (form_data.username, request.client.host if request.client else None)
+    retry_after = login_limiter.get_retry_after(attempt_key)
+    if retry_after:
+        logger.warning(f"Login of {form_data.username} is limited, too many failed attempts")
+        return templates.TemplateResponse(
+            "login.html",
+            {"request": request, "message": f"Too many failed attempts, try again in {math.ceil(retry_after)} sec"},
+            status_code=429,
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
     user = await authenticate_user(form_data.username, form_data.password)
     if not user:
+        login_limiter.register_failure(attempt_key)
         return templates.TemplateResponse("login.html", {"request": request, "message": "Invalid credentials"})
+    login_limiter.reset(attempt_key)
     access_token = create_access_token({"sub": form_data.username}, expires_delta=settings.app_jwt_token_sec)
     response = RedirectResponse("/", status_code=302)  # redirect to home
     response.set_cookie(key="access_token", value=access_token, httponly=True, max_age=settings.app_jwt_token_sec)
@@ -0,0 +1,76 @@
+import mimetypes
+from pathlib import Path
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from botocore.exceptions import ClientError
+
+import app.core.services.s3 as s3
+from app.core.services.auth import get_current_user
+from app.core.models.user import UserInDB
+from app.settings import settings
+
+
+prefix = 'image'
+router = APIRouter(prefix=f'/{prefix}')
+
+# image keys are md5 of content (see upload_image_to_loc), so object under key never changes
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+async def get_image_response(key: str, prefix: str = '', range_header: str = None, if_none_match: str = None) -> Response:
+
+    etag = f'"{Path(key).stem}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    try:
+        obj = await s3.get_object(bucket_name=settings.s3_images_bucket, prefix=prefix, file_key=key, byte_range=range_header)
+    except ClientError as e:
+        error_code = e.response.get("Error", {}).get("Code")
+        if error_code in ("NoSuchKey", "404"):
+            raise HTTPException(status_code=404, detail=f"Image {prefix}/{key} not found")
+        if error_code == "InvalidRange":
+            raise HTTPException(status_code=416, detail=f"Invalid range {range_header} for image {prefix}/{key}")
+        raise
+
+    headers["Content-Length"] = str(obj["ContentLength"])
+    if obj.get("ContentRange"):
+        headers["Content-Range"] = obj["ContentRange"]
+
+    media_type, _ = mimetypes.guess_type(key)
+
+    return StreamingResponse(
+        s3.iter_object_body(obj["Body"]),
+        status_code=206 if obj.get("ContentRange") else 200,
+        media_type=media_type or obj.get("ContentType") or "application/octet-stream",
+        headers=headers
+    )
+
+
+@router.get("/{key}")
+async def get_store_image_route(
+        key: str,
+        range_header: str | None = Header(default=None, alias="Range"),
+        if_none_match: str | None = Header(default=None),
+        current_user: UserInDB = Depends(get_current_user),  # we let any user see that, as group view
+    ):
+    """Image from shared image store"""
+
+    return await get_image_response(key=key, range_header=range_header, if_none_match=if_none_match)
+
+
+@router.get("/{assignment_id}/{key}")
+async def get_image_route(
+        assignment_id: str,
+        key: str,
+        range_header: str | None = Header(default=None, alias="Range"),
+        if_none_match: str | None = Header(default=None),
+        current_user: UserInDB = Depends(get_current_user),  # we let any user see that, as group view
+    ):
+    """Legacy image, stored in folder of assignment"""
+
+    return await get_image_response(key=key, prefix=assignment_id, range_header=range_header, if_none_match=if_none_match)
+
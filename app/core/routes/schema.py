@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import Response
+
+from app.core.services.auth import get_current_user
+import app.core.services.schema as schema
+from app.core.models.user import UserInDB
+
+
+prefix = 'schema'
+router = APIRouter(prefix=f'/{prefix}')
+
+# schema in store is addressed by hash of its content, so it never changes
+SCHEMA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/{schema_hash}")
+async def get_schema_route(
+        schema_hash: str,
+        if_none_match: str | None = Header(default=None),
+        current_user: UserInDB = Depends(get_current_user),  # we let any user see that, as group view
+    ):
+    """UI schema or events mapper (json) from schema store"""
+
+    etag = f'"{schema_hash}"'
+    headers = {"ETag": etag, "Cache-Control": SCHEMA_CACHE_CONTROL}
+
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    data = await schema.get_schema(kind=None, schema_hash=schema_hash)
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"Schema {schema_hash} not found")
+
+    return Response(content=data, media_type="application/json", headers=headers)
@@ -7,8 +7,13 @@ from motor.motor_asyncio import AsyncIOMotorCollection
 
 import app.core.services.database as db
 from app.core.services.auth import require_authenticated_user
-from app.core.services.assignment import get_actual_model_schema_data
+from app.core.services.assignment import get_actual_model_schema_data, backfill_image_manifests
 from app.core.services.logs import get_logs_from_files
+from app.core.services.image_gc import collect_orphaned_images
+from app.core.services.schema import resolve_assignment_schema, migrate_embedded_schemas
+from app.core.services.groups import rebuild_groups
+from app.core.services.metrics import metrics
+from app.core.services.loop_monitor import loop_monitor
 from app.core.models.user import UserInDB
 from app.core.models.assignment import AssignmentInUI
 from app.settings import settings
@@ -29,8 +34,7 @@ async def get_assignment_route(
     assignment_data = await db.get_obj_by_id(assignment_id, collection)
 
     assignment_ui_schema_hash = assignment_data.get('assignment_ui_schema_hash')
-    assignment_ui_schema = assignment_data.get('assignment_ui_schema')
-    events_mapper = assignment_data.get('events_mapper')
+    assignment_ui_schema, events_mapper = await resolve_assignment_schema(assignment_data)
 
     assignment_data['assignment_ui_schema_hash'] = 'PLACEHOLDER'
     assignment_data['assignment_ui_schema'] = 'PLACEHOLDER'
@@ -65,4 +69,59 @@ async def get_logs(
         return templates.TemplateResponse(f"{prefix}/logs.html", {"request": request, "logs": logs, "current_user": current_user})
 
     except Exception as e:
-        return templates.TemplateResponse(f"{prefix}/logs.html", {"request": request, "logs": [], "error": str(e), "current_user": current_user})
\ No newline at end of file
+        return templates.TemplateResponse(f"{prefix}/logs.html", {"request": request, "logs": [], "error": str(e), "current_user": current_user})
+
+
+@router.post("/images/manifest/backfill")
+async def backfill_image_manifests_route(
+        current_user: UserInDB = Depends(require_authenticated_user),
+        collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection)),
+    ):
+    """Writes image manifest for assignments saved before it appeared"""
+
+    return {"updated": await backfill_image_manifests(collection)}
+
+
+@router.post("/images/gc")
+async def collect_orphaned_images_route(
+        dry_run: bool = False,
+        current_user: UserInDB = Depends(require_authenticated_user),
+        collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection)),
+    ):
+    """Deletes images, that aren't referenced by any assignment. With dry_run only reports them"""
+
+    return await collect_orphaned_images(collection, dry_run=dry_run)
+
+
+@router.post("/schemas/migrate")
+async def migrate_embedded_schemas_route(
+        current_user: UserInDB = Depends(require_authenticated_user),
+        collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection)),
+    ):
+    """Moves schemas, embedded in assignments, to schema store"""
+
+    return {"updated": await migrate_embedded_schemas(collection)}
+
+
+@router.post("/groups/rebuild")
+async def rebuild_groups_route(
+        current_user: UserInDB = Depends(require_authenticated_user),
+        collection: AsyncIOMotorCollection = Depends(db.collection_dependency(settings.app_assignments_collection)),
+    ):
+    """Recomputes summaries of all groups from assignments (consistency repair)"""
+
+    return {"groups": await rebuild_groups(collection)}
+
+
+@router.get("/metrics")
+async def get_metrics_route(current_user: UserInDB = Depends(require_authenticated_user)):
+    """Metrics of worker, that handles request"""
+
+    return metrics.snapshot()
+
+
+@router.get("/loop")
+async def get_loop_route(current_user: UserInDB = Depends(require_authenticated_user)):
+    """Event loop lag histogram and recent stalls (with stacks) of worker, that handles request"""
+
+    return loop_monitor.snapshot()
@@ -4,7 +4,7 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from bson import ObjectId
 
 import app.core.services.database as db
-from app.core.services.auth import get_password_hash, require_authenticated_user
+from app.core.services.auth import get_password_hash, require_authenticated_user, invalidate_user
 from app.core.models.user import User, UserInDB, Role
 from app.settings import settings
 from app.logger import logger
@@ -46,7 +46,7 @@ async def add_user_route(
     if username_exists:
         raise HTTPException(status_code=400, detail=f"User {username} already exists")
 
-    user = User(username=username, hashed_password=get_password_hash(password), role=Role(role).value, active=True)
+    user = User(username=username, hashed_password=await get_password_hash(password), role=Role(role).value, active=True)
 
     try:
         user = await db.create_obj(user, collection)
@@ -79,10 +79,31 @@ async def delete_user(
         current_user: UserInDB = Depends(require_authenticated_user)
     ):
 
+    user_data = await db.get_obj_by_fields({'_id': user_id}, collection, filter_cols=('username', ))
     result = await db.delete_obj(user_id, collection)
     logger.info(f"User {user_id} deleted")
 
     if result:
+        await invalidate_user(user_data['username'])
         return {"message": f"User deleted successfully"}
     else:
-        raise {"message": f"User {user_id} not found. Nothing to delete successfully"}
\ No newline at end of file
+        raise HTTPException(status_code=404, detail=f"User {user_id} not found. Nothing to delete")
+
+
+@router.post("/deactivate/{user_id}")
+async def deactivate_user(
+        user_id: str,
+        collection=Depends(db.collection_dependency(settings.app_users_collection)),
+        current_user: UserInDB = Depends(require_authenticated_user)
+    ):
+    """Tokens of deactivated user aren't accepted anymore (user is kept)"""
+
+    user_data = await db.get_obj_by_fields({'_id': user_id}, collection, filter_cols=('username', ))
+    if not user_data:
+        raise HTTPException(status_code=404, detail=f"User {user_id} not found")
+
+    await collection.update_one({'_id': ObjectId(user_id)}, {'$set': {'active': False}})
+    await invalidate_user(user_data['username'])
+    logger.info(f"User {user_id} deactivated")
+
+    return {"message": f"User {user_data['username']} deactivated successfully"}
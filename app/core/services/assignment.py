@@ -1,18 +1,31 @@
-from typing import Literal, Collection, List, Tuple, Iterable, Any, Type, Union, Dict, Callable
+from typing import Literal, Collection, List, Tuple, Iterable, Iterator, Any, Type, Union, Dict, Callable, Set, Awaitable
+import asyncio
 import hashlib
 import uuid
 import datetime as dt
-from collections import defaultdict
+from collections import defaultdict, Counter
+from contextlib import asynccontextmanager
+from pathlib import Path
 from pydantic import BaseModel
+from bson import ObjectId
 
 from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
 from fastapi import HTTPException
 
-from app.core.services.utils import format_date, get_model_size, get_hash
+from app.core.services.utils import format_date, get_hash, get_by_path
+from app.core.services.cache import LRUCache
+from app.core.services.metrics import metrics
 import app.core.services.database as db
 import app.core.services.s3 as s3
-from app.core.models.assignment import Event, EventsMapper, AssignmentInUI,AssignmentInDB, Status, AssignmentWithFullSchema, Image
+import app.core.services.image_store as image_store
+import app.core.services.sizes as sizes
+import app.core.services.groups as groups
+import app.core.services.executors as executors
+from app.core.services.schema import get_schema_snapshot_async, store_snapshot, move_schema_to_store
+from app.core.models.assignment import AssignmentInDB, Status, AssignmentWithFullSchema, Image, ImageMode
 from app.settings import settings
+from app.logger import logger
 
 
 def recursive_apply(data: Union[Dict, List], target_keys: Union[List[str], Tuple[str]], operation: Callable, operation_kwargs: dict = {}) -> Union[Dict, List]:
@@ -50,6 +63,44 @@ async def async_recursive_apply(data: Union[Dict, List], target_keys: Union[List
     return data
 
 
+def iter_images(
+        data: Union[Dict, List], image_parent_keys: Union[List[str], Tuple[str]] = ('images', 'check_images'), path: str = ''
+) -> Iterator[Tuple[str, dict]]:
+    """
+    Yields (dotted path, image dict) for every image in data, e.g. ('blocks.0.events.1.images.0', {...}).
+    Yielded dicts are the same objects as in data, so they can be changed in place.
+    """
+    if isinstance(data, dict):
+        for key, value in data.items():
+            key_path = f"{path}.{key}" if path else str(key)
+            if key in image_parent_keys:
+                if isinstance(value, list):
+                    for idx, image in enumerate(value):
+                        if isinstance(image, dict):
+                            yield f"{key_path}.{idx}", image
+                elif isinstance(value, dict):
+                    yield key_path, value
+            else:
+                yield from iter_images(value, image_parent_keys, key_path)
+    elif isinstance(data, list):
+        for idx, item in enumerate(data):
+            yield from iter_images(item, image_parent_keys, f"{path}.{idx}" if path else str(idx))
+
+
+def get_image_url(image_location: str) -> str:
+    """Url of /image endpoint, that serves image from s3 location"""
+    _, prefix, file_key = s3.parse_s3_uri(image_location)
+    return f"/image/{prefix}/{file_key}" if prefix else f"/image/{file_key}"
+
+
+def set_image_url_from_loc(image_data: dict, image_loc_field: str, image_data_field: str) -> dict:
+
+    if image_data.get(image_loc_field) and len(image_data.get(image_loc_field)) > 0:
+        image_data[image_data_field] = get_image_url(image_data[image_loc_field])
+
+    return image_data
+
+
 async def get_image_from_loc(image_data: dict, image_loc_field: str, image_data_field: str) -> dict:
 
     if image_data.get(image_loc_field) and len(image_data.get(image_loc_field)) > 0:
@@ -59,19 +110,256 @@ async def get_image_from_loc(image_data: dict, image_loc_field: str, image_data_
     return image_data
 
 
-async def upload_image_to_loc(image_data: dict, assignment_id:str,  image_loc_field: str, image_data_field: str) -> dict:
+async def get_images_from_loc_concurrently(
+        images: Iterable[dict],
+        image_loc_field: str,
+        image_data_field: str,
+        max_concurrency: int = settings.app_images_hydration_concurrency,
+        timeout_sec: float = settings.app_images_hydration_timeout_sec
+) -> int:
+    """
+    Downloads all images at once (not more than max_concurrency at a time) and writes them in place.
+    Image that doesn't fit into timeout_sec is left without data, and doesn't fail others.
+    :return: number of images that weren't loaded in time
+    """
 
-    if image_data.get(image_data_field) and len(image_data.get(image_data_field)) > 0:
-        s3_uri = await s3.base64_image_to_s3(
-            file_name_wo_ext=get_hash(image_data[image_data_field]),
-            base64_string=image_data[image_data_field],
-            prefix=assignment_id
-        )
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _get_image(image_data: dict) -> bool:
+        async with semaphore:
+            try:
+                await asyncio.wait_for(
+                    get_image_from_loc(image_data, image_loc_field=image_loc_field, image_data_field=image_data_field),
+                    timeout=timeout_sec
+                )
+                return True
+            except asyncio.TimeoutError:
+                logger.warning(f"Image {image_data.get(image_loc_field)} wasn't loaded in {timeout_sec}s, skipped")
+                image_data[image_data_field] = None
+                return False
+
+    results = await asyncio.gather(*(_get_image(image) for image in images if image.get(image_loc_field)))
+    return results.count(False)
+
+
+# s3 uris of images, that were uploaded (or checked) by this worker.
+# Disabled by default (size 0): other workers can delete objects without invalidating it
+known_image_uris = LRUCache(maxsize=settings.app_images_known_uris_cache_size)
+
+
+async def is_image_uploaded(s3_uri: str, verify: bool = False) -> bool:
+    """
+    Object for s3_uri surely exists, if it's known by this worker, referenced in image store,
+    or (with verify) checked with HEAD request
+    """
+
+    if s3_uri in known_image_uris:
+        return True
+    if image_store.is_content_addressed(s3_uri) and await image_store.is_stored(image_store.get_image_key(s3_uri)):
+        return True
+    if verify:
+        bucket_name, prefix, file_key = s3.parse_s3_uri(s3_uri)
+        return await s3.file_exists(bucket_name=bucket_name, prefix=prefix, file_key=file_key)
+    return False
+
+
+def is_same_image(image_location: str | None, file_name_wo_ext: str, assignment_id: str) -> bool:
+    """Image location already has this content hash: in image store, or in legacy folder of this assignment"""
+
+    if not image_location:
+        return False
+    _, prefix, file_key = s3.parse_s3_uri(image_location)
+    return Path(file_key).stem == file_name_wo_ext and prefix in ('', assignment_id)
+
+
+async def upload_image_to_loc(
+        image_data: dict, assignment_id:str,  image_loc_field: str, image_data_field: str, upload_stats: dict = None,
+        held_keys: List[str] = None
+) -> dict:
+
+    """
+    New images are uploaded into shared image store as {hash}.ext, only if there is no such image yet.
+    Unchanged images keep their location.
+    :param held_keys: if passed, store keys of new images are held (see image_store.hold_image) and added there,
+    caller releases them after save
+    """
+
+    upload_stats = upload_stats if upload_stats is not None else {}
+
+    # only new base64 data uri can be uploaded, url (see ImageMode.url) points to already uploaded image
+    if image_data.get(image_data_field) and image_data[image_data_field].startswith('data:'):
+        _, ext, base64_data = s3.parse_base64_image(image_data[image_data_field])
+        # hash only of content, so the same image gets the same key, whatever header of data uri is
+        file_name_wo_ext = await executors.offload('md5', get_hash, base64_data, size=len(base64_data))
+        current_location = image_data.get(image_loc_field)
+
+        if is_same_image(current_location, file_name_wo_ext, assignment_id) and (
+            not settings.app_images_verify_unchanged or await is_image_uploaded(current_location, verify=True)
+        ):
+            s3_uri = current_location
+            upload_stats['skipped'] = upload_stats.get('skipped', 0) + 1
+        else:
+            s3_uri = image_store.get_store_uri(f"{file_name_wo_ext}{ext}")
+            if held_keys is not None:
+                # reference is taken before check, so object can't be deleted, until save acquires it
+                key = image_store.get_image_key(s3_uri)
+                held_keys.append(key)
+                is_uploaded = await image_store.hold_image(key)
+            else:
+                is_uploaded = await is_image_uploaded(s3_uri)
+            if is_uploaded:
+                upload_stats['skipped'] = upload_stats.get('skipped', 0) + 1
+            else:
+                s3_uri = await s3.base64_image_to_s3(file_name_wo_ext=file_name_wo_ext, base64_string=image_data[image_data_field])
+                await image_store.register_image(
+                    image_store.get_image_key(s3_uri), size=image_store.get_base64_decoded_size(base64_data)
+                )
+                upload_stats['uploaded'] = upload_stats.get('uploaded', 0) + 1
+
+        known_image_uris.set(s3_uri)
         image_data[image_loc_field] = s3_uri
 
     return image_data
 
 
+def iter_assignment_images(
+        assignment_data: dict, image_parent_keys: Tuple[str] = ('images', 'check_images')
+) -> Iterator[Tuple[str, dict]]:
+    """
+    (path, image dict) of every image with location: straight from image_manifest if document has it,
+    otherwise with walk over the whole document tree
+    """
+
+    manifest = assignment_data.get('image_manifest')
+    if manifest is None:
+        yield from iter_images(assignment_data, image_parent_keys)
+        return
+
+    for entry in manifest:
+        try:
+            yield entry['path'], get_by_path(assignment_data, entry['path'])
+        except (KeyError, IndexError, ValueError, TypeError):
+            logger.warning(f"Image {entry['key']} isn't found in document by path {entry['path']}")
+
+
+def build_image_manifest(
+        assignment_data: dict, image_parent_keys: Tuple[str] = ('images', 'check_images'), image_loc_field: str = 'image_location'
+) -> List[dict]:
+    """Manifest entries (see ImageManifestEntry) for every image with location, without sizes. Walks the document tree"""
+
+    manifest = []
+    for path, image in iter_images(assignment_data, image_parent_keys):
+        if image.get(image_loc_field):
+            key = image_store.get_image_key(image[image_loc_field])
+            manifest.append({"path": path, "key": key, "size": None, "hash": Path(key).stem})
+    return manifest
+
+
+async def fill_image_manifest_sizes(manifest: List[dict], known_manifest: List[dict] = None, head_unknown: bool = False) -> List[dict]:
+    """
+    Sizes of images are taken from known (previous) manifest, then from image store,
+    and with head_unknown - with HEAD requests for the rest
+    """
+
+    sizes = {entry['key']: entry['size'] for entry in known_manifest or [] if entry.get('size') is not None}
+
+    unknown_keys = {entry['key'] for entry in manifest} - set(sizes)
+    if unknown_keys:
+        sizes.update(await image_store.get_sizes(unknown_keys))
+
+    unknown_keys -= set(sizes)
+    if head_unknown and unknown_keys:
+        unknown_keys = list(unknown_keys)
+        head_sizes = await asyncio.gather(*(s3.get_file_size(file_key=key) for key in unknown_keys))
+        sizes.update({key: size for key, size in zip(unknown_keys, head_sizes) if size is not None})
+
+    for entry in manifest:
+        entry['size'] = sizes.get(entry['key'])
+    return manifest
+
+
+def get_manifest_store_keys(manifest: List[dict]) -> Set[str]:
+    """Keys of images, that are in shared image store (and counted there)"""
+    return {entry['key'] for entry in manifest if image_store.is_store_key(entry['key'])}
+
+
+def get_store_image_keys(assignment_data: dict) -> Set[str]:
+    """Keys of all images of assignment, that are in shared image store (and counted there)"""
+
+    manifest = assignment_data.get('image_manifest')
+    if manifest is None:
+        manifest = build_image_manifest(assignment_data)
+    return get_manifest_store_keys(manifest)
+
+
+async def get_stored_version(assignment_id: str, collection: AsyncIOMotorCollection) -> Tuple[int | None, List[dict]] | None:
+    """
+    save_counter and image manifest of assignment, as it's saved in db now (manifest is built on the fly for documents without it)
+    :return: None, if assignment isn't found
+    """
+
+    assignment_data = await collection.find_one({"_id": ObjectId(assignment_id)}, {"image_manifest": 1, "save_counter": 1})
+    if not assignment_data:
+        return None
+    if assignment_data.get('image_manifest') is not None:
+        return assignment_data.get('save_counter'), assignment_data['image_manifest']
+
+    blocks_data = await collection.find_one({"_id": ObjectId(assignment_id)}, {"blocks": 1})
+    return assignment_data.get('save_counter'), build_image_manifest(blocks_data) if blocks_data else []
+
+
+async def get_stored_image_manifest(assignment_id: str, collection: AsyncIOMotorCollection) -> List[dict]:
+    """Image manifest of assignment, as it's saved in db now (built on the fly for documents without it)"""
+
+    version = await get_stored_version(assignment_id, collection)
+    return version[1] if version else []
+
+
+async def copy_images_to_store(assignment_data: dict, held_keys: List[str], image_loc_field: str = 'image_location') -> dict:
+    """
+    Moves references of legacy images (in assignment folder) to image store, with server side copy.
+    Works over image_manifest (it's built, if document doesn't have it yet)
+    :param held_keys: store keys of copied images are held and added there (see image_store.copy_to_store),
+    caller releases them after save
+    """
+
+    if assignment_data.get('image_manifest') is None:
+        assignment_data['image_manifest'] = build_image_manifest(assignment_data)
+
+    async def _copy_image(entry: dict):
+        image = get_by_path(assignment_data, entry['path'])
+        image[image_loc_field] = await image_store.copy_to_store(image[image_loc_field], held_keys=held_keys, size=entry.get('size'))
+        entry['key'] = image_store.get_image_key(image[image_loc_field])
+
+    await asyncio.gather(*(
+        _copy_image(entry) for entry in assignment_data['image_manifest'] if not image_store.is_store_key(entry['key'])
+    ))
+    return assignment_data
+
+
+async def backfill_image_manifests(collection: AsyncIOMotorCollection, batch_size: int = 100) -> int:
+    """
+    Writes image_manifest for documents, saved before it appeared.
+    Sizes are taken from image store, or with HEAD requests for legacy images
+    :return: number of updated documents
+    """
+
+    updated = 0
+    requests = []
+    async for assignment_data in collection.find({"image_manifest": None}, {"blocks": 1}):
+        manifest = await fill_image_manifest_sizes(build_image_manifest(assignment_data), head_unknown=True)
+        requests.append(UpdateOne({"_id": assignment_data["_id"], "image_manifest": None}, {"$set": {"image_manifest": manifest}}))
+        if len(requests) >= batch_size:
+            updated += (await collection.bulk_write(requests, ordered=False)).modified_count
+            requests = []
+
+    if requests:
+        updated += (await collection.bulk_write(requests, ordered=False)).modified_count
+
+    logger.info(f"Image manifest backfilled for {updated} assignments")
+    return updated
+
+
 def clean_dict_field(data: dict, field_to_clean: str) -> dict:
     if data.get(field_to_clean) and len(data.get(field_to_clean)) > 0:
         data[field_to_clean] = ''
@@ -82,7 +370,9 @@ async def get_images_for_assignment_from_s3(
         assignment_data: dict,
         image_parent_keys: Tuple[str] = ('images', 'check_images'),
         image_loc_field: str = 'image_location',
-        image_data_field: str = 'image_data'
+        image_data_field: str = 'image_data',
+        concurrent: bool = True,
+        image_mode: ImageMode = ImageMode.base64
 ) -> dict:
 
     """
@@ -90,9 +380,21 @@ async def get_images_for_assignment_from_s3(
     :param image_parent_keys: names of parent dict, where image info can be stored
     :param image_loc_field: name of attribute in image_holder, where image located
     :param image_data_field: name of attribute where base64 string of image should be stored
+    :param concurrent: collect all images first and download them concurrently, otherwise one by one
+    :param image_mode: base64 - download images into data uri, url - only put url of /image endpoint (no s3 calls)
     :return: modified assignment_data
     """
 
+    if ImageMode(image_mode) == ImageMode.url:
+        for _, image in iter_assignment_images(assignment_data, image_parent_keys):
+            set_image_url_from_loc(image, image_loc_field=image_loc_field, image_data_field=image_data_field)
+        return assignment_data
+
+    if concurrent:
+        images = [image for _, image in iter_assignment_images(assignment_data, image_parent_keys)]
+        await get_images_from_loc_concurrently(images, image_loc_field=image_loc_field, image_data_field=image_data_field)
+        return assignment_data
+
     return await async_recursive_apply(
         data=assignment_data,
         target_keys=image_parent_keys,
@@ -106,14 +408,25 @@ async def upload_images_from_assignment_to_s3(
         assignment_id: str,
         image_parent_keys: Tuple[str] = ('images', 'check_images'),
         image_loc_field: str = 'image_location',
-        image_data_field: str = 'image_data'
+        image_data_field: str = 'image_data',
+        upload_stats: dict = None,
+        held_keys: List[str] = None
 ) -> dict:
 
+    """
+    Uploads only new or changed images
+    :param upload_stats: if passed, number of 'uploaded' and 'skipped' images will be counted there
+    :param held_keys: if passed, keys held for new images are added there (see upload_image_to_loc)
+    """
+
     return await async_recursive_apply(
         data=assignment_data,
         target_keys=image_parent_keys,
         operation=upload_image_to_loc,
-        operation_kwargs={"assignment_id": assignment_id, "image_loc_field": image_loc_field, "image_data_field": image_data_field}
+        operation_kwargs={
+            "assignment_id": assignment_id, "image_loc_field": image_loc_field, "image_data_field": image_data_field,
+            "upload_stats": upload_stats, "held_keys": held_keys
+        }
     )
 
 
@@ -136,7 +449,9 @@ async def upload_images_from_assignment_to_s3_with_clean(
         assignment_id: str,
         image_parent_keys: Tuple[str] = ('images', 'check_images'),
         image_loc_field: str = 'image_location',
-        image_data_field: str = 'image_data'
+        image_data_field: str = 'image_data',
+        upload_stats: dict = None,
+        held_keys: List[str] = None
 ) -> dict:
 
     assignment_data = await upload_images_from_assignment_to_s3(
@@ -144,7 +459,9 @@ async def upload_images_from_assignment_to_s3_with_clean(
         assignment_id=assignment_id,
         image_parent_keys=image_parent_keys,
         image_loc_field=image_loc_field,
-        image_data_field=image_data_field
+        image_data_field=image_data_field,
+        upload_stats=upload_stats,
+        held_keys=held_keys
     )
 
     assignment_data = clean_images_from_assignment_data(
@@ -174,47 +491,221 @@ async def get_assignment_data(
 
 
 async def get_assignment_data_with_images(
-        assignment_id: str, collection: AsyncIOMotorCollection, as_model: bool = False, rename_mongo_id: bool = True
+        assignment_id: str, collection: AsyncIOMotorCollection, as_model: bool = False, rename_mongo_id: bool = True,
+        image_mode: ImageMode = ImageMode.base64
 ) -> Union[dict, AssignmentInDB]:
 
     assignment_data = await get_assignment_data(assignment_id=assignment_id, collection=collection, as_model=as_model, rename_mongo_id=rename_mongo_id)
-    assignment_data = await get_images_for_assignment_from_s3(assignment_data=assignment_data)
+    assignment_data = await get_images_for_assignment_from_s3(assignment_data=assignment_data, image_mode=image_mode)
 
     return assignment_data
 
 
-def update_assignment_size_total(data: dict, size_total_field: str = 'size_total') -> dict:
-    data[size_total_field] = get_model_size(data)
-    return data
+# save_counter is version of document (ETag), so only db increments it
+SAVE_COUNTER_INC_STAGE = {"$set": {"save_counter": {"$add": [{"$ifNull": ["$save_counter", 0]}, 1]}}}
+# full save is retried, while document is changed by concurrent saves between read of its manifest and write
+SAVE_ATTEMPTS = 3
 
 
-async def update_assignment_in_db(assignment_id: str, data_update: dict, collection: AsyncIOMotorCollection) -> dict:
+async def update_assignment_in_db(assignment_id: str, data_update: dict, collection: AsyncIOMotorCollection) -> dict | None:
+    """
+    Write of full document. It's conditional on save_counter of stored version, that image references are counted from,
+    so concurrent save of the same document (other tab or worker) can't release or acquire the same keys twice
+    :return: updated assignment (None, if it's not found)
+    """
 
     data_update['updated_at'] = dt.datetime.now().isoformat()
-    data_update['save_counter'] += 1
-    data_update['size_doc'] = get_model_size(data_update)
+    # incremented by db (it's ETag of document), so value from client is ignored
+    data_update.pop('save_counter', None)
 
     del data_update['id']  # pass to update without id
+    # computed by db from stored document, see update stages
+    for size_field in ('size_doc', 'size_total'):
+        data_update.pop(size_field, None)
+    new_manifest = build_image_manifest(data_update)
+
+    for _ in range(SAVE_ATTEMPTS):
+        stored_version = await get_stored_version(assignment_id, collection)
+        if stored_version is None:
+            return None
+        save_counter, old_manifest = stored_version
+        data_update['image_manifest'] = await fill_image_manifest_sizes(new_manifest, known_manifest=old_manifest)
+
+        # new images are referenced before save, and removed ones are released only after it
+        images_to_acquire, images_to_release = image_store.get_keys_diff(
+            old_keys=get_manifest_store_keys(old_manifest),
+            new_keys=get_manifest_store_keys(data_update['image_manifest'])
+        )
+        await image_store.acquire_images(images_to_acquire)
+        result = await db.update_obj_with_pipeline(
+            assignment_id, data_update, collection,
+            stages=[SAVE_COUNTER_INC_STAGE, sizes.get_size_stage(sizes.get_images_size(data_update['image_manifest']))],
+            returned_fields=('save_counter', ),
+            conditions={"save_counter": save_counter},
+        )
+        await image_store.release_images(images_to_release if result else images_to_acquire)
+        if result:
+            await groups.recompute_group(data_update.get('group_id'), collection)
+            return result
+        metrics.inc("saves_retried")
+
+    raise HTTPException(status_code=409, detail=f"Assignment {assignment_id} is being saved by someone else, try again")
+
+
+async def save_assignment(assignment_id: str, assignment_update: dict, collection: AsyncIOMotorCollection) -> Tuple[dict | None, dict]:
+    """
+    Full save of document from editor: upload of new images and write to db (with sizes)
+    :return: updated assignment (None, if it's not found), upload stats
+    """
+
+    upload_stats = {"uploaded": 0, "skipped": 0}
+    held_keys = []
+    try:
+        updated_assignment = await upload_images_from_assignment_to_s3_with_clean(
+            assignment_data=assignment_update, assignment_id=assignment_id, upload_stats=upload_stats, held_keys=held_keys
+        )
+        updated_assignment = await update_assignment_in_db(assignment_id=assignment_id, data_update=updated_assignment, collection=collection)
+    finally:
+        # saved images are acquired by assignment now, and not saved ones are deleted, if nobody references them
+        await image_store.release_images(held_keys)
+    return updated_assignment, upload_stats
+
+
+class PendingSave:
 
-    return await db.update_obj(assignment_id, data_update, collection, model_dump_kwargs={'exclude_none': True})
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.save: Callable[[], Awaitable[Any]] | None = None
+        self.timer: asyncio.Task | None = None
+
+
+class SaveCoalescer:
+    """
+    Write-behind buffer of saves per document: during window only the latest state is kept,
+    and it's written once, when window is over. Every caller waits for that write and gets its result,
+    so response to save still means, that data is in db.
+    Buffer is per worker process, so saves of one document that came to different workers aren't coalesced.
+    """
+
+    def __init__(self, window_sec: float = settings.app_save_coalesce_window_sec):
+        self.window_sec = window_sec
+        self._pending: dict[str, PendingSave] = {}
+        # only one write of document at once, so older state can't overwrite newer one.
+        # Lock is kept, while anybody holds or waits for it (see _write_lock), so every caller gets the same lock
+        self._write_locks: dict[str, asyncio.Lock] = {}
+        self._write_lock_users: Counter = Counter()
+
+    @asynccontextmanager
+    async def _write_lock(self, key: str):
+        lock = self._write_locks.get(key)
+        if lock is None:
+            lock = self._write_locks[key] = asyncio.Lock()
+        self._write_lock_users[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._write_lock_users[key] -= 1
+            if not self._write_lock_users[key]:
+                del self._write_lock_users[key]
+                del self._write_locks[key]
+
+    async def save(self, key: str, save: Callable[[], Awaitable[Any]]) -> Any:
+        """:param save: write of the latest state, called once per window"""
+
+        metrics.inc("saves_requested")
+        if self.window_sec <= 0:
+            metrics.inc("saves_flushed")
+            return await save()
+
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = PendingSave(asyncio.get_running_loop().create_future())
+            pending.timer = asyncio.create_task(self._flush_later(key))
+        else:
+            metrics.inc("saves_absorbed")
+        pending.save = save
+
+        return await asyncio.shield(pending.future)
+
+    async def _flush_later(self, key: str):
+        await asyncio.sleep(self.window_sec)
+        await self.flush(key, from_timer=True)
+
+    async def flush(self, key: str, from_timer: bool = False) -> bool:
+        """
+        Writes pending state of document right now (e.g. before fork or delete).
+        Write, that is already in progress (e.g. started by timer), is waited for too, so db has the latest state after that
+        :return: whether document had pending state or write in progress
+        """
+
+        pending = self._pending.pop(key, None)
+        in_progress = key in self._write_locks
+        if pending is None and not in_progress:
+            return False
+        if pending is not None and not from_timer:
+            pending.timer.cancel()
+
+        if pending is None:
+            async with self._write_lock(key):
+                return True
+
+        # pending state is taken out of buffer, so its callers get result here, whatever happens to this task
+        try:
+            async with self._write_lock(key):
+                metrics.inc("saves_flushed")
+                result = await pending.save()
+        except asyncio.CancelledError:
+            # e.g. request, that has flushed inline, is cancelled: write is interrupted, callers shouldn't wait forever
+            pending.future.set_exception(HTTPException(status_code=503, detail=f"Save of {key} was interrupted, try again"))
+            raise
+        except BaseException as e:
+            pending.future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+        else:
+            pending.future.set_result(result)
+        return True
+
+    async def flush_many(self, keys: Iterable[str]) -> int:
+        """:return: number of documents, that had pending state or write in progress"""
+
+        return sum(await asyncio.gather(*(self.flush(key) for key in set(keys))))
+
+    async def flush_all(self):
+        """Writes all pending states, on shutdown"""
+        await self.flush_many([*self._pending, *self._write_locks])
+
+
+save_coalescer = SaveCoalescer()
 
 
 async def duplicate_assignment(assignment_id: str, collection: AsyncIOMotorCollection, use_new_schema: bool = True) -> str:
 
+    # fork is made from the latest state of document
+    await save_coalescer.flush(assignment_id)
+
     # pre-create empty assignment, to know id already
     res = await db.create_obj({}, collection)
     new_assignment_id = res['_id']
 
-    assignment_data = await get_assignment_data_with_images(assignment_id=assignment_id, collection=collection, rename_mongo_id=True)
+    # images are not downloaded: new version just references the same images in store
+    assignment_data = await get_assignment_data(assignment_id=assignment_id, collection=collection, rename_mongo_id=True)
 
     # on creation, we can either use schema of base assignment, or get most actual one
     if use_new_schema:
-        assignment_ui_schema, assignment_ui_schema_hash, events_mapper = await get_actual_model_schema_data()
-        assignment_data['assignment_ui_schema'] = assignment_ui_schema
-        assignment_data['assignment_ui_schema_hash'] = assignment_ui_schema_hash
-        assignment_data['events_mapper'] = events_mapper
+        snapshot = await get_schema_snapshot_async()
+        await store_snapshot(snapshot)
+        assignment_data['assignment_ui_schema'] = None
+        assignment_data['assignment_ui_schema_hash'] = snapshot.assignment_ui_schema_hash
+        assignment_data['events_mapper'] = None
+        assignment_data['events_mapper_hash'] = snapshot.events_mapper_hash
         # create from model, to get all changed fields
         assignment_data = AssignmentWithFullSchema(**assignment_data).model_dump()
+        # paths of images can be changed with schema, so manifest is rebuilt (sizes are kept)
+        assignment_data['image_manifest'] = await fill_image_manifest_sizes(
+            build_image_manifest(assignment_data), known_manifest=assignment_data.get('image_manifest')
+        )
 
     _, latest_version = await db.max_value_in_group(
         group_field='group_id', group_val=assignment_data['group_id'], find_max_in_field='version', collection=collection
@@ -225,11 +716,25 @@ async def duplicate_assignment(assignment_id: str, collection: AsyncIOMotorColle
     assignment_data['created_at'] = dt.datetime.now().isoformat()
     assignment_data['updated_at'] = dt.datetime.now().isoformat()
 
-    # we need to resave all images data to new assignment_id prefix
-    assignment_data = await upload_images_from_assignment_to_s3_with_clean(assignment_data=assignment_data, assignment_id=new_assignment_id)
+    # new version keeps only hashes of schema, even if base assignment has it embedded
+    assignment_data = await move_schema_to_store(assignment_data)
+
+    # legacy images (in folder of base assignment) are copied to store, because folder is deleted with base assignment.
+    # Copies are held, until new version acquires them
+    held_keys = []
+    try:
+        assignment_data = await copy_images_to_store(assignment_data, held_keys=held_keys)
+        await image_store.acquire_images(get_store_image_keys(assignment_data))
+    finally:
+        await image_store.release_images(held_keys)
 
     # updating data
-    result = await db.update_obj(new_assignment_id, assignment_data, collection)
+    for size_field in ('size_doc', 'size_total'):
+        assignment_data.pop(size_field, None)
+    result = await db.update_obj_with_pipeline(
+        new_assignment_id, assignment_data, collection, stages=[sizes.get_size_stage(sizes.get_images_size(assignment_data['image_manifest']))]
+    )
+    await groups.recompute_group(assignment_data['group_id'], collection)
 
     return str(result['_id'])
 
@@ -279,31 +784,23 @@ def group_assignments_data(assignments: Collection[dict[str, Any]], group_by: st
 
 async def get_actual_model_schema_data() -> tuple[str, str, str]:
     """
-    Updating all json descriptions (because it's base for Json Form creation) with most actual data
-    Getting Schema and Events mapper (both in json string) to pass it to Front
+    Schema (with hash) and Events mapper (both in json string) to pass it to Front.
+    Taken from snapshot, that is rebuilt only when events mapper config is changed
     """
-    model_class = AssignmentInUI
-
-    Event.update_json_schema_for_field('event_type', {"enum": list((await EventsMapper.from_yaml()).dump().keys())})
-    model_class.update_json_schema_for_field('status', {"enum": [status.value for status in Status]})
-
-    assignment_ui_schema = model_class.dump_schema(return_str=True)
-    assignment_ui_schema_hash = get_hash(assignment_ui_schema)
-    events_mapper = (await EventsMapper.from_yaml()).dump(return_str=True)
-
-    return assignment_ui_schema, assignment_ui_schema_hash, events_mapper
+    snapshot = await get_schema_snapshot_async()
+    return snapshot.assignment_ui_schema, snapshot.assignment_ui_schema_hash, snapshot.events_mapper
 
 
 async def create_new_assignment(assignment_model_class: Type[BaseModel] = AssignmentWithFullSchema) -> BaseModel:
 
     # we always get the newest configs on creation!
-    # it's json form schema for UI, so we create schema from it (without unwanted fields (assignment_ui_schema and events_mapper)
-    assignment_ui_schema, assignment_ui_schema_hash, events_mapper = await get_actual_model_schema_data()
+    # schema and events mapper are in schema store, assignment keeps only their hashes
+    snapshot = await get_schema_snapshot_async()
+    await store_snapshot(snapshot)
 
     assignment = assignment_model_class(
-        assignment_ui_schema=assignment_ui_schema,
-        assignment_ui_schema_hash=assignment_ui_schema_hash,
-        events_mapper=events_mapper,
+        assignment_ui_schema_hash=snapshot.assignment_ui_schema_hash,
+        events_mapper_hash=snapshot.events_mapper_hash,
         group_id=uuid.uuid4().hex,  # created only on creation of new assignment (not on copying!)
         name=f'Новое ТЗ от {dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}',
         status=Status.design.value,
@@ -327,8 +824,18 @@ async def create_new_assignment(assignment_model_class: Type[BaseModel] = Assign
 
 async def del_assignment_with_images(assignment_id: str, collection: AsyncIOMotorCollection, bucket_name=settings.s3_images_bucket) -> Tuple[int, int]:
 
+    # pending save would reference images after they are released
+    await save_coalescer.flush(assignment_id)
+    image_keys = get_manifest_store_keys(await get_stored_image_manifest(assignment_id, collection))
+    assignment = await db.get_obj_by_fields({"_id": assignment_id}, collection, filter_cols=('group_id', ))
     deleted_assignment_amount = await db.delete_obj(assignment_id, collection)
-    deleted_assignment_images = await s3.delete_folder(bucket_name=bucket_name, prefix=assignment_id)
+    if not deleted_assignment_amount:
+        return deleted_assignment_amount, 0
+    await groups.recompute_group(assignment and assignment.get('group_id'), collection)
+
+    deleted_assignment_images = await image_store.release_images(image_keys, bucket_name=bucket_name)
+    deleted_assignment_images += await s3.delete_folder(bucket_name=bucket_name, prefix=assignment_id)
+    known_image_uris.clear()
 
     return deleted_assignment_amount, deleted_assignment_images
 
@@ -337,9 +844,22 @@ async def del_group_of_assignments_with_images(
         group_id: str, collection: AsyncIOMotorCollection, bucket_name=settings.s3_images_bucket
 ) -> Tuple[Union[int, None], Union[int,None]]:
 
-    assignments = await db.get_obj_by_fields({"group_id": group_id}, collection, filter_cols=('_id',), find_many=True)
+    assignments = await db.get_obj_by_fields({"group_id": group_id}, collection, filter_cols=('_id', 'image_manifest'), find_many=True)
+    # pending saves would reference images after they are released, and they change manifests
+    if await save_coalescer.flush_many([assignment['_id'] for assignment in assignments]):
+        assignments = await db.get_obj_by_fields({"group_id": group_id}, collection, filter_cols=('_id', 'image_manifest'), find_many=True)
+
+    image_keys = []
+    for assignment in assignments:
+        manifest = assignment.get('image_manifest')
+        if manifest is None:
+            manifest = await get_stored_image_manifest(assignment['_id'], collection)
+        image_keys.extend(get_manifest_store_keys(manifest))  # every version holds its own reference on image
+
     num_deleted_docs = await db.delete_by_filter({"group_id": group_id}, collection)
-    deleted_images = [await s3.delete_folder(bucket_name=settings.s3_images_bucket, prefix=assignment['_id']) for assignment in assignments]
-    deleted_images_num = sum(deleted_images) if deleted_images else 0
+    await groups.delete_group(group_id)
+    deleted_images_num = await image_store.release_images(image_keys, bucket_name=bucket_name)
+    deleted_images_num += await s3.delete_folders(bucket_name=bucket_name, prefixes=[assignment['_id'] for assignment in assignments])
+    known_image_uris.clear()
 
     return num_deleted_docs, deleted_images_num
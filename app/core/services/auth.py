@@ -1,5 +1,9 @@
-from typing import Optional
+from typing import Optional, Hashable
+import time
+import asyncio
 import datetime as dt
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from passlib.context import CryptContext
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
@@ -9,6 +13,8 @@ import jwt
 from app.settings import settings
 from app.core.models.user import User, UserInDB, Role
 import app.core.services.database as db
+from app.core.services.cache import LRUCache, TTLCache
+from app.core.services.metrics import metrics
 from app.logger import logger
 
 
@@ -19,26 +25,130 @@ SECRET_KEY = settings.app_jwt_secret_key
 ALGORITHM = settings.app_jwt_algorithm
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt is slow by design (and releases GIL), so it's run in threads, not to block event loop.
+# Size of pool bounds CPU, that can be taken by logins, other calls wait in queue of pool
+password_hashing_executor = ThreadPoolExecutor(
+    max_workers=settings.app_password_hashing_concurrency, thread_name_prefix='password_hashing'
+)
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def verify_password(plain_password, hashed_password) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hashing_executor, pwd_context.verify, plain_password, hashed_password)
 
 
-async def get_user(username: str) -> UserInDB | None:
+async def get_password_hash(password) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_hashing_executor, pwd_context.hash, password)
+
+
+class LoginAttemptLimiter:
+    """
+    Failed login attempts per key (username and client ip) in sliding window.
+    Key with max_attempts failures is blocked, until the oldest of them leaves window, so password isn't even checked.
+    In-process: every worker counts its own attempts.
+    """
+
+    def __init__(self, max_attempts: int, window_sec: float, maxsize: int = 10000, clock=time.monotonic):
+        self.max_attempts = max_attempts
+        self.window_sec = window_sec
+        self.clock = clock
+        self._failures = LRUCache(maxsize)  # key -> deque of times of failures
+
+    def get_retry_after(self, key: Hashable) -> float:
+        """Seconds until the next attempt is allowed (0, if it's allowed now)"""
+
+        failures = self._failures.get(key)
+        if not failures:
+            return 0
+        now = self.clock()
+        while failures and failures[0] <= now - self.window_sec:
+            failures.popleft()
+        if len(failures) < self.max_attempts:
+            return 0
+        return failures[0] + self.window_sec - now
+
+    def register_failure(self, key: Hashable):
+        failures = self._failures.get(key)
+        if failures is None:
+            failures = deque(maxlen=self.max_attempts)
+            self._failures.set(key, failures)
+        failures.append(self.clock())
+
+    def reset(self, key: Hashable):
+        self._failures.pop(key)
+
+
+login_limiter = LoginAttemptLimiter(
+    max_attempts=settings.app_login_max_failed_attempts, window_sec=settings.app_login_attempts_window_sec
+)
+
+
+# username -> UserInDB. User is read on every authenticated request, so it's cached.
+# Changes are seen by this worker at once (see invalidate_user), and by other workers after users version check
+cached_users = TTLCache(settings.app_users_cache_size, ttl_sec=settings.app_users_cache_ttl_sec)
+
+USERS_VERSION_ID = 'users_version'
+_users_version: int | None = None
+_users_version_checked_at: float = float('-inf')
+
+
+async def get_meta_collection():
+    return await db.get_collection(collection_name=settings.app_meta_collection)
+
+
+async def check_users_version():
+    """
+    Cached users are dropped, if users were changed (by any worker) since the last check.
+    Version stamp is read not more often, than once in settings.app_users_version_check_sec
+    """
+
+    global _users_version, _users_version_checked_at
+
+    now = time.monotonic()
+    if now - _users_version_checked_at < settings.app_users_version_check_sec:
+        return
+    _users_version_checked_at = now
+
+    meta_collection = await get_meta_collection()
+    stamp = await meta_collection.find_one({"_id": USERS_VERSION_ID})
+    version = stamp["version"] if stamp else 0
+    if version != _users_version:
+        cached_users.clear()
+        _users_version = version
+
+
+async def invalidate_user(username: str):
+    """Should be called after user is changed or deleted"""
+
+    cached_users.pop(username)
+    meta_collection = await get_meta_collection()
+    await meta_collection.update_one({"_id": USERS_VERSION_ID}, {"$inc": {"version": 1}}, upsert=True)
+
+
+async def get_user(username: str, use_cache: bool = True) -> UserInDB | None:
+
+    if use_cache:
+        await check_users_version()
+        user = cached_users.get(username)
+        if user is not None:
+            return user
+
+    metrics.inc('user_lookups')
     collection = await db.get_collection(collection_name=settings.app_users_collection)
     user_data = await db.get_obj_by_fields({'username': username}, collection)
     if user_data:
-        return UserInDB(**user_data)
+        user = UserInDB(**user_data)
+        cached_users.set(username, user)
+        return user
     else:
         return None
 
 
 async def authenticate_user(username: str, password: str) -> UserInDB | None:
-    user = await get_user(username)
-    if user and verify_password(password, user.hashed_password):
+    # password is always checked against stored hash
+    user = await get_user(username, use_cache=False)
+    if user and await verify_password(password, user.hashed_password):
         return user
     return None
 
@@ -61,7 +171,19 @@ def create_access_token(data: dict, expires_delta: int = 900):
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+_unresolved = object()
+
+
 async def get_current_user(request: Request) -> UserInDB | None:
+    # resolved once per request (it's needed again by exception handlers)
+    current_user = getattr(request.state, 'current_user', _unresolved)
+    if current_user is _unresolved:
+        current_user = await resolve_current_user(request)
+        request.state.current_user = current_user
+    return current_user
+
+
+async def resolve_current_user(request: Request) -> UserInDB | None:
     token = request.cookies.get("access_token")
     if not token:
         return None
@@ -100,7 +222,7 @@ async def initialize_user(
 
     existing_admin = await db.get_obj_by_fields({"role": Role.admin.value}, collection)
     if not existing_admin:
-        admin = User(username=username, hashed_password=get_password_hash(password), role=role)
+        admin = User(username=username, hashed_password=await get_password_hash(password), role=role)
         await db.create_obj(admin.model_dump(), collection)
         logger.debug("Admin user created successfully.")
     else:
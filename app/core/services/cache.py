@@ -0,0 +1,75 @@
+from typing import Any, Hashable, Callable
+from collections import OrderedDict
+import time
+
+
+class LRUCache:
+    """
+    Simple in-process cache with size bound: least recently used items are dropped first.
+    Not shared between workers, so should be used only for data that can't go stale
+    (content addressed) or together with explicit invalidation.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key: Hashable, value: Any = True):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_missing = object()
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache, which items expire after ttl_sec since they were set.
+    For data, that can be changed by other workers: ttl bounds how long stale item can be seen.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl_sec: float = 60, clock: Callable[[], float] = time.monotonic):
+        super().__init__(maxsize)
+        self.ttl_sec = ttl_sec
+        self.clock = clock
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = super().get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at <= self.clock():
+            self.pop(key)
+            return default
+        return value
+
+    def set(self, key: Hashable, value: Any = True):
+        super().set(key, (self.clock() + self.ttl_sec, value))
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = super().pop(key)
+        return default if item is None else item[1]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _missing) is not _missing
+
@@ -1,12 +1,42 @@
-from typing import Union, List, Tuple
+from typing import Union, List, Tuple, Collection
 import pydantic
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection, AsyncIOMotorDatabase
 from bson import ObjectId
+from pymongo import ReturnDocument
 from app.settings import settings
 
 
+# one pooled client per uri for the whole worker process, opened in app lifespan
+_clients: dict[str, AsyncIOMotorClient] = {}
+
+
+def connect_client(uri: str = settings.mongo_uri) -> AsyncIOMotorClient:
+    """
+    Create (or return already created) pooled client for uri.
+    Client is safe to share between requests: it holds connection pool inside
+    """
+    client = _clients.get(uri)
+    if client is None:
+        client = AsyncIOMotorClient(
+            uri,
+            maxPoolSize=settings.mongo_max_pool_size,
+            minPoolSize=settings.mongo_min_pool_size,
+            maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+            serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+        )
+        _clients[uri] = client
+    return client
+
+
+def close_clients():
+    """Close all pooled clients, on app shutdown"""
+    while _clients:
+        _, client = _clients.popitem()
+        client.close()
+
+
 async def get_db(db_name: str = settings.mongo_initdb_database, uri: str = settings.mongo_uri) -> AsyncIOMotorDatabase:
-    client = AsyncIOMotorClient(uri)
+    client = connect_client(uri)
     return client[db_name]
 
 
@@ -83,6 +113,42 @@ async def update_obj(
     return None
 
 
+async def update_obj_with_pipeline(
+        obj_id: str, obj: dict, collection: AsyncIOMotorCollection, stages: List[dict], returned_fields: Collection[str] = (),
+        conditions: dict = None
+) -> dict | None:
+    """
+    Same as update_obj, but as update pipeline: stages (e.g. with fields computed by mongo from stored document)
+    are applied after obj is set
+    :param returned_fields: fields computed by stages, that are read from updated document to returned obj
+    :param conditions: additional filter of document (e.g. its version), None is returned, if it isn't matched
+    """
+
+    # never pass id in updates
+    if obj.get("_id"):
+        del obj["_id"]
+
+    # literals: strings starting with $ aren't field paths, and embedded documents aren't merged
+    set_stage = {"$set": {field: {"$literal": value} for field, value in obj.items()}}
+
+    obj_filter = {"_id": ObjectId(obj_id), **(conditions or {})}
+    if returned_fields:
+        updated = await collection.find_one_and_update(
+            obj_filter, [set_stage, *stages], projection=list(returned_fields), return_document=ReturnDocument.AFTER
+        )
+        if updated is None:
+            return None
+        obj.update({field: updated.get(field) for field in returned_fields})
+        obj["_id"] = obj_id
+        return obj
+
+    result = await collection.update_one(obj_filter, [set_stage, *stages])
+    if result.matched_count > 0:
+        obj["_id"] = obj_id
+        return obj
+    return None
+
+
 async def delete_obj(obj_id: str, collection: AsyncIOMotorCollection) -> int | None:
     result = await collection.delete_one({"_id": ObjectId(obj_id)})
     return result.deleted_count if result.deleted_count > 0 else None
@@ -0,0 +1,103 @@
+"""
+Executors for CPU-heavy work, that shouldn't be done on event loop (every request of worker waits, while loop is busy):
+- thread pool: for operations, that release GIL (hashlib over big buffers), or are split into chunks,
+  so GIL is passed to loop between them (see b64decode, b64encode);
+- process pool (optional, settings.app_offload_process_workers > 0): for pure python operations, that hold GIL
+  all the time (e.g. schema generation). Args and result are pickled, so it's only for small inputs and outputs.
+
+Small inputs (size below settings.app_offload_min_size) are processed inline: handoff to pool costs more, than work itself.
+Time of every call is observed in metrics: loop_busy_sec:{name} (inline, loop was blocked), offload_sec:{name} (in pool).
+"""
+
+from typing import Callable, Any
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+import asyncio
+import base64
+import time
+
+from app.core.services.metrics import metrics
+from app.settings import settings
+
+
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=settings.app_offload_thread_workers, thread_name_prefix='offload')
+    return _thread_pool
+
+
+def get_process_pool() -> Executor:
+    """Process pool, or thread pool, if process pool is disabled"""
+    global _process_pool
+    if settings.app_offload_process_workers <= 0:
+        return get_thread_pool()
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=settings.app_offload_process_workers)
+    return _process_pool
+
+
+def shutdown_executors():
+    """On app shutdown"""
+    global _thread_pool, _process_pool
+    for pool in (_thread_pool, _process_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _thread_pool, _process_pool = None, None
+
+
+async def offload(name: str, func: Callable, *args: Any, size: int | None = None, cpu_bound: bool = False) -> Any:
+    """
+    func(*args) in pool, or inline, if size of input is known and it's small
+    :param name: name of operation in metrics
+    :param cpu_bound: func holds GIL, so it's run in process pool (if it's enabled)
+    """
+
+    start = time.perf_counter()
+    if size is not None and size < settings.app_offload_min_size:
+        result = func(*args)
+        metrics.observe(f"loop_busy_sec:{name}", time.perf_counter() - start)
+        return result
+
+    pool = get_process_pool() if cpu_bound else get_thread_pool()
+    result = await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    metrics.observe(f"offload_sec:{name}", time.perf_counter() - start)
+    return result
+
+
+# multiples of 4 (base64 quantum) and 3 (bytes per quantum), so chunks are encoded and decoded independently
+B64_CHUNK_CHARS = 4 * 256 * 1024
+B64_CHUNK_BYTES = 3 * 256 * 1024
+
+
+B64_ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+B64_NOT_ALPHABET = bytes(set(range(256)) - set(B64_ALPHABET))
+
+
+def b64decode(data: str | bytes) -> bytes:
+    """
+    base64.b64decode by chunks: binascii holds GIL for the whole call, so other threads run between chunks.
+    Characters out of alphabet (e.g. line breaks of wrapped base64) are discarded first, as b64decode does,
+    so chunks stay aligned to quantum. Input, that still isn't aligned, or has padding inside, is decoded at once
+    """
+    if len(data) <= B64_CHUNK_CHARS:
+        return base64.b64decode(data)
+    if isinstance(data, str):
+        try:
+            data = data.encode('ascii')
+        except UnicodeEncodeError:
+            return base64.b64decode(data)  # ValueError, as for b64decode
+    data = data.translate(None, B64_NOT_ALPHABET)
+    if len(data) % 4 or b'=' in data[:-2]:
+        return base64.b64decode(data)
+    return b''.join(base64.b64decode(data[i:i + B64_CHUNK_CHARS]) for i in range(0, len(data), B64_CHUNK_CHARS))
+
+
+def b64encode(data: bytes) -> str:
+    """base64.b64encode by chunks, see b64decode"""
+    if len(data) <= B64_CHUNK_BYTES:
+        return base64.b64encode(data).decode('utf-8')
+    return ''.join(base64.b64encode(data[i:i + B64_CHUNK_BYTES]).decode('utf-8') for i in range(0, len(data), B64_CHUNK_BYTES))
@@ -0,0 +1,133 @@
+"""
+Materialized summaries of groups of versions: collection settings.app_groups_collection keeps one small document per group
+{_id: group_id, group_name, latest_id, latest_version, latest_published_id, latest_published_version, count, last_update},
+so list and group view don't aggregate all versions on every request.
+
+Summary is never changed incrementally: after every write to assignments, summary of touched group is recomputed
+from its versions (one indexed query by group_id), so recompute is idempotent and safe to repeat.
+Recomputes of concurrent writes can finish in any order, so summary keeps server time of its read (recomputed_at),
+and it's replaced only by summary, that was read later. Deletion of group isn't ordered this way:
+recompute, that has read versions before the last one was deleted, can save summary of deleted group again.
+Mongo runs as standalone server (no replica set, so no multi-document transactions): if app fails between writes,
+or in case above, summary can be stale until the next write to the group, or rebuild_groups (see /service/groups/rebuild).
+"""
+
+from typing import List
+from pymongo import ReplaceOne
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+import app.core.services.database as db
+from app.core.models.assignment import Status
+from app.settings import settings
+from app.logger import logger
+
+
+# versions of group should be sorted by version descending before that stage, so $first is the latest version
+GROUP_STAGE = {"$group": {
+    "_id": "$group_id",
+    "group_name": {"$first": "$name"},
+    "latest_id": {"$first": "$_id"},
+    "latest_version": {"$first": "$version"},
+    "count": {"$sum": 1},
+    "last_update": {"$max": "$updated_at"},
+    # documents are compared field by field, so it's the max version (nulls are ignored)
+    "latest_published": {"$max": {"$cond": [
+        {"$ne": ["$status", Status.design.value]}, {"version": "$version", "id": "$_id"}, None
+    ]}},
+}}
+
+SUMMARY_STAGES = [
+    GROUP_STAGE,
+    {"$set": {"latest_published_id": "$latest_published.id", "latest_published_version": "$latest_published.version"}},
+    {"$unset": "latest_published"},
+]
+# server time of aggregation start: versions, saved before it, are in summary
+RECOMPUTED_AT_STAGE = {"$set": {"recomputed_at": "$$NOW"}}
+
+
+def get_summary_pipeline(query: dict) -> List[dict]:
+    return [{"$match": query}, {"$sort": {"group_id": 1, "version": -1}}, *SUMMARY_STAGES]
+
+
+async def get_groups_collection() -> AsyncIOMotorCollection:
+    return await db.get_collection(collection_name=settings.app_groups_collection)
+
+
+async def recompute_group(group_id: str | None, collection: AsyncIOMotorCollection) -> dict | None:
+    """
+    Summary of group is recomputed from its versions in collection, and saved (or deleted, if group has no versions)
+    :return: summary
+    """
+
+    if not group_id:
+        return None
+
+    groups_collection = await get_groups_collection()
+    summaries = await collection.aggregate([*get_summary_pipeline({"group_id": group_id}), RECOMPUTED_AT_STAGE]).to_list(length=1)
+    if not summaries:
+        await groups_collection.delete_one({"_id": group_id})
+        return None
+
+    summary = summaries[0]
+    try:
+        # summary without recomputed_at was saved before it appeared
+        await groups_collection.replace_one(
+            {"_id": group_id, "recomputed_at": {"$not": {"$gt": summary["recomputed_at"]}}}, summary, upsert=True
+        )
+    except DuplicateKeyError:
+        # summary, that was read later, is saved already
+        pass
+    return summary
+
+
+async def get_group(group_id: str, collection: AsyncIOMotorCollection) -> dict | None:
+    """Summary of group. Group, that isn't in groups collection yet (e.g. created before it), is recomputed"""
+
+    groups_collection = await get_groups_collection()
+    summary = await groups_collection.find_one({"_id": group_id})
+    if summary is None:
+        summary = await recompute_group(group_id, collection)
+    return summary
+
+
+async def delete_group(group_id: str):
+    groups_collection = await get_groups_collection()
+    await groups_collection.delete_one({"_id": group_id})
+
+
+async def rebuild_groups(collection: AsyncIOMotorCollection, batch_size: int = 500) -> int:
+    """
+    Consistency repair: summaries of all groups are recomputed from assignments, summaries of deleted groups are removed
+    :return: number of groups
+    """
+
+    groups_collection = await get_groups_collection()
+
+    group_ids = []
+    requests = []
+    # version, pre-created on fork, has no group yet
+    async for summary in collection.aggregate(
+            [*get_summary_pipeline({"group_id": {"$type": "string"}}), RECOMPUTED_AT_STAGE], allowDiskUse=True
+    ):
+        group_ids.append(summary["_id"])
+        requests.append(ReplaceOne({"_id": summary["_id"]}, summary, upsert=True))
+        if len(requests) >= batch_size:
+            await groups_collection.bulk_write(requests, ordered=False)
+            requests = []
+
+    if requests:
+        await groups_collection.bulk_write(requests, ordered=False)
+    deleted = await groups_collection.delete_many({"_id": {"$nin": group_ids}})
+
+    logger.info(f"Summaries of {len(group_ids)} groups are rebuilt, {deleted.deleted_count} stale ones are deleted")
+    return len(group_ids)
+
+
+async def rebuild_groups_if_empty(collection: AsyncIOMotorCollection) -> int:
+    """First start with groups collection: it's filled from existing assignments"""
+
+    groups_collection = await get_groups_collection()
+    if await groups_collection.find_one({}, {"_id": 1}) or not await collection.find_one({}, {"_id": 1}):
+        return 0
+    return await rebuild_groups(collection)
@@ -0,0 +1,143 @@
+"""
+Garbage collector of images bucket.
+
+Object is orphaned, if no assignment references its key (neither in image_manifest nor in blocks of documents without it).
+Such objects appear, when image was uploaded but assignment wasn't saved, or legacy image (not counted in store)
+was replaced or removed. They are deleted, if they are older than grace period (so uploads of save in progress are kept),
+and their counter in store doesn't hold them.
+
+Scheduled GC is started in lifespan of every worker, but runs in one of them: worker, that holds lease
+(document in settings.app_meta_collection, that expires after interval, unless its owner renews it).
+"""
+
+from typing import List, Set
+import asyncio
+import datetime as dt
+import os
+import socket
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import DuplicateKeyError
+
+import app.core.services.database as db
+import app.core.services.s3 as s3
+import app.core.services.image_store as image_store
+from app.core.services.assignment import build_image_manifest, known_image_uris
+from app.settings import settings
+from app.logger import logger
+
+
+GC_LEASE_ID = 'images_gc_lease'
+# worker process, that runs scheduled GC
+LEASE_OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def get_referenced_keys(collection: AsyncIOMotorCollection) -> Set[str]:
+    """Keys of all images, referenced by any assignment (store and legacy ones)"""
+
+    keys = set()
+    async for assignment_data in collection.find({"image_manifest": {"$ne": None}}, {"image_manifest.key": 1}):
+        keys.update(entry['key'] for entry in assignment_data['image_manifest'])
+
+    # documents saved before manifest appeared
+    async for assignment_data in collection.find({"image_manifest": None}, {"blocks": 1}):
+        keys.update(entry['key'] for entry in build_image_manifest(assignment_data))
+
+    return keys
+
+
+async def get_held_keys() -> Set[str]:
+    """Keys, that store counter still holds (refcount > 0)"""
+
+    images_collection = await image_store.get_images_collection()
+    return {image["_id"] async for image in images_collection.find({"refcount": {"$gt": 0}}, {"_id": 1})}
+
+
+def get_orphaned_objects(page: List[dict], referenced_keys: Set[str], held_keys: Set[str], older_than: dt.datetime) -> List[dict]:
+    """Objects of listing page, that can be deleted"""
+
+    return [
+        obj for obj in page
+        if obj['Key'] not in referenced_keys and obj['Key'] not in held_keys and obj['LastModified'] < older_than
+    ]
+
+
+async def collect_orphaned_images(
+        collection: AsyncIOMotorCollection,
+        bucket_name: str = settings.s3_images_bucket,
+        grace_period_sec: int = settings.app_images_gc_grace_period_sec,
+        dry_run: bool = False,
+) -> dict:
+    """
+    Streams bucket listing and deletes orphaned objects page by page.
+    :return: {"scanned": objects in bucket, "deleted": deleted objects, "reclaimed_bytes": their size}
+    """
+
+    # objects uploaded after this moment can belong to save in progress
+    older_than = dt.datetime.now(dt.timezone.utc) - dt.timedelta(seconds=grace_period_sec)
+    referenced_keys = await get_referenced_keys(collection)
+    held_keys = await get_held_keys()
+
+    report = {"scanned": 0, "deleted": 0, "reclaimed_bytes": 0}
+
+    async for page in s3.iter_files_pages(bucket_name=bucket_name):
+        report["scanned"] += len(page)
+        orphaned_objects = get_orphaned_objects(page, referenced_keys, held_keys, older_than=older_than)
+        if not orphaned_objects:
+            continue
+
+        if not dry_run:
+            # keys and counters are captured at start of run, so store keys are deleted only under deleting mark
+            # (save can hold and upload orphaned key again meanwhile). Legacy keys aren't counted or reused
+            legacy_keys = [obj['Key'] for obj in orphaned_objects if not image_store.is_store_key(obj['Key'])]
+            if legacy_keys:
+                await s3.delete_files(legacy_keys, bucket_name=bucket_name)
+            store_keys = await image_store.delete_unreferenced(
+                [obj['Key'] for obj in orphaned_objects if image_store.is_store_key(obj['Key'])], bucket_name=bucket_name
+            )
+            deleted_keys = {*legacy_keys, *store_keys}
+            orphaned_objects = [obj for obj in orphaned_objects if obj['Key'] in deleted_keys]
+
+        report["deleted"] += len(orphaned_objects)
+        report["reclaimed_bytes"] += sum(obj.get('Size', 0) for obj in orphaned_objects)
+
+    if report["deleted"] and not dry_run:
+        known_image_uris.clear()
+
+    logger.info(f"Images GC{' (dry run)' if dry_run else ''}: {report}")
+    return report
+
+
+async def acquire_gc_lease(lease_sec: int, owner: str = LEASE_OWNER) -> bool:
+    """
+    Take lease for lease_sec, if it's expired or already owned by owner (then it's renewed)
+    :return: lease is taken, so owner runs GC
+    """
+
+    meta_collection = await db.get_collection(collection_name=settings.app_meta_collection)
+    now = dt.datetime.now(dt.timezone.utc)
+    try:
+        await meta_collection.update_one(
+            {"_id": GC_LEASE_ID, "$or": [{"expires_at": {"$lte": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + dt.timedelta(seconds=lease_sec)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # lease document exists, but isn't matched: it's held by other worker
+        return False
+    return True
+
+
+async def run_gc_periodically(interval_sec: int = settings.app_images_gc_interval_sec):
+    """Background task for lifespan. GC runs only in worker, that holds lease. Errors are logged, so next run still happens"""
+
+    while True:
+        await asyncio.sleep(interval_sec)
+        try:
+            if not await acquire_gc_lease(lease_sec=interval_sec):
+                logger.debug("Images GC is skipped: it's run by other worker")
+                continue
+            collection = await db.get_collection(collection_name=settings.app_assignments_collection)
+            await collect_orphaned_images(collection)
+        except Exception as e:
+            logger.error(f"Images GC failed: {e}")
@@ -0,0 +1,214 @@
+"""
+Content addressed image store.
+
+Images are stored once in bucket root as {hash}.ext, and shared between all assignments (and their versions).
+Collection settings.app_images_collection keeps reference counter for every such key:
+{_id: key, refcount: number of assignments, that reference key, size: bytes, created_at, deleting: while object is deleted}
+
+Object is reused only under reference: save holds key (see hold_image) before it decides to skip upload,
+so the object can't be deleted by release of other assignment, until save has acquired it.
+
+Legacy images, that were stored as {assignment_id}/{hash}.ext, are owned by that assignment only,
+aren't counted and deleted together with assignment folder.
+"""
+
+from typing import Iterable, Collection, Set, List
+from collections import Counter
+import asyncio
+import datetime as dt
+import time
+
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+import app.core.services.database as db
+import app.core.services.s3 as s3
+from app.settings import settings
+from app.logger import logger
+
+
+# how long save waits for deletion of object by release, before it uploads the same object again
+DELETION_WAIT_SEC = 10
+DELETION_POLL_SEC = 0.05
+
+
+async def get_images_collection() -> AsyncIOMotorCollection:
+    return await db.get_collection(collection_name=settings.app_images_collection)
+
+
+def get_image_key(s3_uri: str) -> str:
+    """Full object key from s3 uri"""
+    _, prefix, file_key = s3.parse_s3_uri(s3_uri)
+    return f"{prefix}/{file_key}" if prefix else file_key
+
+
+def is_content_addressed(s3_uri: str) -> bool:
+    """Image is in shared store (bucket root), not in legacy folder of assignment"""
+    return is_store_key(get_image_key(s3_uri))
+
+
+def is_store_key(key: str) -> bool:
+    """Key is in shared store (bucket root), not in legacy folder of assignment"""
+    return '/' not in key
+
+
+def get_store_uri(file_name: str, bucket_name: str = settings.s3_images_bucket) -> str:
+    return s3.get_s3_uri(bucket=bucket_name, object_key=file_name)
+
+
+def get_base64_decoded_size(base64_data: str) -> int:
+    """Size in bytes of base64 payload, without decoding it"""
+    return len(base64_data) * 3 // 4 - base64_data[-2:].count('=')
+
+
+async def is_stored(key: str) -> bool:
+    """Object for key is in store and referenced by someone, so it isn't deleted right now"""
+    images_collection = await get_images_collection()
+    return await images_collection.count_documents({"_id": key, "refcount": {"$gt": 0}, "deleting": None}, limit=1) > 0
+
+
+async def hold_image(key: str) -> bool:
+    """
+    +1 reference for key, before object is reused or uploaded by save (release it with release_images after save).
+    If object is being deleted right now, waits for it, so upload after that isn't deleted.
+    :return: object was referenced already, so it's in bucket and upload can be skipped
+    """
+
+    images_collection = await get_images_collection()
+    previous = await images_collection.find_one_and_update(
+        {"_id": key},
+        {"$inc": {"refcount": 1}, "$setOnInsert": {"created_at": dt.datetime.now().isoformat()}},
+        upsert=True, return_document=ReturnDocument.BEFORE
+    )
+    if previous is None:
+        return False
+    if previous.get("deleting") is None:
+        return previous.get("refcount", 0) > 0
+
+    deadline = time.monotonic() + DELETION_WAIT_SEC
+    while time.monotonic() < deadline and await images_collection.count_documents({"_id": key, "deleting": {"$ne": None}}, limit=1):
+        await asyncio.sleep(DELETION_POLL_SEC)
+    return False
+
+
+async def register_image(key: str, size: int = None):
+    """Save info about just uploaded object. It's not referenced until acquire_images"""
+
+    images_collection = await get_images_collection()
+    await images_collection.update_one(
+        {"_id": key},
+        {"$setOnInsert": {"refcount": 0, "created_at": dt.datetime.now().isoformat()}, "$set": {"size": size}},
+        upsert=True
+    )
+
+
+async def get_sizes(keys: Iterable[str]) -> dict[str, int]:
+    """Known sizes in bytes of images in store"""
+
+    images_collection = await get_images_collection()
+    return {
+        image["_id"]: image["size"]
+        async for image in images_collection.find({"_id": {"$in": list(keys)}, "size": {"$ne": None}}, {"size": 1})
+    }
+
+
+async def acquire_images(keys: Iterable[str]):
+    """+1 reference for every key occurrence (pass key once per referencing assignment)"""
+
+    counts = Counter(keys)
+    if not counts:
+        return
+
+    now = dt.datetime.now().isoformat()
+    images_collection = await get_images_collection()
+    await images_collection.bulk_write([
+        UpdateOne({"_id": key}, {"$inc": {"refcount": count}, "$setOnInsert": {"created_at": now}}, upsert=True)
+        for key, count in counts.items()
+    ], ordered=False)
+
+
+async def release_images(keys: Iterable[str], bucket_name: str = settings.s3_images_bucket) -> int:
+    """
+    -1 reference for every key occurrence. Objects, that aren't referenced anymore, are deleted from s3.
+    :return: number of deleted objects
+    """
+
+    counts = Counter(keys)
+    if not counts:
+        return 0
+
+    images_collection = await get_images_collection()
+    await images_collection.bulk_write([
+        UpdateOne({"_id": key}, {"$inc": {"refcount": -count}})
+        for key, count in counts.items()
+    ], ordered=False)
+
+    unreferenced_keys = [
+        image["_id"] async for image in images_collection.find({"_id": {"$in": list(counts)}, "refcount": {"$lte": 0}, "deleting": None}, {"_id": 1})
+    ]
+    deleted_keys = await delete_unreferenced(unreferenced_keys, bucket_name=bucket_name)
+    if deleted_keys:
+        logger.debug(f"Deleted {len(deleted_keys)} unreferenced images from store")
+    return len(deleted_keys)
+
+
+async def mark_deleting(key: str) -> bool:
+    """
+    Mark counter of key (or create marked one, if there is no counter) as deleting, if key isn't referenced
+    :return: key is marked by us, so we delete object
+    """
+
+    images_collection = await get_images_collection()
+    try:
+        await images_collection.update_one(
+            {"_id": key, "refcount": {"$not": {"$gt": 0}}, "deleting": None}, {"$set": {"deleting": dt.datetime.now().isoformat()}}, upsert=True
+        )
+    except DuplicateKeyError:
+        # counter isn't matched: key is referenced, or is being deleted by someone else
+        return False
+    return True
+
+
+async def delete_unreferenced(keys: Collection[str], bucket_name: str = settings.s3_images_bucket) -> List[str]:
+    """
+    Delete objects of store keys, that aren't referenced.
+    Counter is marked as deleting (only one caller deletes object), object is deleted, and then counter,
+    if nobody has acquired it meanwhile. Otherwise mark is removed: save, that held key, waits for it and uploads again
+    :return: keys of deleted objects
+    """
+
+    marked = await asyncio.gather(*(mark_deleting(key) for key in keys))
+    marked_keys = [key for key, is_marked in zip(keys, marked) if is_marked]
+    if not marked_keys:
+        return []
+
+    images_collection = await get_images_collection()
+    try:
+        await s3.delete_files(marked_keys, bucket_name=bucket_name)
+    finally:
+        # counter created by mark has no refcount
+        await images_collection.delete_many({"_id": {"$in": marked_keys}, "refcount": {"$not": {"$gt": 0}}})
+        await images_collection.update_many({"_id": {"$in": marked_keys}}, {"$unset": {"deleting": ""}})
+    return marked_keys
+
+
+async def copy_to_store(s3_uri: str, held_keys: List[str], size: int = None) -> str:
+    """
+    Copy legacy image (assignment folder) to shared store with server side copy, without downloading.
+    Key in store is held (see hold_image) and added to held_keys, caller releases them after save.
+    :return: uri in store
+    """
+
+    bucket_name, prefix, file_key = s3.parse_s3_uri(s3_uri)
+    store_uri = get_store_uri(file_key, bucket_name=bucket_name)
+    held_keys.append(file_key)
+    if not await hold_image(file_key):
+        await s3.copy_file(src_key=f"{prefix}/{file_key}", dst_key=file_key, bucket_name=bucket_name)
+        await register_image(file_key, size=size)
+    return store_uri
+
+
+def get_keys_diff(old_keys: Collection[str], new_keys: Collection[str]) -> tuple[Set[str], Set[str]]:
+    """:return: keys to acquire, keys to release"""
+    return set(new_keys) - set(old_keys), set(old_keys) - set(new_keys)
@@ -0,0 +1,86 @@
+"""
+Indexes of app collections, created on startup (see lifespan).
+Every index declares query shapes, that it serves, so it's clear, what can be dropped, when query is changed.
+"""
+
+from typing import List
+
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+import app.core.services.database as db
+from app.settings import settings
+from app.logger import logger
+
+
+INDEXES: dict[str, List[tuple[IndexModel, str]]] = {
+    settings.app_assignments_collection: [
+        (
+            IndexModel([("group_id", ASCENDING), ("version", DESCENDING)], name="group_id_version"),
+            "max_value_in_group: {group_id} sort {version: -1} (fork), recompute of group summary: {group_id} sort {version: -1}, "
+            "delete of group: {group_id}",
+        ),
+        (
+            IndexModel([("updated_at", DESCENDING), ("_id", DESCENDING)], name="updated_at_id"),
+            "assignments list api: sort {updated_at: -1, _id: -1}, keyset {updated_at, _id} of cursor",
+        ),
+        (
+            IndexModel([("name", ASCENDING)], name="name"),
+            "assignments list: {name: /^prefix/} (filter by name prefix)",
+        ),
+        (
+            IndexModel([("author", ASCENDING), ("updated_at", DESCENDING)], name="author_updated_at"),
+            "assignments list: {author} sort {updated_at: -1}",
+        ),
+        (
+            IndexModel([("issue", ASCENDING)], name="issue"),
+            "assignments list: {issue}",
+        ),
+        (
+            IndexModel([("status", ASCENDING), ("group_id", ASCENDING), ("version", DESCENDING)], name="status_group_id_version"),
+            "groups list filtered by status (the most common filter): {status} sort {group_id: 1, version: -1} "
+            "in summary pipeline, so it's not a collection scan with in-memory sort",
+        ),
+        (
+            IndexModel([("status", ASCENDING), ("updated_at", DESCENDING)], name="status_updated_at"),
+            "assignments list api: {status} sort {updated_at: -1, _id: -1}",
+        ),
+    ],
+    settings.app_groups_collection: [
+        (
+            IndexModel([("last_update", DESCENDING), ("_id", DESCENDING)], name="last_update_id"),
+            "assignments list without filters: sort {last_update: -1, _id: -1}, keyset {last_update, _id} of cursor",
+        ),
+    ],
+    settings.app_users_collection: [
+        (
+            IndexModel([("username", ASCENDING)], name="username", unique=True),
+            "get_user: {username} on every authenticated request, check of existing user on creation",
+        ),
+        (
+            IndexModel([("role", ASCENDING)], name="role"),
+            "initialize_user: {role}",
+        ),
+    ],
+}
+
+
+async def create_indexes(indexes: dict[str, List[tuple[IndexModel, str]]] = INDEXES, db_name: str = settings.mongo_initdb_database) -> int:
+    """
+    Creates indexes idempotently (existing index with the same spec is no-op).
+    Failed index (e.g. unique index over duplicates) is logged and doesn't stop app start.
+    :return: number of created (or already existing) indexes
+    """
+
+    created = 0
+    for collection_name, collection_indexes in indexes.items():
+        collection = await db.get_collection(db_name=db_name, collection_name=collection_name)
+        for index, serves in collection_indexes:
+            try:
+                await collection.create_indexes([index])
+                created += 1
+                logger.info(f"Index {collection_name}.{index.document['name']} is ready, serves {serves}")
+            except PyMongoError as e:
+                logger.error(f"Index {collection_name}.{index.document['name']} can't be created: {e}")
+
+    return created
@@ -0,0 +1,180 @@
+"""
+Assignments list: filters are pushed down to mongo, and only one page is read, with keyset pagination
+(cursor is sort key of the last item of page, so next page is found by index, not by skipping all previous ones).
+
+List page shows groups of versions: summaries of groups (latest version, count of versions, last update)
+are read from groups collection (see groups), or, when versions are filtered, aggregated by mongo from matched versions.
+Only versions of groups of current page are read.
+"""
+
+from typing import List, Tuple, Any, Collection
+import re
+import json
+import base64
+import binascii
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+from app.core.services.utils import format_date
+from app.core.services.assignment import group_assignments_data
+import app.core.services.groups as groups
+
+
+LIST_COLS = (
+    "group_id", "_id", "name", "status", "issue", "version", "author", "created_at", "updated_at", "size_total", "assignment_ui_schema_hash"
+)
+
+
+def build_assignments_query(status: str = None, author: str = None, issue: str = None, name_prefix: str = None) -> dict:
+    """Mongo query for list filters (empty ones are skipped)"""
+
+    query = {}
+    if status:
+        query["status"] = status
+    if author:
+        query["author"] = author
+    if issue:
+        query["issue"] = issue
+    if name_prefix:
+        # anchored case-sensitive regex is prefix match, it can use index
+        query["name"] = {"$regex": f"^{re.escape(name_prefix)}"}
+    return query
+
+
+def encode_cursor(*values: Any) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int = 2) -> List[str]:
+    """
+    Values of sort key (dates in iso format and ids are strings). Cursor comes from client,
+    so values of other types are rejected: they go to query as is (e.g. {"$ne": null} would be operator)
+    """
+
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(value, str) for value in values):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+    return values
+
+
+def get_keyset_filter(sort_fields: Collection[str], after: Collection[Any]) -> dict:
+    """
+    Items after given sort key, when items are sorted descending by sort_fields, e.g. for (updated_at, _id):
+    updated_at < after[0] or (updated_at == after[0] and _id < after[1])
+    """
+
+    conditions = []
+    equal = {}
+    for field, value in zip(sort_fields, after):
+        conditions.append({**equal, field: {"$lt": value}})
+        equal[field] = value
+    return {"$or": conditions}
+
+
+async def list_assignments(
+        collection: AsyncIOMotorCollection,
+        query: dict,
+        limit: int,
+        cursor: str | None = None,
+        needed_cols: Collection = LIST_COLS,
+) -> Tuple[List[dict], str | None]:
+    """
+    Page of assignments, sorted by (updated_at, _id) descending
+    :return: assignments, cursor of next page (None, if it's the last one)
+    """
+
+    if cursor:
+        updated_at, last_id = decode_cursor(cursor)
+        try:
+            last_id = ObjectId(last_id)
+        except (InvalidId, TypeError):
+            raise HTTPException(status_code=422, detail="Invalid cursor")
+        query = {"$and": [query, get_keyset_filter(("updated_at", "_id"), (updated_at, last_id))]}
+
+    # one more item, to know if there is next page
+    assignments = await collection.find(query, needed_cols).sort([("updated_at", -1), ("_id", -1)]).limit(limit + 1).to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(assignments) > limit:
+        assignments = assignments[:limit]
+        next_cursor = encode_cursor(assignments[-1]["updated_at"], str(assignments[-1]["_id"]))
+
+    for assignment in assignments:
+        assignment["id"] = str(assignment.pop("_id"))
+    return assignments, next_cursor
+
+
+def get_groups_pipeline(query: dict, limit: int, after: Collection[Any] | None = None) -> List[dict]:
+    """Summaries of groups of assignments, matched by query, sorted by (last_update, group_id) descending"""
+
+    pipeline = groups.get_summary_pipeline(query)
+    if after:
+        pipeline.append({"$match": get_keyset_filter(("last_update", "_id"), after)})
+    pipeline += [
+        {"$sort": {"last_update": -1, "_id": -1}},
+        {"$limit": limit + 1},
+    ]
+    return pipeline
+
+
+async def list_assignment_groups(
+        collection: AsyncIOMotorCollection,
+        query: dict,
+        limit: int,
+        cursor: str | None = None,
+        needed_cols: Collection = LIST_COLS,
+        format_date_cols: Collection = ("created_at", "updated_at")
+) -> Tuple[dict, str | None]:
+    """
+    Page of groups: {group_id: {group_name, latest_id, latest_version, count, last_update, assignments}},
+    assignments of group (matched by query) are sorted by updated_at descending
+    :return: groups, cursor of next page (None, if it's the last one)
+    """
+
+    after = decode_cursor(cursor) if cursor else None
+    if query:
+        summaries = await collection.aggregate(get_groups_pipeline(query, limit, after)).to_list(length=limit + 1)
+    else:
+        # all groups: one materialized summary per group
+        groups_collection = await groups.get_groups_collection()
+        summaries = await groups_collection.find(
+            get_keyset_filter(("last_update", "_id"), after) if after else {}, {"recomputed_at": 0}
+        ).sort([("last_update", -1), ("_id", -1)]).limit(limit + 1).to_list(length=limit + 1)
+
+    next_cursor = None
+    if len(summaries) > limit:
+        summaries = summaries[:limit]
+        next_cursor = encode_cursor(summaries[-1]["last_update"], summaries[-1]["_id"])
+
+    if not summaries:
+        return {}, None
+
+    group_ids = [summary["_id"] for summary in summaries]
+    assignments = await collection.find(
+        {**query, "group_id": {"$in": group_ids}}, needed_cols
+    ).sort([("updated_at", -1), ("_id", -1)]).to_list(length=None)
+
+    for assignment in assignments:
+        assignment["id"] = assignment.pop("_id")
+        for col in format_date_cols:
+            if assignment.get(col):
+                assignment[col] = format_date(assignment[col])
+    assignments_by_group = group_assignments_data(assignments, sort_by_desc=())
+
+    page = {}
+    for summary in summaries:
+        group_id = summary.pop("_id")
+        summary["latest_id"] = str(summary["latest_id"])
+        if summary.get("latest_published_id"):
+            summary["latest_published_id"] = str(summary["latest_published_id"])
+        if summary.get("last_update"):
+            summary["last_update"] = format_date(summary["last_update"])
+        summary["assignments"] = assignments_by_group.get(group_id, {}).get("assignments", [])
+        page[group_id] = summary
+    return page, next_cursor
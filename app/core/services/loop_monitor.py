@@ -0,0 +1,116 @@
+"""
+Event loop lag monitor (started in lifespan).
+
+Heartbeat task on loop sleeps for interval and measures, how late it wakes up: that's lag, every request waits the same.
+Sidecar thread checks heartbeat: if loop hasn't beaten for longer than threshold, loop is blocked right now, so stack
+of loop thread (faulthandler-like, from sys._current_frames) shows the blocking code, and context of running task
+shows request (route and request id, see middleware). Stall is logged once, and kept in recent stalls for /service/loop.
+"""
+
+from typing import Any
+from collections import deque
+import asyncio
+import datetime as dt
+import sys
+import threading
+import time
+import traceback
+
+from app.core.services.metrics import metrics
+from app.settings import settings
+from app.logger import logger, request_id_var, route_var
+
+
+# seconds, lag of healthy loop is below a millisecond
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class LoopMonitor:
+
+    def __init__(
+            self,
+            interval_sec: float = settings.app_loop_monitor_interval_sec,
+            threshold_sec: float = settings.app_loop_lag_threshold_sec,
+            stalls_kept: int = settings.app_loop_stalls_kept,
+    ):
+        self.interval_sec = interval_sec
+        self.threshold_sec = threshold_sec
+        self.stalls = deque(maxlen=stalls_kept)
+        self.last_beat = time.monotonic()
+        self._reported_beat: float | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._heartbeat_task: asyncio.Task | None = None
+        self._watcher: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Should be called on loop, that is monitored"""
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self._stopped.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._watcher = threading.Thread(target=self._watch, name='loop_monitor', daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+        if self._watcher:
+            self._watcher.join(timeout=self.interval_sec * 2)
+
+    async def _heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval_sec
+            await asyncio.sleep(self.interval_sec)
+            self.last_beat = time.monotonic()
+            metrics.observe('loop_lag_sec', max(self.last_beat - expected, 0), buckets=LAG_BUCKETS)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval_sec):
+            last_beat = self.last_beat
+            blocked_sec = time.monotonic() - last_beat - self.interval_sec
+            # one report for one stall
+            if blocked_sec > self.threshold_sec and last_beat != self._reported_beat:
+                self._reported_beat = last_beat
+                self.report_stall(blocked_sec)
+
+    def capture_stall(self, blocked_sec: float) -> dict[str, Any]:
+        """Stack of loop thread and request of running task, right now (called from sidecar thread)"""
+
+        frame = sys._current_frames().get(self._loop_thread_id)
+        task = asyncio.current_task(self._loop) if self._loop else None
+        context = task.get_context() if task else None
+
+        return {
+            "detected_at": dt.datetime.now().isoformat(),
+            "blocked_sec": round(blocked_sec, 3),
+            "route": context.get(route_var) if context else None,
+            "request_id": context.get(request_id_var) if context else None,
+            "task": task.get_name() if task else None,
+            "stack": ''.join(traceback.format_stack(frame)) if frame else None,
+        }
+
+    def report_stall(self, blocked_sec: float):
+        stall = self.capture_stall(blocked_sec)
+        self.stalls.append(stall)
+        metrics.inc('loop_stalls')
+        logger.warning(
+            f"Event loop is blocked for {stall['blocked_sec']}s by {stall['route']} (request id {stall['request_id']}, "
+            f"task {stall['task']}), stack of loop thread:\n{stall['stack']}"
+        )
+
+    def snapshot(self) -> dict[str, Any]:
+        lag = metrics.histograms.get('loop_lag_sec')
+        return {
+            "interval_sec": self.interval_sec,
+            "threshold_sec": self.threshold_sec,
+            "lag": lag.snapshot() if lag else None,
+            "stalls": list(self.stalls),
+        }
+
+
+loop_monitor = LoopMonitor()
@@ -0,0 +1,71 @@
+"""
+In-process metrics of worker, exposed on /service/metrics.
+Not shared between workers: every worker reports its own numbers (see pid in snapshot).
+"""
+
+from typing import Any, Sequence
+from collections import Counter
+import bisect
+import os
+import time
+
+
+# seconds, from fast in-memory operations to frozen loop
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Counts of observed values by buckets (upper bounds, the last bucket is +inf), with sum and max"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "buckets": {**{str(bound): count for bound, count in zip(self.buckets, self.counts)}, "inf": self.counts[-1]},
+        }
+
+
+class Metrics:
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.counters: Counter = Counter()
+        self.histograms: dict[str, Histogram] = {}
+
+    def inc(self, name: str, value: int = 1):
+        self.counters[name] += value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram(buckets)
+        histogram.observe(value)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "uptime_sec": round(time.time() - self.started_at, 1),
+            "counters": dict(self.counters),
+            "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,331 @@
+"""
+Incremental save of assignment with JSON Patch (RFC 6902) operations.
+
+Operations are translated to targeted $set/$unset/$push on dotted paths and applied
+with one update_one, conditional on save_counter, that client has seen (so concurrent save is 409, not lost update),
+and on existence of touched paths (so operation on missing path or index out of range is 422, as with document).
+
+Document is read only when it's needed:
+- operation can't be expressed as update operator (remove from array, move, copy, test),
+- operations touch the same paths (mongo can't apply conflicting operators in one update),
+- images are affected (they should be uploaded, counted in store and image_manifest rebuilt).
+Then patch is applied to stored document in memory, and touched subtrees are $set back.
+"""
+
+from typing import List, Tuple, Any
+import copy
+import datetime as dt
+from bson import ObjectId
+
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo.errors import WriteError
+
+import app.core.services.image_store as image_store
+import app.core.services.sizes as sizes
+import app.core.services.groups as groups
+from app.core.services.assignment import (
+    iter_images, build_image_manifest, fill_image_manifest_sizes, get_manifest_store_keys,
+    upload_images_from_assignment_to_s3_with_clean
+)
+from app.core.models.assignment import PatchOperation
+
+
+# managed by server only
+PROTECTED_FIELDS = (
+    '_id', 'id', 'group_id', 'version', 'save_counter', 'author', 'created_at', 'updated_at',
+    'assignment_ui_schema', 'assignment_ui_schema_hash', 'events_mapper', 'events_mapper_hash',
+    'image_manifest', 'size', 'size_doc', 'size_total',
+)
+
+
+def parse_pointer(pointer: str) -> List[str]:
+    """JSON pointer (/blocks/0/name) to tokens (['blocks', '0', 'name'])"""
+
+    if not pointer.startswith('/'):
+        raise HTTPException(status_code=422, detail=f"Invalid JSON pointer {pointer}")
+    return [token.replace('~1', '/').replace('~0', '~') for token in pointer[1:].split('/')]
+
+
+def validate_tokens(tokens: List[str], pointer: str):
+
+    if tokens[0] in PROTECTED_FIELDS:
+        raise HTTPException(status_code=422, detail=f"Field {tokens[0]} can't be changed with patch")
+    for token in tokens:
+        # mongo can't address such fields with dotted path
+        if not token or '.' in token or token.startswith('$'):
+            raise HTTPException(status_code=422, detail=f"Unsupported path {pointer}")
+
+
+def is_index(token: str) -> bool:
+    return token.isdigit() or token == '-'
+
+
+def to_dotted(tokens: List[str]) -> str:
+    return '.'.join(tokens)
+
+
+def is_overlapping(path_1: str, path_2: str) -> bool:
+    """One path is the same or nested into the other"""
+    return path_1 == path_2 or path_1.startswith(f"{path_2}.") or path_2.startswith(f"{path_1}.")
+
+
+def get_container_tokens(operation: PatchOperation) -> List[str]:
+    """Tokens of subtree, that is changed by operation (array itself for operations with array index)"""
+
+    tokens = parse_pointer(operation.path)
+    if operation.op in ('add', 'remove') and is_index(tokens[-1]):
+        return tokens[:-1]
+    return tokens
+
+
+def is_affecting_images(operations: List[PatchOperation], manifest: List[dict], image_parent_keys: Tuple[str] = ('images', 'check_images')) -> bool:
+    """Operations add, change or remove images, or shift their paths"""
+
+    for operation in operations:
+        tokens = parse_pointer(operation.path)
+        if any(token in image_parent_keys for token in tokens):
+            return True
+        if isinstance(operation.value, (dict, list)) and any(True for _ in iter_images(operation.value, image_parent_keys)):
+            return True
+        container_path = to_dotted(get_container_tokens(operation))
+        if any(is_overlapping(entry['path'], container_path) for entry in manifest):
+            return True
+    return False
+
+
+def build_update(operations: List[PatchOperation]) -> dict | None:
+    """
+    Update operators for operations, or None, if they can't be applied without reading document
+    """
+
+    update = {"$set": {}, "$unset": {}, "$push": {}}
+    touched_paths = []
+
+    for operation in operations:
+        tokens = parse_pointer(operation.path)
+
+        if operation.op in ('add', 'replace') and not (operation.op == 'add' and is_index(tokens[-1])):
+            path = to_dotted(tokens)
+            update["$set"][path] = operation.value
+        elif operation.op == 'add':
+            path = to_dotted(tokens[:-1])
+            if tokens[-1] == '-':
+                update["$push"][path] = operation.value
+            else:
+                update["$push"][path] = {"$each": [operation.value], "$position": int(tokens[-1])}
+        elif operation.op == 'remove' and not is_index(tokens[-1]):
+            path = to_dotted(tokens)
+            update["$unset"][path] = ""
+        else:
+            return None
+
+        if any(is_overlapping(path, touched_path) for touched_path in touched_paths):
+            return None
+        touched_paths.append(path)
+
+    return {operator: fields for operator, fields in update.items() if fields}
+
+
+def build_conditions(operations: List[PatchOperation]) -> dict:
+    """
+    Filter of paths, that should exist for update operators to have RFC 6902 semantics
+    ($set and $push create missing parents, $set pads array with nulls, $position past the end appends),
+    so with missing path document isn't matched, instead of being changed
+    """
+
+    conditions = {}
+    for operation in operations:
+        tokens = parse_pointer(operation.path)
+        if operation.op in ('replace', 'remove'):
+            conditions[to_dotted(tokens)] = {"$exists": True}
+            continue
+        if len(tokens) == 1:
+            continue  # root document exists
+        conditions[to_dotted(tokens[:-1])] = {"$exists": True}
+        if tokens[-1].isdigit() and int(tokens[-1]) > 0:
+            # inserted item can be the next one after the last, but not further
+            conditions[to_dotted([*tokens[:-1], str(int(tokens[-1]) - 1)])] = {"$exists": True}
+    return conditions
+
+
+def resolve_parent(document: Any, tokens: List[str]) -> Tuple[Any, str]:
+
+    parent = document
+    try:
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+    except (KeyError, IndexError, ValueError, TypeError):
+        raise HTTPException(status_code=422, detail=f"Path /{'/'.join(tokens)} doesn't exist")
+    return parent, tokens[-1]
+
+
+def get_value(document: Any, tokens: List[str]) -> Any:
+
+    parent, token = resolve_parent(document, tokens)
+    try:
+        return parent[int(token)] if isinstance(parent, list) else parent[token]
+    except (KeyError, IndexError, ValueError, TypeError):
+        raise HTTPException(status_code=422, detail=f"Path /{'/'.join(tokens)} doesn't exist")
+
+
+def add_value(document: Any, tokens: List[str], value: Any):
+
+    parent, token = resolve_parent(document, tokens)
+    if isinstance(parent, list):
+        index = len(parent) if token == '-' else int(token) if token.isdigit() else -1
+        if not 0 <= index <= len(parent):
+            raise HTTPException(status_code=422, detail=f"Index of /{'/'.join(tokens)} is out of range")
+        parent.insert(index, value)
+    elif isinstance(parent, dict):
+        parent[token] = value
+    else:
+        raise HTTPException(status_code=422, detail=f"Path /{'/'.join(tokens)} doesn't exist")
+
+
+def remove_value(document: Any, tokens: List[str]) -> Any:
+
+    value = get_value(document, tokens)
+    parent, token = resolve_parent(document, tokens)
+    if isinstance(parent, list):
+        parent.pop(int(token))
+    else:
+        parent.pop(token)
+    return value
+
+
+def apply_patch(document: dict, operations: List[PatchOperation]) -> dict:
+    """Applies operations to document in place (RFC 6902 semantics)"""
+
+    for operation in operations:
+        tokens = parse_pointer(operation.path)
+        if operation.op == 'add':
+            add_value(document, tokens, copy.deepcopy(operation.value))
+        elif operation.op == 'remove':
+            remove_value(document, tokens)
+        elif operation.op == 'replace':
+            remove_value(document, tokens)
+            add_value(document, tokens, copy.deepcopy(operation.value))
+        elif operation.op == 'move':
+            add_value(document, tokens, remove_value(document, parse_pointer(operation.from_)))
+        elif operation.op == 'copy':
+            add_value(document, tokens, copy.deepcopy(get_value(document, parse_pointer(operation.from_))))
+        elif operation.op == 'test':
+            if get_value(document, tokens) != operation.value:
+                raise HTTPException(status_code=409, detail=f"Test of {operation.path} failed")
+    return document
+
+
+def build_update_from_document(document: dict, operations: List[PatchOperation]) -> dict:
+    """$set of every subtree touched by operations (nested ones are covered by their parents)"""
+
+    touched_tokens = []
+    for operation in operations:
+        if operation.op == 'test':
+            continue
+        touched_tokens.append(get_container_tokens(operation))
+        if operation.op == 'move':
+            from_tokens = parse_pointer(operation.from_)
+            touched_tokens.append(from_tokens[:-1] if is_index(from_tokens[-1]) else from_tokens)
+
+    update = {"$set": {}, "$unset": {}}
+    touched_paths = []
+    for tokens in sorted(touched_tokens, key=len):
+        path = to_dotted(tokens)
+        if any(is_overlapping(path, touched_path) for touched_path in touched_paths):
+            continue
+        touched_paths.append(path)
+        try:
+            update["$set"][path] = get_value(document, tokens)
+        except HTTPException:
+            update["$unset"][path] = ""  # removed field
+    return {operator: fields for operator, fields in update.items() if fields}
+
+
+async def patch_assignment_in_db(
+        assignment_id: str,
+        save_counter: int,
+        operations: List[PatchOperation],
+        collection: AsyncIOMotorCollection,
+        upload_stats: dict = None
+) -> dict:
+    """
+    :param save_counter: save_counter of document, that client has changed
+    :return: new save_counter and updated_at
+    """
+
+    for operation in operations:
+        validate_tokens(parse_pointer(operation.path), operation.path)
+        if operation.op in ('move', 'copy'):
+            if operation.from_ is None:
+                raise HTTPException(status_code=422, detail=f"Operation {operation.op} requires from")
+            validate_tokens(parse_pointer(operation.from_), operation.from_)
+
+    assignment_filter = {"_id": ObjectId(assignment_id), "save_counter": save_counter}
+    stored = await collection.find_one({"_id": ObjectId(assignment_id)}, {"save_counter": 1, "image_manifest": 1, "group_id": 1})
+    if not stored:
+        raise HTTPException(status_code=404, detail=f"Assignment {assignment_id} not found")
+    if stored.get("save_counter") != save_counter:
+        raise HTTPException(status_code=409, detail=f"Assignment {assignment_id} was saved by someone else, reload it")
+
+    update = None
+    manifest = stored.get("image_manifest")
+    if manifest is not None and not is_affecting_images(operations, manifest):
+        update = build_update(operations)
+
+    images_to_acquire, images_to_release, held_keys = set(), set(), []
+    try:
+        if update is not None:
+            assignment_filter.update(build_conditions(operations))
+        else:
+            document = await collection.find_one(assignment_filter)
+            if not document:
+                raise HTTPException(status_code=409, detail=f"Assignment {assignment_id} was saved by someone else, reload it")
+
+            old_manifest = document.get("image_manifest")
+            if old_manifest is None:
+                old_manifest = build_image_manifest(document)
+
+            document = apply_patch(document, operations)
+            document = await upload_images_from_assignment_to_s3_with_clean(
+                assignment_data=document, assignment_id=assignment_id, upload_stats=upload_stats, held_keys=held_keys
+            )
+            update = build_update_from_document(document, operations)
+
+            new_manifest = await fill_image_manifest_sizes(build_image_manifest(document), known_manifest=old_manifest)
+            update.setdefault("$set", {})["image_manifest"] = manifest = new_manifest
+            images_to_acquire, images_to_release = image_store.get_keys_diff(
+                old_keys=get_manifest_store_keys(old_manifest), new_keys=get_manifest_store_keys(new_manifest)
+            )
+
+        updated_at = dt.datetime.now().isoformat()
+        update.setdefault("$set", {})["updated_at"] = updated_at
+        update["$inc"] = {"save_counter": 1}
+
+        # new images are referenced before save, and removed ones are released only after it
+        await image_store.acquire_images(images_to_acquire)
+        try:
+            result = await collection.update_one(assignment_filter, update)
+        except WriteError as e:
+            # e.g. $push into field, that isn't array
+            await image_store.release_images(images_to_acquire)
+            raise HTTPException(status_code=422, detail=f"Patch can't be applied to assignment {assignment_id}: {e}")
+        await image_store.release_images(images_to_release if result.matched_count else images_to_acquire)
+    finally:
+        # new images are acquired by saved document now (or deleted, if save failed and nobody references them)
+        await image_store.release_images(held_keys)
+
+    if not result.matched_count:
+        current = await collection.find_one({"_id": ObjectId(assignment_id)}, {"save_counter": 1})
+        if current and current.get("save_counter") == save_counter:
+            # not saved by someone else, so path of some operation doesn't exist
+            raise HTTPException(status_code=422, detail=f"Patch can't be applied to assignment {assignment_id}: path doesn't exist")
+        raise HTTPException(status_code=409, detail=f"Assignment {assignment_id} was saved by someone else, reload it")
+
+    # sizes are computed by db from patched document, so it isn't read or serialized in app
+    await collection.update_one(
+        {"_id": ObjectId(assignment_id), "save_counter": save_counter + 1}, [sizes.get_size_stage(sizes.get_images_size(manifest))]
+    )
+    await groups.recompute_group(stored.get("group_id"), collection)
+
+    return {"id": assignment_id, "save_counter": save_counter + 1, "updated_at": updated_at}
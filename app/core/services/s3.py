@@ -1,24 +1,89 @@
-from typing import List
+from typing import List, Iterable, AsyncIterator
 from urllib.parse import urlparse
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, AsyncExitStack
+import asyncio
 import aioboto3
-import base64
+from aiobotocore.config import AioConfig
+from botocore.exceptions import ClientError
 import mimetypes
 
+import app.core.services.executors as executors
 from app.settings import settings
 from app.logger import logger
 
 
-@asynccontextmanager
-async def get_s3_client():
+DELETE_OBJECTS_BATCH_SIZE = 1000  # s3 limit for one delete_objects request
+
+
+def create_s3_client():
+    """New s3 client context manager with pool and keep-alive from settings"""
     session = aioboto3.Session()
-    async with session.client(
+    return session.client(
             service_name='s3',
             endpoint_url=settings.s3_endpoint,
             aws_access_key_id=settings.s3_access_key_id,
-            aws_secret_access_key=settings.s3_secret_access_key
-    ) as client:
-        yield client
+            aws_secret_access_key=settings.s3_secret_access_key,
+            config=AioConfig(
+                max_pool_connections=settings.s3_max_pool_connections,
+                connect_timeout=settings.s3_connect_timeout_sec,
+                read_timeout=settings.s3_read_timeout_sec,
+                connector_args={"keepalive_timeout": settings.s3_keepalive_timeout_sec},
+            )
+    )
+
+
+class S3ClientManager:
+    """
+    Holds one long-living s3 client per worker (opened in app lifespan),
+    so all operations reuse its connection pool instead of new TLS/HTTP handshake every time.
+    Also caps simultaneous s3 calls of worker with semaphore.
+    """
+
+    def __init__(self, max_concurrency: int = settings.s3_max_concurrency):
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._exit_stack: AsyncExitStack | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def start(self):
+        if self._client is not None:
+            return self._client
+        self._exit_stack = AsyncExitStack()
+        self._client = await self._exit_stack.enter_async_context(create_s3_client())
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        logger.debug(f"S3 client started for {settings.s3_endpoint}")
+        return self._client
+
+    async def close(self):
+        if self._exit_stack is not None:
+            await self._exit_stack.aclose()
+        self._client = None
+        self._exit_stack = None
+        self._semaphore = None
+
+    @asynccontextmanager
+    async def client(self):
+        async with self.semaphore:
+            if self._client is not None:
+                yield self._client
+            else:
+                # outside of app lifespan (scripts, tests) - short-living client, as before
+                async with create_s3_client() as client:
+                    yield client
+
+
+s3_client_manager = S3ClientManager()
+
+
+def get_s3_client():
+    """Shared s3 client (while holding one slot of concurrency semaphore)"""
+    return s3_client_manager.client()
 
 
 async def s3_client_dependency():
@@ -80,22 +145,39 @@ async def create_bucket(bucket_name: str = settings.s3_images_bucket):
             return logger.debug(f"Bucket {bucket_name} already exists.")
 
 
+async def iter_files_pages(bucket_name: str = settings.s3_images_bucket, prefix: str = '') -> AsyncIterator[List[dict]]:
+    """
+    Yields listing pages (up to 1000 objects with 'Key', 'Size', 'LastModified'), following continuation token.
+    Same as list_objects_v2 paginator, but client (and concurrency slot) is taken only for page request,
+    so caller can make other s3 calls between pages.
+    """
+
+    list_kwargs = {"Bucket": bucket_name, "Prefix": prefix}
+    while True:
+        async with get_s3_client() as s3_client:
+            response = await s3_client.list_objects_v2(**list_kwargs)
+
+        yield response.get('Contents', [])
+
+        if not response.get('IsTruncated'):
+            break
+        list_kwargs["ContinuationToken"] = response['NextContinuationToken']
+
+
 async def list_files(bucket_name: str = settings.s3_images_bucket, prefix: str = '') -> List:
 
-    async with get_s3_client() as s3_client:
-        response = await s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix)
-        if 'Contents' in response:
-            return [obj['Key'] for obj in response['Contents']]
-        else:
-            return []
+    return [obj['Key'] async for page in iter_files_pages(bucket_name=bucket_name, prefix=prefix) for obj in page]
 
 
-async def upload_data_to_bucket(file_name: str, file_data: bytes, bucket_name: str = settings.s3_images_bucket, prefix: str = '') -> str:
+async def upload_data_to_bucket(
+        file_name: str, file_data: bytes, bucket_name: str = settings.s3_images_bucket, prefix: str = '', content_type: str = None
+) -> str:
 
     async with get_s3_client() as s3_client:
         full_key = f"{prefix}/{file_name}" if prefix else file_name
+        put_kwargs = {"ContentType": content_type} if content_type else {}
         try:
-            await s3_client.put_object(Bucket=bucket_name, Key=full_key, Body=file_data)
+            await s3_client.put_object(Bucket=bucket_name, Key=full_key, Body=file_data, **put_kwargs)
             return get_s3_uri(bucket=bucket_name, object_key=full_key)
         except Exception as e:
             raise Exception(f"Error uploading file: {e}")
@@ -113,6 +195,37 @@ async def download_from_bucket(file_key: str, bucket_name: str = settings.s3_ima
             raise Exception(f"Error downloading file: {e}")
 
 
+async def get_object(file_key: str, bucket_name: str = settings.s3_images_bucket, prefix: str = '', byte_range: str = None) -> dict:
+    """
+    Raw get_object response, with not yet read streaming 'Body' (read it with iter_object_body).
+    :param byte_range: value of http Range header, e.g. 'bytes=0-1023'
+    """
+
+    async with get_s3_client() as s3_client:
+        full_key = f"{prefix}/{file_key}" if prefix else file_key
+        get_kwargs = {"Range": byte_range} if byte_range else {}
+        return await s3_client.get_object(Bucket=bucket_name, Key=full_key, **get_kwargs)
+
+
+async def iter_object_body(body, chunk_size: int = 64 * 1024):
+    """Streams object body by chunks and releases connection to pool in the end"""
+
+    async with body:
+        async for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+
+
+async def copy_file(src_key: str, dst_key: str, bucket_name: str = settings.s3_images_bucket) -> str:
+    """Server side copy, data isn't transferred through app"""
+
+    async with get_s3_client() as s3_client:
+        try:
+            await s3_client.copy_object(Bucket=bucket_name, Key=dst_key, CopySource={"Bucket": bucket_name, "Key": src_key})
+            return get_s3_uri(bucket=bucket_name, object_key=dst_key)
+        except Exception as e:
+            raise Exception(f"Error copying file {src_key} to {dst_key}: {e}")
+
+
 async def delete_file(file_name: str, bucket_name: str = settings.s3_images_bucket, prefix: str = ''):
 
     async with get_s3_client() as s3_client:
@@ -123,48 +236,110 @@ async def delete_file(file_name: str, bucket_name: str = settings.s3_images_buck
             raise Exception(f"Error deleting file: {e}")
 
 
+async def delete_files(file_keys: List[str], bucket_name: str = settings.s3_images_bucket) -> int:
+    """Delete objects by full keys with delete_objects batches (up to 1000 keys per request)"""
+
+    deleted_files = 0
+    for i in range(0, len(file_keys), DELETE_OBJECTS_BATCH_SIZE):
+        batch = file_keys[i:i + DELETE_OBJECTS_BATCH_SIZE]
+        async with get_s3_client() as s3_client:
+            response = await s3_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True}
+            )
+        errors = response.get('Errors', [])
+        for error in errors:
+            logger.error(f"Error deleting file {bucket_name}/{error.get('Key')}: {error.get('Code')} {error.get('Message')}")
+        deleted_files += len(batch) - len(errors)
+
+    return deleted_files
+
+
 async def delete_folder(bucket_name: str, prefix: str) -> int:
     """Delete all files (objects) under a given prefix in the S3 bucket."""
 
+    if not clean_path(prefix):
+        raise ValueError(f"Empty prefix, refusing to delete whole bucket {bucket_name}")
+    folder_prefix = f"{clean_path(prefix)}/"
+
     deleted_files = 0
+    try:
+        # every listing page (up to 1000 keys) is deleted with one request
+        async for page in iter_files_pages(bucket_name=bucket_name, prefix=folder_prefix):
+            if page:
+                deleted_files += await delete_files([obj['Key'] for obj in page], bucket_name=bucket_name)
+
+        if not deleted_files:
+            logger.info(f"No files found under prefix '{prefix}' to delete.")
+
+    except Exception as e:
+        raise Exception(f"Error deleting folder with prefix {prefix}: {str(e)}")
+
+    return deleted_files
+
+
+async def delete_folders(bucket_name: str, prefixes: Iterable[str]) -> int:
+    """Delete several prefixes concurrently, number of simultaneous requests is limited by s3 client semaphore"""
+
+    deleted_files = await asyncio.gather(*(delete_folder(bucket_name=bucket_name, prefix=prefix) for prefix in prefixes))
+    return sum(deleted_files)
+
+
+async def head_file(file_key: str, bucket_name: str = settings.s3_images_bucket, prefix: str = '') -> dict | None:
+    """Object metadata (head_object response) or None, if there is no such object"""
+
     async with get_s3_client() as s3_client:
+        full_key = f"{prefix}/{file_key}" if prefix else file_key
         try:
-            files = await list_files(bucket_name=bucket_name, prefix=prefix)
-            if files:
-                for file_key in files:
-                    await s3_client.delete_object(Bucket=bucket_name, Key=file_key)
-                    deleted_files += 1
-            else:
-                logger.info(f"No files found under prefix '{prefix}' to delete.")
+            return await s3_client.head_object(Bucket=bucket_name, Key=full_key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
 
-        except Exception as e:
-            raise Exception(f"Error deleting folder with prefix {prefix}: {str(e)}")
 
-    return deleted_files
+async def file_exists(file_key: str, bucket_name: str = settings.s3_images_bucket, prefix: str = '') -> bool:
+    return await head_file(file_key=file_key, bucket_name=bucket_name, prefix=prefix) is not None
 
 
-async def base64_image_to_s3(file_name_wo_ext: str, base64_string: str, bucket_name: str = settings.s3_images_bucket, prefix: str = '') -> str:
-    """Upload a base64-encoded image to S3"""
+async def get_file_size(file_key: str, bucket_name: str = settings.s3_images_bucket, prefix: str = '') -> int | None:
+    head = await head_file(file_key=file_key, bucket_name=bucket_name, prefix=prefix)
+    return head["ContentLength"] if head else None
 
-    try:
-        # Extract MIME type from base64 string
-        header, base64_data = base64_string.split(",", 1)
-        mime_type = header.split(";")[0].split(":")[1]
 
-        valid_mime_types = {"image/png", "image/jpg", "image/jpeg", "image/gif", "image/webp"}
-        if mime_type not in valid_mime_types:
-            raise ValueError(f"Unsupported MIME type: {mime_type}")
+def parse_base64_image(base64_string: str) -> tuple[str, str, str]:
+    """
+    Parse data uri of image (without decoding it)
+    :return: mime type, file extension, base64 data
+    """
+
+    # Extract MIME type from base64 string
+    header, base64_data = base64_string.split(",", 1)
+    mime_type = header.split(";")[0].split(":")[1]
 
-        ext = mimetypes.guess_extension(mime_type)
-        if not ext:
-            raise ValueError(f"Could not determine file extension for MIME type: {mime_type}")
+    valid_mime_types = {"image/png", "image/jpg", "image/jpeg", "image/gif", "image/webp"}
+    if mime_type not in valid_mime_types:
+        raise ValueError(f"Unsupported MIME type: {mime_type}")
 
+    ext = mimetypes.guess_extension(mime_type)
+    if not ext:
+        raise ValueError(f"Could not determine file extension for MIME type: {mime_type}")
+
+    return mime_type, ext, base64_data
+
+
+async def base64_image_to_s3(file_name_wo_ext: str, base64_string: str, bucket_name: str = settings.s3_images_bucket, prefix: str = '') -> str:
+    """Upload a base64-encoded image to S3"""
+
+    ext = ''
+    try:
+        mime_type, ext, base64_data = parse_base64_image(base64_string)
         file_name_with_ext = f"{file_name_wo_ext}{ext}"
 
-        image_data = base64.b64decode(base64_data)
+        image_data = await executors.offload('b64decode', executors.b64decode, base64_data, size=len(base64_data))
 
         s3_uri = await upload_data_to_bucket(
-            bucket_name=bucket_name, prefix=prefix, file_name=file_name_with_ext, file_data=image_data
+            bucket_name=bucket_name, prefix=prefix, file_name=file_name_with_ext, file_data=image_data, content_type=mime_type
         )
 
         logger.debug(f"Image uploaded to S3: {s3_uri}")
@@ -179,7 +354,7 @@ async def s3_to_base64_image(file_key: str, bucket_name: str = settings.s3_image
 
     try:
         file_data = await download_from_bucket(bucket_name=bucket_name, file_key=file_key, prefix=prefix)
-        base64_string = base64.b64encode(file_data).decode('utf-8')
+        base64_string = await executors.offload('b64encode', executors.b64encode, file_data, size=len(file_data))
         mime_type, _ = mimetypes.guess_type(file_key)
         mime_type = "application/octet-stream" if not mime_type else mime_type
         data = f"data:{mime_type};base64,{base64_string}"
@@ -0,0 +1,239 @@
+"""
+Snapshot of UI schema and events mapper, that are passed to front and saved with assignments.
+
+It's computed once (on startup) and rebuilt only when events mapper yaml is changed:
+mtime of file is checked on every access, content hash - only when mtime is changed.
+
+Schema store: collection settings.app_schemas_collection keeps every schema and events mapper once,
+{_id: hash, kind: field name in document, data: json string, created_at}, and documents keep only hashes.
+Documents saved before store appeared have them embedded, so both ways are read (see resolve_assignment_schema).
+"""
+
+from typing import Tuple
+import os
+import yaml
+import datetime as dt
+from pydantic import BaseModel, ConfigDict
+from pymongo import UpdateOne
+from motor.motor_asyncio import AsyncIOMotorCollection
+
+import app.core.services.database as db
+import app.core.services.executors as executors
+from app.core.services.cache import LRUCache
+from app.core.services.utils import get_hash
+from app.core.models.assignment import Event, EventsMapper, AssignmentInUI, Status
+from app.settings import settings
+from app.logger import logger
+
+
+class SchemaSnapshot(BaseModel):
+
+    model_config = ConfigDict(frozen=True)
+
+    assignment_ui_schema: str
+    assignment_ui_schema_hash: str
+    events_mapper: str
+    events_mapper_hash: str
+    # source of snapshot, to know when it should be rebuilt
+    events_mapper_path: str
+    events_mapper_mtime: float
+    events_mapper_source_hash: str
+
+
+_snapshot: SchemaSnapshot | None = None
+
+
+def build_schema_snapshot(events_mapper_source: str, path: str, mtime: float) -> SchemaSnapshot:
+    """
+    Json schema (it's base for Json Form creation) with most actual enums, injected into its copy,
+    and Events mapper (both in json string) to pass it to Front
+    """
+
+    events_mapper = EventsMapper(data=yaml.safe_load(events_mapper_source))
+
+    assignment_ui_schema = AssignmentInUI.dump_schema(return_str=True, field_overrides={
+        Event: {"event_type": {"enum": list(events_mapper.dump().keys())}},
+        AssignmentInUI: {"status": {"enum": [status.value for status in Status]}},
+    })
+
+    events_mapper_str = events_mapper.dump(return_str=True)
+
+    return SchemaSnapshot(
+        assignment_ui_schema=assignment_ui_schema,
+        assignment_ui_schema_hash=get_hash(assignment_ui_schema),
+        events_mapper=events_mapper_str,
+        events_mapper_hash=get_hash(events_mapper_str),
+        events_mapper_path=path,
+        events_mapper_mtime=mtime,
+        events_mapper_source_hash=get_hash(events_mapper_source),
+    )
+
+
+def get_cached_snapshot(path: str) -> Tuple[SchemaSnapshot | None, str | None, float]:
+    """
+    Cached snapshot, if events mapper file isn't changed since it was built
+    :return: snapshot (None, if it should be rebuilt), source of events mapper (if it was read), mtime of file
+    """
+
+    global _snapshot
+
+    mtime = os.stat(path).st_mtime
+    if _snapshot and _snapshot.events_mapper_path == path and _snapshot.events_mapper_mtime == mtime:
+        return _snapshot, None, mtime
+
+    with open(path, 'r') as f:
+        events_mapper_source = f.read()
+
+    if _snapshot and _snapshot.events_mapper_path == path and _snapshot.events_mapper_source_hash == get_hash(events_mapper_source):
+        # file is touched, but not changed
+        _snapshot = _snapshot.model_copy(update={"events_mapper_mtime": mtime})
+        return _snapshot, None, mtime
+
+    return None, events_mapper_source, mtime
+
+
+def set_snapshot(snapshot: SchemaSnapshot) -> SchemaSnapshot:
+    global _snapshot
+    _snapshot = snapshot
+    logger.info(f"Schema snapshot is built from {snapshot.events_mapper_path}, hash {snapshot.assignment_ui_schema_hash}")
+    return snapshot
+
+
+def get_schema_snapshot(path: str = settings.app_config_events_mapper_path) -> SchemaSnapshot:
+    """Actual snapshot: cached one, if events mapper file isn't changed since it was built"""
+
+    snapshot, events_mapper_source, mtime = get_cached_snapshot(path)
+    if snapshot:
+        return snapshot
+    return set_snapshot(build_schema_snapshot(events_mapper_source, path=path, mtime=mtime))
+
+
+async def get_schema_snapshot_async(path: str = settings.app_config_events_mapper_path) -> SchemaSnapshot:
+    """Same as get_schema_snapshot, but snapshot is built not on event loop (schema generation is pure python)"""
+
+    snapshot, events_mapper_source, mtime = get_cached_snapshot(path)
+    if snapshot:
+        return snapshot
+    snapshot = await executors.offload('schema_snapshot', build_schema_snapshot, events_mapper_source, path, mtime, cpu_bound=True)
+    return set_snapshot(snapshot)
+
+
+# kind of schema (field in document with data) -> field in document with hash
+SCHEMA_FIELDS = {
+    "assignment_ui_schema": "assignment_ui_schema_hash",
+    "events_mapper": "events_mapper_hash",
+}
+
+# content addressed, so it can't go stale
+stored_schemas = LRUCache(settings.app_schemas_cache_size)
+
+
+async def get_schemas_collection() -> AsyncIOMotorCollection:
+    return await db.get_collection(collection_name=settings.app_schemas_collection)
+
+
+async def put_schema(kind: str, schema_hash: str, data: str):
+    """Save schema to store once (no-op, if it's already there)"""
+
+    if schema_hash in stored_schemas:
+        return
+
+    schemas_collection = await get_schemas_collection()
+    await schemas_collection.update_one(
+        {"_id": schema_hash},
+        {"$setOnInsert": {"kind": kind, "data": data, "created_at": dt.datetime.now().isoformat()}},
+        upsert=True
+    )
+    stored_schemas.set(schema_hash, (kind, data))
+
+
+async def get_schema(kind: str | None, schema_hash: str) -> str | None:
+    """Schema (or events mapper) json string by hash. Hashes of all kinds are unique, so kind is just a check"""
+
+    cached = stored_schemas.get(schema_hash)
+    if cached is None:
+        schemas_collection = await get_schemas_collection()
+        schema = await schemas_collection.find_one({"_id": schema_hash}, {"kind": 1, "data": 1})
+        if not schema:
+            return None
+        cached = (schema["kind"], schema["data"])
+        stored_schemas.set(schema_hash, cached)
+
+    stored_kind, data = cached
+    return data if kind is None or kind == stored_kind else None
+
+
+async def store_snapshot(snapshot: SchemaSnapshot):
+    await put_schema("assignment_ui_schema", snapshot.assignment_ui_schema_hash, snapshot.assignment_ui_schema)
+    await put_schema("events_mapper", snapshot.events_mapper_hash, snapshot.events_mapper)
+
+
+async def resolve_assignment_schema(assignment_data: dict) -> Tuple[str | None, str | None]:
+    """(assignment_ui_schema, events_mapper) of document: embedded in it, or from store by hashes"""
+
+    resolved = []
+    for kind, hash_field in SCHEMA_FIELDS.items():
+        data = assignment_data.get(kind)
+        if data is None and assignment_data.get(hash_field):
+            data = await get_schema(kind, assignment_data[hash_field])
+        resolved.append(data)
+    return resolved[0], resolved[1]
+
+
+async def get_assignment_schema_hashes(assignment_data: dict) -> Tuple[str | None, str | None]:
+    """
+    (assignment_ui_schema_hash, events_mapper_hash) of document, to reference schema by url.
+    Embedded schema of old document is put to store, so it's available by hash too (document itself isn't changed)
+    """
+
+    hashes = []
+    for kind, hash_field in SCHEMA_FIELDS.items():
+        data = assignment_data.get(kind)
+        if isinstance(data, str):
+            await put_schema(kind, get_hash(data), data)
+            hashes.append(get_hash(data))
+        else:
+            hashes.append(assignment_data.get(hash_field))
+    return hashes[0], hashes[1]
+
+
+async def move_schema_to_store(assignment_data: dict) -> dict:
+    """Embedded schema and events mapper of document are put to store, only hashes are left in document"""
+
+    for kind, hash_field in SCHEMA_FIELDS.items():
+        data = assignment_data.pop(kind, None)
+        if isinstance(data, str):
+            assignment_data[hash_field] = get_hash(data)
+            await put_schema(kind, assignment_data[hash_field], data)
+    return assignment_data
+
+
+async def migrate_embedded_schemas(collection: AsyncIOMotorCollection, batch_size: int = 100) -> int:
+    """
+    One-off migration: embedded schemas of documents are moved to store.
+    :return: number of updated documents
+    """
+
+    embedded_filter = {"$or": [{kind: {"$type": "string"}} for kind in SCHEMA_FIELDS]}
+    projection = {field: 1 for fields in SCHEMA_FIELDS.items() for field in fields}
+
+    updated = 0
+    requests = []
+    async for assignment_data in collection.find(embedded_filter, projection):
+        assignment_data = await move_schema_to_store(assignment_data)
+        requests.append(UpdateOne(
+            {"_id": assignment_data["_id"]},
+            {
+                "$set": {hash_field: assignment_data[hash_field] for hash_field in SCHEMA_FIELDS.values() if assignment_data.get(hash_field)},
+                "$unset": {kind: "" for kind in SCHEMA_FIELDS},
+            }
+        ))
+        if len(requests) >= batch_size:
+            updated += (await collection.bulk_write(requests, ordered=False)).modified_count
+            requests = []
+
+    if requests:
+        updated += (await collection.bulk_write(requests, ordered=False)).modified_count
+
+    logger.info(f"Schemas of {updated} assignments are moved to schema store")
+    return updated
@@ -0,0 +1,39 @@
+"""
+Json bodies for api responses: compact encoding and gzip compression, negotiated with Accept-Encoding.
+"""
+
+from typing import Any, Tuple
+import gzip
+import json
+
+from app.settings import settings
+
+
+def dumps(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def get_accepted_encodings(accept_encoding: str | None) -> set[str]:
+    """Codings from Accept-Encoding header, without explicitly refused ones (q=0)"""
+
+    encodings = set()
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            encodings.add(coding.lower())
+    return encodings
+
+
+def compress(body: bytes, accept_encoding: str | None, min_size: int = settings.app_http_compression_min_size) -> Tuple[bytes, str | None]:
+    """
+    Body compressed with gzip, if client accepts it.
+    Small bodies aren't compressed, it doesn't pay off.
+    :return: body, Content-Encoding (None, if not compressed)
+    """
+
+    if len(body) < min_size:
+        return body, None
+
+    if 'gzip' in get_accepted_encodings(accept_encoding):
+        return gzip.compress(body, compresslevel=settings.app_http_compression_level), 'gzip'
+    return body, None
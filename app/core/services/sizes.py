@@ -0,0 +1,25 @@
+"""
+Size accounting of assignments (in MB, as shown in UI):
+- size_doc: size of document as it's stored in mongo (BSON), computed by mongo itself with $bsonSize
+  in update pipeline, so document isn't serialized one more time in app;
+- size_total: size_doc plus sizes of images, referenced by document (tracked on upload, see image_manifest).
+"""
+
+from typing import List
+
+MB = 1024 ** 2
+
+
+def get_images_size(manifest: List[dict]) -> int:
+    """Bytes of all images of document (image referenced twice is counted once). Unknown sizes are skipped"""
+    return sum({entry['key']: entry.get('size') or 0 for entry in manifest}.values())
+
+
+def get_size_stage(images_size: int, size_doc_field: str = 'size_doc', size_total_field: str = 'size_total') -> dict:
+    """Update pipeline stage, that sets size fields from stored size of document"""
+
+    doc_size = {"$bsonSize": "$$ROOT"}
+    return {"$set": {
+        size_doc_field: {"$round": [{"$divide": [doc_size, MB]}, 2]},
+        size_total_field: {"$round": [{"$divide": [{"$add": [doc_size, images_size]}, MB]}, 2]},
+    }}
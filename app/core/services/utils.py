@@ -1,10 +1,8 @@
 from typing import Union, Any
 import os
-import sys
 import datetime as dt
 import hashlib
 
-import pydantic
 import yaml
 import json
 from pathlib import Path
@@ -48,21 +46,13 @@ def format_date(date: str | dt.datetime) -> str:
     return date.strftime('%Y-%m-%d %H:%M')
 
 
-def get_model_size(data: pydantic.BaseModel | dict | Any) -> float:
-
-    """
-    :return: size in Mbytes
-    """
-
-    if isinstance(data, pydantic.BaseModel):
-        data = json.dumps(data.model_dump())
-    elif isinstance(data, dict):
-        data = json.dumps(data)
-    else:
-        pass
+def get_hash(str_: str) -> str:
+    return hashlib.md5(str_.encode()).hexdigest()
 
-    return round(sys.getsizeof(data) / (1024 ** 2), 2)
 
+def get_by_path(data: dict | list, path: str) -> Any:
+    """Value from nested dicts/lists by dotted path, e.g. 'blocks.0.events.1'"""
+    for key in path.split('.'):
+        data = data[int(key)] if isinstance(data, list) else data[key]
+    return data
 
-def get_hash(str_: str) -> str:
-    return hashlib.md5(str_.encode()).hexdigest()
\ No newline at end of file
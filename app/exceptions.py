@@ -25,7 +25,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "request": request,
             "error": str(exc),
             "current_user": await get_current_user(request)
-        }
+        },
+        status_code=exc.status_code
     )
 
 
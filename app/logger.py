@@ -1,5 +1,6 @@
 import logging
 import sys
+from contextvars import ContextVar
 from logging.handlers import TimedRotatingFileHandler
 from pathlib import Path
 import functools
@@ -11,10 +12,23 @@ from app.settings import settings
 LOG_DIR = Path(settings.app_log_folder)
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
+# context of request, that is handled by current task (set by middleware)
+request_id_var: ContextVar[str | None] = ContextVar("request_id", default=None)
+route_var: ContextVar[str | None] = ContextVar("route", default=None)
+
 logger = logging.getLogger("tomata")
 logger.setLevel(settings.app_log_level)
 
-log_format = logging.Formatter('%(asctime)s [%(levelname)s]: %(message)s')
+
+class RequestContextFilter(logging.Filter):
+    """Adds request_id of current request to records (- outside of requests)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get() or '-'
+        return True
+
+
+log_format = logging.Formatter('%(asctime)s [%(levelname)s] [%(request_id)s]: %(message)s')
 
 # file handler
 file_handler = TimedRotatingFileHandler(
@@ -27,11 +41,13 @@ file_handler = TimedRotatingFileHandler(
 )
 file_handler.setFormatter(log_format)
 file_handler.suffix = "%Y-%m-%d"
+file_handler.addFilter(RequestContextFilter())
 logger.addHandler(file_handler)
 
 # stdout handler
 console_handler = logging.StreamHandler()
 console_handler.setFormatter(log_format)
+console_handler.addFilter(RequestContextFilter())
 logger.addHandler(console_handler)
 
 
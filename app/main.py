@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, HTTPException
@@ -7,10 +8,18 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
 from app.core.routes import core_router
-from app.middlewares import LoggingMiddleware
+from app.middlewares import RequestInstrumentationMiddleware
 from app.settings import settings
+import app.core.services.database as db
 from app.core.services.auth import initialize_user
-from app.core.services.s3 import create_bucket
+from app.core.services.s3 import create_bucket, s3_client_manager
+from app.core.services.image_gc import run_gc_periodically
+from app.core.services.indexes import create_indexes
+from app.core.services.schema import get_schema_snapshot_async, store_snapshot
+from app.core.services.executors import shutdown_executors
+from app.core.services.loop_monitor import loop_monitor
+from app.core.services.assignment import save_coalescer
+from app.core.services.groups import rebuild_groups_if_empty
 from app.exceptions import general_exception_handler, http_exception_handler
 
 
@@ -19,15 +28,30 @@ PROJECT_NAME = 'TOMATA'
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if settings.app_loop_monitor_interval_sec > 0:
+        loop_monitor.start()
+    db.connect_client()
+    await create_indexes()
+    await store_snapshot(await get_schema_snapshot_async())
+    await rebuild_groups_if_empty(await db.get_collection(collection_name=settings.app_assignments_collection))
+    await s3_client_manager.start()
     await initialize_user(username=settings.app_init_admin_username, password=settings.app_init_admin_password)
     await create_bucket(bucket_name=settings.s3_images_bucket)
+    gc_task = asyncio.create_task(run_gc_periodically()) if settings.app_images_gc_interval_sec > 0 else None
     yield
+    if gc_task:
+        gc_task.cancel()
+    await save_coalescer.flush_all()
+    await s3_client_manager.close()
+    shutdown_executors()
+    loop_monitor.stop()
+    db.close_clients()
 
 
 app = FastAPI(title=PROJECT_NAME, lifespan=lifespan)
 app.include_router(core_router)
 app.add_middleware(SessionMiddleware, secret_key=settings.app_fastapi_middleware_secret_key)
-app.add_middleware(LoggingMiddleware)
+app.add_middleware(RequestInstrumentationMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
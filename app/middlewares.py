@@ -1,22 +1,79 @@
+import logging
 import time
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+import uuid
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
 
-from app.logger import logger
+from app.core.services.metrics import metrics
+from app.settings import settings
+from app.logger import logger, request_id_var, route_var
 
 
-class LoggingMiddleware(BaseHTTPMiddleware):
+# bytes, from tiny json to document with inlined images
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+
+
+def get_route_template(scope: Scope) -> str:
+    """Path of matched route (/assignment/{assignment_id}), so metrics don't grow with every id"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "other"
+
+
+class RequestInstrumentationMiddleware:
     """
-    Middleware for logging all requests and errors
+    Pure ASGI middleware (no extra task and no buffering of response, unlike BaseHTTPMiddleware) for all requests:
+    - request id (X-Request-ID of request, or new one) is set to context for logs and returned in X-Request-ID header;
+    - latency, status and response size are observed in metrics by route template;
+    - errors and slow requests are logged.
+    Response messages are passed through as is, only size of body is counted, so streaming stays streaming.
     """
-    async def dispatch(self, request: Request, call_next) -> Response:
-        start_time = time.time()
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+                break
+        request_id = request_id or uuid.uuid4().hex
+        request_id_var.set(request_id)
+        route_var.set(f"{scope['method']} {scope['path']}")
+
+        status_code = 500
+        response_size = 0
+
+        async def send_with_instrumentation(message: Message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_with_instrumentation)
         except Exception as e:
-            logger.error(f"Error while operating request {request.method} {request.url.path} from {request.client.host}: {e}", exc_info=True)
-            raise e
-        process_time = time.time() - start_time
-        logger.debug(f"HTTP request {request.method} {request.url.path} from {request.client.host} processed for {process_time:.4f}s with {response.status_code}")
-        return response
+            client_host = scope["client"][0] if scope.get("client") else None
+            logger.error(f"Error while operating request {scope['method']} {scope['path']} from {client_host}: {e}", exc_info=True)
+            raise
+        finally:
+            process_time = time.perf_counter() - start_time
+            route = f"{scope['method']} {get_route_template(scope)}"
+            metrics.observe(f"http_latency_sec:{route}", process_time)
+            metrics.observe(f"http_response_bytes:{route}", response_size, buckets=SIZE_BUCKETS)
+            metrics.inc(f"http_status:{route}:{status_code}")
+
+            is_slow = process_time >= settings.app_http_slow_request_sec
+            if is_slow or logger.isEnabledFor(logging.DEBUG):
+                logger.log(
+                    logging.WARNING if is_slow else logging.DEBUG,
+                    f"{'Slow ' if is_slow else ''}HTTP request {scope['method']} {scope['path']} processed for {process_time:.4f}s "
+                    f"with {status_code}, {response_size} bytes"
+                )
@@ -25,11 +25,49 @@ class Settings(BaseSettings):
 
     app_assignments_collection: str = 'assignments'
     app_users_collection: str = 'users'
+    app_images_collection: str = 'images'
+    app_schemas_collection: str = 'schemas'
+    app_groups_collection: str = 'groups'
+    app_meta_collection: str = 'meta'
 
     app_config_events_mapper_path: str = 'app/configs/events_mapper.yaml'
+    app_schemas_cache_size: int = 64
 
     app_init_admin_username: str = 'admin'
     app_init_admin_password: str = 'admin'
+    app_users_cache_size: int = 1024
+    app_users_cache_ttl_sec: float = 60
+    app_users_version_check_sec: float = 5  # how soon changes of users made by other workers are seen
+    app_password_hashing_concurrency: int = 2  # threads for bcrypt
+    app_login_max_failed_attempts: int = 5  # per username and client ip in window, then login is refused with 429
+    app_login_attempts_window_sec: float = 300
+
+    app_images_hydration_concurrency: int = 8
+    app_images_hydration_timeout_sec: float = 10
+    app_images_view_mode: str = 'url'  # url | base64, see ImageMode
+    app_images_edit_mode: str = 'base64'
+    app_images_verify_unchanged: bool = False  # HEAD request before skipping upload of unchanged image
+    app_images_known_uris_cache_size: int = 0
+    app_images_gc_interval_sec: int = 86400  # 0 - no scheduled GC, only on demand
+    app_images_gc_grace_period_sec: int = 86400
+
+    app_save_coalesce_window_sec: float = 0.5  # saves of document within window are written once, 0 - no coalescing
+
+    app_offload_min_size: int = 256 * 1024  # bytes, smaller inputs of CPU-heavy operations are processed on event loop
+    app_offload_thread_workers: int = 4
+    app_offload_process_workers: int = 0  # 0 - no process pool, pure python operations go to thread pool too
+
+    app_loop_monitor_interval_sec: float = 0.1  # 0 - no monitor
+    app_loop_lag_threshold_sec: float = 0.5  # stack of blocked loop is logged, when it's blocked for longer
+    app_loop_stalls_kept: int = 20  # recent stalls on /service/loop
+
+    app_http_slow_request_sec: float = 1  # slower requests are logged with warning
+
+    app_http_compression_min_size: int = 1024  # bytes, smaller json responses aren't compressed
+    app_http_compression_level: int = 6
+
+    app_list_page_size: int = 50  # groups on list page
+    app_list_max_page_size: int = 200
 
     # mongo
     mongo_server: str = 'mongo'
@@ -39,6 +77,10 @@ class Settings(BaseSettings):
     mongo_initdb_database: str = 'tomata'
     mongodb_data_dir: str = './data/db'
     mongodb_log_dir: str = './log/mongodb'
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 0
+    mongo_max_idle_time_ms: int = 60000
+    mongo_server_selection_timeout_ms: int = 5000
 
     # mongo express
     me_config_basicauth_username: str = 'mexpress'
@@ -52,6 +94,11 @@ class Settings(BaseSettings):
     s3_access_key_id: str = 'minio'
     s3_secret_access_key: str = 'minio123'
     s3_images_bucket: str = 'images'
+    s3_max_pool_connections: int = 50
+    s3_keepalive_timeout_sec: float = 60
+    s3_connect_timeout_sec: float = 5
+    s3_read_timeout_sec: float = 60
+    s3_max_concurrency: int = 32
 
     @property
     def mongo_uri(self):
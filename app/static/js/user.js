@@ -20,3 +20,25 @@ function deleteUser(userId) {
     }
 }
 
+
+
+function deactivateUser(userId) {
+
+    if (!userId) {
+        alert("Error: userId is required!");
+        return;
+    }
+
+    if (confirm("Are you sure you want to deactivate this user?")) {
+        fetch(`/user/deactivate/${userId}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            }
+        }).then(response => response.json())
+        .then(data => {
+            alert(data.message);
+            window.location.href = "/user/list";
+        });
+    }
+}
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+Throughput benchmark for /assignment/list
+
+Usage (app and mongo should be up, e.g. with docker-compose):
+
+    python -m benchmarks.assignment_list --url http://localhost:8000 --requests 500 --concurrency 20
+    python -m benchmarks.assignment_list --mongo --requests 500 --concurrency 20
+
+--url mode measures req/s of the endpoint itself (run it on commits before and after change to compare).
+--mongo mode reproduces the old and the new way of getting collection side by side,
+to see connection setup cost without app overhead:
+- before: new AsyncIOMotorClient for every operation (how get_db worked)
+- after: one pooled client for the process (how get_db works now)
+"""
+
+import argparse
+import asyncio
+import time
+
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.settings import settings
+
+
+async def _run(worker, requests: int, concurrency: int) -> float:
+    """Run worker `requests` times with given concurrency, return req/s"""
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def _one():
+        async with semaphore:
+            await worker()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(_one() for _ in range(requests)))
+    return requests / (time.perf_counter() - start)
+
+
+async def bench_http(url: str, requests: int, concurrency: int, username: str = None, password: str = None):
+
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        if username:
+            await client.post("/token", data={"username": username, "password": password})
+
+        async def _get_list():
+            response = await client.get("/assignment/list")
+            response.raise_for_status()
+
+        await _get_list()  # warm up
+        rps = await _run(_get_list, requests, concurrency)
+        print(f"GET /assignment/list: {rps:.1f} req/s ({requests} requests, concurrency {concurrency})")
+
+
+async def bench_mongo(requests: int, concurrency: int):
+
+    needed_cols = ("group_id", "_id", "name", "status", "issue", "version", "author", "created_at", "updated_at", "size_total", "assignment_ui_schema_hash")
+
+    async def _list_with_new_client():
+        client = AsyncIOMotorClient(settings.mongo_uri)
+        collection = client[settings.mongo_initdb_database][settings.app_assignments_collection]
+        [doc async for doc in collection.find({}, needed_cols)]
+        client.close()
+
+    pooled_client = AsyncIOMotorClient(
+        settings.mongo_uri,
+        maxPoolSize=settings.mongo_max_pool_size,
+        minPoolSize=settings.mongo_min_pool_size,
+        maxIdleTimeMS=settings.mongo_max_idle_time_ms,
+        serverSelectionTimeoutMS=settings.mongo_server_selection_timeout_ms,
+    )
+
+    async def _list_with_pooled_client():
+        collection = pooled_client[settings.mongo_initdb_database][settings.app_assignments_collection]
+        [doc async for doc in collection.find({}, needed_cols)]
+
+    before = await _run(_list_with_new_client, requests, concurrency)
+    await _list_with_pooled_client()  # warm up pool
+    after = await _run(_list_with_pooled_client, requests, concurrency)
+    pooled_client.close()
+
+    print(f"list query, client per request (before): {before:.1f} req/s")
+    print(f"list query, pooled client (after):       {after:.1f} req/s")
+    print(f"speedup: x{after / before:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of /assignment/list")
+    parser.add_argument("--url", default=f"http://localhost:{settings.app_port}")
+    parser.add_argument("--mongo", action="store_true", help="compare client per request vs pooled client directly on mongo")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--username", default=None)
+    parser.add_argument("--password", default=None)
+    args = parser.parse_args()
+
+    if args.mongo:
+        asyncio.run(bench_mongo(args.requests, args.concurrency))
+    else:
+        asyncio.run(bench_http(args.url, args.requests, args.concurrency, args.username, args.password))
+
+
+if __name__ == "__main__":
+    main()
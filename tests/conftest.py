@@ -1,8 +1,10 @@
 import pytest
+from contextlib import asynccontextmanager
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, MagicMock
 from bson import ObjectId
 
+import app.core.services.s3 as s3
 from app.main import app
 
 
@@ -12,6 +14,55 @@ def test_client():
         yield client
 
 
+class FakeS3Client:
+    """
+    Bucket of objects (keys, or dicts with 'Key', 'Size', 'LastModified'), listed by pages of page_size.
+    Continuation token is the last listed key, as in s3 listing goes on by keys, so deletes between pages don't shift it
+    """
+
+    def __init__(self, objects, page_size: int = 1000):
+        objects = [{"Key": obj} if isinstance(obj, str) else obj for obj in objects]
+        self.objects = {obj["Key"]: obj for obj in objects}
+        self.page_size = page_size
+        self.list_requests = 0
+        self.delete_requests = []
+
+    async def list_objects_v2(self, Bucket, Prefix, ContinuationToken=None):
+        self.list_requests += 1
+        keys = [
+            key for key in sorted(self.objects)
+            if key.startswith(Prefix) and (ContinuationToken is None or key > ContinuationToken)
+        ]
+        page = keys[:self.page_size]
+        response = {"Contents": [self.objects[key] for key in page], "IsTruncated": len(keys) > self.page_size}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = page[-1]
+        return response
+
+    async def delete_objects(self, Bucket, Delete):
+        self.delete_requests.append([obj["Key"] for obj in Delete["Objects"]])
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+        return {}
+
+
+@pytest.fixture()
+def make_fake_s3_client(monkeypatch):
+    """Factory of FakeS3Client, that is returned by s3.get_s3_client"""
+
+    def make(objects, page_size: int = 1000) -> FakeS3Client:
+        client = FakeS3Client(objects, page_size=page_size)
+
+        @asynccontextmanager
+        async def get_s3_client_():
+            yield client
+
+        monkeypatch.setattr(s3, "get_s3_client", get_s3_client_)
+        return client
+
+    return make
+
+
 @pytest.fixture
 def mock_s3():
     mock = AsyncMock()
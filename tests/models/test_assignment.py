@@ -1,6 +1,6 @@
 import pytest
 
-from app.core.models.assignment import EventData, EventsMapper, Event, Image, AssignmentBase, Block, Status
+from app.core.models.assignment import EventData, EventsMapper, Event, Image, AssignmentBase, AssignmentInUI, Block, Status
 from app.settings import settings
 
 
@@ -48,6 +48,19 @@ def test_remove_keys_recursively():
     assert result == {"key1": {}, "key2": "value2"}
 
 
+def test_dump_schema_with_field_overrides():
+    schema = AssignmentInUI.dump_schema(field_overrides={
+        Event: {"event_type": {"enum": ["pageview"]}},
+        AssignmentInUI: {"status": {"enum": ["Design"]}},
+    })
+    event_schema = schema["properties"]["blocks"]["items"]["properties"]["events"]["items"]
+
+    assert event_schema["properties"]["event_type"]["enum"] == ["pageview"]
+    assert schema["properties"]["status"]["enum"] == ["Design"]
+    # model classes stay untouched
+    assert Event.model_fields["event_type"].json_schema_extra["enum"] == []
+
+
 # 4. Test Event Model
 def test_event_model():
     event = Event(name="Test Event", description="This is a test event", event_data="Some data")
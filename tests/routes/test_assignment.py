@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.core.services.database as db
+import app.core.routes.assignment as assignment_routes
+from app.core.services.auth import require_authenticated_user
+from app.core.models.user import UserInDB
+from app.main import app
+
+
+@pytest.fixture()
+def data_client(monkeypatch):
+    calls = []
+
+    async def get_obj_by_fields_(query, collection, filter_cols=None, find_many=False):
+        return {"_id": query["_id"], "save_counter": 3}
+
+    async def get_assignment_data_with_images_(assignment_id, collection, rename_mongo_id=True, image_mode=None):
+        calls.append(assignment_id)
+        return {
+            "id": assignment_id, "name": "a" * 2000, "save_counter": 3, "assignment_ui_schema_hash": "schema_hash",
+            "events_mapper_hash": "mapper_hash", "image_manifest": []
+        }
+
+    monkeypatch.setattr(db, "get_obj_by_fields", get_obj_by_fields_)
+    monkeypatch.setattr(assignment_routes, "get_assignment_data_with_images", get_assignment_data_with_images_)
+    app.dependency_overrides[require_authenticated_user] = lambda: UserInDB(_id="507f1f77bcf86cd799439011", username="admin", hashed_password="")
+
+    client = TestClient(app)  # without lifespan, no db needed
+    client.data_calls = calls
+    yield client
+    app.dependency_overrides.clear()
+
+
+def test_get_assignment_data(data_client):
+    response = data_client.get("/assignment/assignment_id/data", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"assignment_id-3-base64"'
+    # test client decodes gzip itself
+    assert response.json() == {"id": "assignment_id", "name": "a" * 2000, "save_counter": 3, "assignment_ui_schema_hash": "schema_hash"}
+
+
+def test_get_assignment_data_not_modified(data_client):
+    response = data_client.get("/assignment/assignment_id/data", headers={"If-None-Match": 'W/"assignment_id-3-base64"'})
+
+    assert response.status_code == 304
+    assert data_client.data_calls == []
+
+
+def test_list_assignments_data(data_client, monkeypatch):
+    calls = []
+
+    async def list_assignments_(collection, query, limit, cursor=None):
+        calls.append((query, limit, cursor))
+        return [{"id": "assignment_id", "name": "Main"}], "next"
+
+    monkeypatch.setattr(assignment_routes.listing, "list_assignments", list_assignments_)
+
+    response = data_client.get("/assignment/list/data", params={"name": "Ma", "status": "Review", "limit": 10, "cursor": "current"})
+
+    assert response.status_code == 200
+    assert response.json() == {"items": [{"id": "assignment_id", "name": "Main"}], "next_cursor": "next"}
+    assert calls == [({"status": "Review", "name": {"$regex": "^Ma"}}, 10, "current")]
+    assert data_client.get("/assignment/list/data", params={"limit": 100000}).status_code == 422
@@ -0,0 +1,27 @@
+from fastapi.testclient import TestClient
+
+import app.core.routes.general as general_routes
+from app.core.services.auth import LoginAttemptLimiter
+from app.main import app
+
+
+def test_token_route_limits_failed_attempts(monkeypatch):
+    calls = []
+
+    async def authenticate_user_(username, password):
+        calls.append(username)
+        return None
+
+    monkeypatch.setattr(general_routes, "authenticate_user", authenticate_user_)
+    monkeypatch.setattr(general_routes, "login_limiter", LoginAttemptLimiter(max_attempts=2, window_sec=60))
+    client = TestClient(app)
+
+    for _ in range(2):
+        assert client.post("/token", data={"username": "admin", "password": "wrong"}).status_code == 200
+
+    response = client.post("/token", data={"username": "admin", "password": "wrong"})
+
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+    # password isn't checked, when attempts are limited
+    assert calls == ["admin", "admin"]
@@ -0,0 +1,70 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.core.services.s3 as s3
+from app.main import app
+
+
+class FakeBody:
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def iter_chunks(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+
+@pytest.fixture()
+def image_client(monkeypatch):
+    calls = []
+
+    async def get_object_(file_key, bucket_name, prefix, byte_range=None):
+        calls.append(byte_range)
+        if byte_range:
+            return {"Body": FakeBody(b"png"), "ContentLength": 3, "ContentRange": "bytes 0-2/8", "ContentType": "binary/octet-stream"}
+        return {"Body": FakeBody(b"png data"), "ContentLength": 8, "ContentType": "binary/octet-stream"}
+
+    monkeypatch.setattr(s3, "get_object", get_object_)
+    client = TestClient(app)  # without lifespan, no db/s3 needed
+    client.s3_calls = calls
+    return client
+
+
+def test_get_image(image_client):
+    response = image_client.get("/image/67a72006a08815331075b43d/0cc175b9c0f1b6a831c399e269772661.png")
+
+    assert response.status_code == 200
+    assert response.content == b"png data"
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["content-length"] == "8"
+    assert response.headers["etag"] == '"0cc175b9c0f1b6a831c399e269772661"'
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_get_image_not_modified(image_client):
+    response = image_client.get(
+        "/image/67a72006a08815331075b43d/0cc175b9c0f1b6a831c399e269772661.png",
+        headers={"If-None-Match": '"0cc175b9c0f1b6a831c399e269772661"'}
+    )
+
+    assert response.status_code == 304
+    assert image_client.s3_calls == []
+
+
+def test_get_image_range(image_client):
+    response = image_client.get(
+        "/image/67a72006a08815331075b43d/0cc175b9c0f1b6a831c399e269772661.png",
+        headers={"Range": "bytes=0-2"}
+    )
+
+    assert response.status_code == 206
+    assert response.content == b"png"
+    assert response.headers["content-range"] == "bytes 0-2/8"
+    assert image_client.s3_calls == ["bytes=0-2"]
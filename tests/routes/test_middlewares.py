@@ -0,0 +1,47 @@
+import pytest
+from fastapi.testclient import TestClient
+from starlette.responses import StreamingResponse
+
+import app.core.services.schema as schema
+from app.core.services.metrics import metrics
+from app.middlewares import RequestInstrumentationMiddleware
+from app.main import app
+
+
+def test_requests_are_instrumented_by_route_template(monkeypatch):
+    async def get_schema_(kind, schema_hash):
+        return '{"type": "object"}'
+
+    monkeypatch.setattr(schema, "get_schema", get_schema_)
+    metrics.reset()
+    client = TestClient(app)
+
+    response = client.get("/schema/hash1", headers={"X-Request-ID": "request_id"})
+    client.get("/schema/hash2")
+
+    assert response.headers["x-request-id"] == "request_id"
+    route = "GET /schema/{schema_hash}"
+    assert metrics.histograms[f"http_latency_sec:{route}"].count == 2
+    assert metrics.histograms[f"http_response_bytes:{route}"].sum == 2 * len('{"type": "object"}')
+    assert metrics.counters[f"http_status:{route}:200"] == 2
+
+
+@pytest.mark.asyncio
+async def test_streaming_response_is_passed_through():
+    async def chunks():
+        for chunk in (b"first", b"second"):
+            yield chunk
+
+    middleware = RequestInstrumentationMiddleware(StreamingResponse(chunks()))
+    messages = []
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware({"type": "http", "method": "GET", "path": "/stream", "headers": []}, receive, send)
+
+    assert [message.get("body") for message in messages if message["type"] == "http.response.body"][:2] == [b"first", b"second"]
+    assert (b"x-request-id", ) == tuple(name for name, _ in messages[0]["headers"] if name == b"x-request-id")
@@ -0,0 +1,43 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.core.services.schema as schema
+from app.main import app
+
+
+@pytest.fixture()
+def schema_client(monkeypatch):
+    calls = []
+
+    async def get_schema_(kind, schema_hash):
+        calls.append(schema_hash)
+        return '{"title": "Technical Assignment"}' if schema_hash == "schema_hash" else None
+
+    monkeypatch.setattr(schema, "get_schema", get_schema_)
+    client = TestClient(app)  # without lifespan, no db needed
+    client.schema_calls = calls
+    return client
+
+
+def test_get_schema(schema_client):
+    response = schema_client.get("/schema/schema_hash")
+
+    assert response.status_code == 200
+    assert response.json() == {"title": "Technical Assignment"}
+    assert response.headers["etag"] == '"schema_hash"'
+    assert "immutable" in response.headers["cache-control"]
+
+
+def test_get_schema_not_modified(schema_client):
+    response = schema_client.get("/schema/schema_hash", headers={"If-None-Match": '"schema_hash"'})
+
+    assert response.status_code == 304
+    assert schema_client.schema_calls == []
+
+
+def test_get_schema_not_found(schema_client):
+    response = schema_client.get("/schema/unknown")
+
+    # http errors are rendered with error page by app exception handler
+    assert response.status_code == 404
+    assert "Schema unknown not found" in response.text
@@ -1,10 +1,21 @@
+import asyncio
 import pytest
+from unittest.mock import AsyncMock
 from bson import ObjectId
+from fastapi import HTTPException
 
+import app.core.services.s3 as s3
+import app.core.services.image_store as image_store
+import app.core.services.groups as groups
 from app.core.services.assignment import (
     async_recursive_apply, recursive_apply, clean_dict_field, get_assignment_data,
-    duplicate_assignment, get_all_assignments_data, group_assignments_data
+    duplicate_assignment, get_all_assignments_data, group_assignments_data,
+    iter_images, get_images_for_assignment_from_s3, get_images_from_loc_concurrently,
+    upload_images_from_assignment_to_s3, get_store_image_keys, build_image_manifest, iter_assignment_images,
+    copy_images_to_store, update_assignment_in_db, SaveCoalescer
 )
+from app.core.services.utils import get_hash
+from app.core.models.assignment import ImageMode
 
 def test_recursive_apply(mock_utils):
     data = {
@@ -224,4 +235,367 @@ def test_group_assignments_data():
 
     assert len(result) == 2
     assert "group1" in result
-    assert len(result["group1"]["assignments"]) == 2
\ No newline at end of file
+    assert len(result["group1"]["assignments"]) == 2
+
+
+def test_iter_images(get_image_assignment):
+    result = [(path, image['image_location']) for path, image in iter_images(get_image_assignment)]
+
+    assert result == [
+        ('blocks.0.events.0.check_images.0', 's3://bucket_name/path/to/file/filename1.png'),
+        ('blocks.0.events.0.check_images.1', 's3://bucket_name/path/to/file/filename2.png'),
+        ('blocks.0.events.0.images.0', 's3://bucket_name/path/to/file/filename3.png'),
+        ('blocks.0.events.0.images.1', 's3://bucket_name/path/to/file/filename4.png'),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_images_concurrently_with_timeout(get_image_assignment, monkeypatch):
+
+    async def s3_to_base64_image_(file_key, bucket_name, prefix):
+        if file_key == 'filename2.png':
+            await asyncio.sleep(10)
+        return f"data:{file_key}"
+
+    monkeypatch.setattr(s3, 's3_to_base64_image', s3_to_base64_image_)
+
+    images = [image for _, image in iter_images(get_image_assignment)]
+    not_loaded = await get_images_from_loc_concurrently(images, 'image_location', 'image_data', timeout_sec=0.1)
+    event = get_image_assignment['blocks'][0]['events'][0]
+
+    assert not_loaded == 1
+
+    assert [image['image_data'] for image in event['check_images']] == ['data:filename1.png', None]
+    assert [image['image_data'] for image in event['images']] == ['data:filename3.png', 'data:filename4.png']
+
+
+
+@pytest.mark.asyncio
+async def test_get_images_for_assignment_from_s3(get_image_assignment, monkeypatch):
+
+    async def s3_to_base64_image_(file_key, bucket_name, prefix):
+        return f"data:{file_key}"
+
+    monkeypatch.setattr(s3, 's3_to_base64_image', s3_to_base64_image_)
+
+    result = await get_images_for_assignment_from_s3(get_image_assignment)
+
+    assert [image['image_data'] for _, image in iter_images(result)] == [
+        'data:filename1.png', 'data:filename2.png', 'data:filename3.png', 'data:filename4.png'
+    ]
+
+
+@pytest.mark.asyncio
+async def test_get_images_for_assignment_as_urls(get_image_assignment):
+    result = await get_images_for_assignment_from_s3(get_image_assignment, image_mode=ImageMode.url)
+
+    assert [image['image_data'] for _, image in iter_images(result)] == [
+        '/image/path/to/file/filename1.png', '/image/path/to/file/filename2.png',
+        '/image/path/to/file/filename3.png', '/image/path/to/file/filename4.png'
+    ]
+
+
+@pytest.mark.asyncio
+async def test_upload_only_changed_images(monkeypatch):
+    uploaded = []
+    stored_keys = {f"{get_hash('R0lGODlhAQ')}.png"}
+
+    async def base64_image_to_s3_(file_name_wo_ext, base64_string, prefix=''):
+        uploaded.append(file_name_wo_ext)
+        return f"s3://images/{file_name_wo_ext}.png"
+
+    async def is_stored_(key):
+        return key in stored_keys
+
+    async def register_image_(key, size=None):
+        stored_keys.add(key)
+
+    monkeypatch.setattr(s3, 'base64_image_to_s3', base64_image_to_s3_)
+    monkeypatch.setattr(image_store, 'is_stored', is_stored_)
+    monkeypatch.setattr(image_store, 'register_image', register_image_)
+
+    unchanged_hash = get_hash('iVBORw0KGgo')
+    data = {
+        'images': [
+            # unchanged, in legacy folder of assignment
+            {'image_data': 'data:image/png;base64,iVBORw0KGgo', 'image_location': f's3://images/assignment_id/{unchanged_hash}.png'},
+            # new one
+            {'image_data': 'data:image/png;base64,R0lGODlh', 'image_location': None},
+            # new for assignment, but already in store
+            {'image_data': 'data:image/png;base64,R0lGODlhAQ', 'image_location': None},
+            # url, not data
+            {'image_data': '/image/some_hash.png', 'image_location': 's3://images/some_hash.png'},
+        ]
+    }
+    upload_stats = {"uploaded": 0, "skipped": 0}
+
+    result = await upload_images_from_assignment_to_s3(data, assignment_id='assignment_id', upload_stats=upload_stats)
+
+    assert uploaded == [get_hash('R0lGODlh')]
+    assert upload_stats == {"uploaded": 1, "skipped": 2}
+    assert [image['image_location'] for image in result['images']] == [
+        f's3://images/assignment_id/{unchanged_hash}.png',
+        f's3://images/{get_hash("R0lGODlh")}.png',
+        f's3://images/{get_hash("R0lGODlhAQ")}.png',
+        's3://images/some_hash.png',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_upload_images_holds_keys_before_dedup(monkeypatch):
+    uploaded = []
+    referenced_keys = {f"{get_hash('R0lGODlhAQ')}.png"}
+
+    async def base64_image_to_s3_(file_name_wo_ext, base64_string, prefix=''):
+        uploaded.append(file_name_wo_ext)
+        return f"s3://images/{file_name_wo_ext}.png"
+
+    async def hold_image_(key):
+        return key in referenced_keys
+
+    monkeypatch.setattr(s3, 'base64_image_to_s3', base64_image_to_s3_)
+    monkeypatch.setattr(image_store, 'hold_image', hold_image_)
+    monkeypatch.setattr(image_store, 'is_stored', AsyncMock(side_effect=AssertionError("check without reference")))
+    monkeypatch.setattr(image_store, 'register_image', AsyncMock())
+
+    data = {'images': [
+        {'image_data': 'data:image/png;base64,R0lGODlh', 'image_location': None},
+        {'image_data': 'data:image/png;base64,R0lGODlhAQ', 'image_location': None},
+    ]}
+    upload_stats = {"uploaded": 0, "skipped": 0}
+    held_keys = []
+
+    await upload_images_from_assignment_to_s3(data, assignment_id='assignment_id', upload_stats=upload_stats, held_keys=held_keys)
+
+    # only object, that was referenced when it was held, is reused
+    assert uploaded == [get_hash('R0lGODlh')]
+    assert upload_stats == {"uploaded": 1, "skipped": 1}
+    assert held_keys == [f"{get_hash('R0lGODlh')}.png", f"{get_hash('R0lGODlhAQ')}.png"]
+
+
+def test_get_store_image_keys():
+    data = {
+        'images': [
+            {'image_location': 's3://images/assignment_id/legacy.png'},
+            {'image_location': 's3://images/hash1.png'},
+            {'image_location': None},
+        ],
+        'blocks': [{'check_images': [{'image_location': 's3://images/hash1.png'}, {'image_location': 's3://images/hash2.png'}]}]
+    }
+
+    assert get_store_image_keys(data) == {'hash1.png', 'hash2.png'}
+
+
+def test_build_image_manifest():
+    data = {
+        'images': [{'image_location': 's3://images/assignment_id/legacy.png'}, {'image_location': None}],
+        'blocks': [{'check_images': [{'image_location': 's3://images/hash1.png'}]}]
+    }
+
+    assert build_image_manifest(data) == [
+        {'path': 'images.0', 'key': 'assignment_id/legacy.png', 'size': None, 'hash': 'legacy'},
+        {'path': 'blocks.0.check_images.0', 'key': 'hash1.png', 'size': None, 'hash': 'hash1'},
+    ]
+
+
+def test_iter_assignment_images_from_manifest():
+    data = {
+        'images': [{'image_location': 's3://images/hash1.png'}],
+        'blocks': [{'check_images': [{'image_location': 's3://images/hash2.png'}]}],
+        'image_manifest': [{'path': 'blocks.0.check_images.0', 'key': 'hash2.png'}]
+    }
+
+    # only manifest is used, without walk over document
+    assert list(iter_assignment_images(data)) == [('blocks.0.check_images.0', {'image_location': 's3://images/hash2.png'})]
+    assert get_store_image_keys(data) == {'hash2.png'}
+
+
+@pytest.mark.asyncio
+async def test_copy_images_to_store(monkeypatch):
+    copied = []
+
+    async def copy_to_store_(s3_uri, held_keys, size=None):
+        copied.append((s3_uri, size))
+        held_keys.append(s3_uri.rsplit('/', 1)[-1])
+        return f"s3://images/{s3_uri.rsplit('/', 1)[-1]}"
+
+    monkeypatch.setattr(image_store, 'copy_to_store', copy_to_store_)
+
+    data = {'images': [{'image_location': 's3://images/assignment_id/hash1.png'}, {'image_location': 's3://images/hash2.png'}]}
+    data['image_manifest'] = build_image_manifest(data)
+    data['image_manifest'][0]['size'] = 10
+    held_keys = []
+
+    result = await copy_images_to_store(data, held_keys=held_keys)
+
+    assert copied == [('s3://images/assignment_id/hash1.png', 10)]
+    assert held_keys == ['hash1.png']
+    assert [image['image_location'] for image in result['images']] == ['s3://images/hash1.png', 's3://images/hash2.png']
+    assert [entry['key'] for entry in result['image_manifest']] == ['hash1.png', 'hash2.png']
+
+
+@pytest.mark.asyncio
+async def test_save_coalescer():
+    coalescer = SaveCoalescer(window_sec=0.05)
+    written = []
+
+    async def save_(state):
+        written.append(state)
+        return state
+
+    results = await asyncio.gather(*(coalescer.save('assignment_id', lambda state=state: save_(state)) for state in (1, 2, 3)))
+
+    # the latest state wins, every caller gets result of the same write
+    assert written == [3]
+    assert results == [3, 3, 3]
+
+
+@pytest.mark.asyncio
+async def test_save_coalescer_forced_flush():
+    coalescer = SaveCoalescer(window_sec=10)
+    written = []
+
+    async def save_():
+        written.append('state')
+        return 'state'
+
+    save_task = asyncio.create_task(coalescer.save('assignment_id', save_))
+    await asyncio.sleep(0)
+    await coalescer.flush('assignment_id')
+
+    assert await save_task == 'state'
+    assert written == ['state']
+
+
+@pytest.mark.asyncio
+async def test_save_coalescer_flush_waits_for_write_in_progress():
+    coalescer = SaveCoalescer(window_sec=0.01)
+    stored = {"name": "old"}
+    write_started = asyncio.Event()
+
+    async def save_():
+        write_started.set()
+        await asyncio.sleep(0.05)  # slow db write
+        stored["name"] = "new"
+        return dict(stored)
+
+    save_task = asyncio.create_task(coalescer.save('assignment_id', save_))
+    # timer has taken pending state, and its write is in progress
+    await write_started.wait()
+
+    assert await coalescer.flush('assignment_id')
+    assert stored == {"name": "new"}
+    assert await save_task == {"name": "new"}
+    # nothing is left, when nobody holds or waits for lock
+    assert not coalescer._write_locks and not coalescer._write_lock_users
+    assert not await coalescer.flush('assignment_id')
+
+
+@pytest.mark.asyncio
+async def test_save_coalescer_writes_are_serialized():
+    coalescer = SaveCoalescer(window_sec=0.01)
+    running, overlaps = [], []
+
+    async def save_(state):
+        overlaps.append(bool(running))
+        running.append(state)
+        await asyncio.sleep(0.02)
+        running.remove(state)
+        return state
+
+    first = asyncio.create_task(coalescer.save('assignment_id', lambda: save_(1)))
+    await asyncio.sleep(0.015)  # first write is in progress
+    second = asyncio.create_task(coalescer.save('assignment_id', lambda: save_(2)))
+    flush = asyncio.create_task(coalescer.flush('assignment_id'))
+
+    assert await asyncio.gather(first, second, flush) == [1, 2, True]
+    assert overlaps == [False, False]
+    assert not coalescer._write_locks
+
+
+@pytest.mark.asyncio
+async def test_update_assignment_save_counter_is_incremented_by_db(monkeypatch):
+    assignment_id = str(ObjectId())
+    collection = AsyncMock()
+    collection.find_one.return_value = {"_id": ObjectId(assignment_id), "image_manifest": [], "save_counter": 7}
+    collection.find_one_and_update.return_value = {"_id": ObjectId(assignment_id), "save_counter": 8}
+    monkeypatch.setattr(image_store, "acquire_images", AsyncMock())
+    monkeypatch.setattr(image_store, "release_images", AsyncMock())
+    monkeypatch.setattr(groups, "recompute_group", AsyncMock())
+
+    result = await update_assignment_in_db(
+        assignment_id, {"id": assignment_id, "name": "new", "save_counter": 100, "blocks": []}, collection
+    )
+
+    assert result["save_counter"] == 8
+    query, (set_stage, inc_stage, _) = collection.find_one_and_update.await_args.args
+    # write is conditional on version, that manifest was read from
+    assert query == {"_id": ObjectId(assignment_id), "save_counter": 7}
+    # value from client isn't written
+    assert "save_counter" not in set_stage["$set"]
+    assert inc_stage == {"$set": {"save_counter": {"$add": [{"$ifNull": ["$save_counter", 0]}, 1]}}}
+
+
+@pytest.mark.asyncio
+async def test_update_assignment_concurrent_save_is_retried(monkeypatch):
+    assignment_id = str(ObjectId())
+    image = {"image_location": "s3://images/new.png"}
+    collection = AsyncMock()
+    # other save has replaced old.png with other.png between read of manifest and write
+    collection.find_one.side_effect = [
+        {"image_manifest": [{"path": "blocks.0.images.0", "key": "old.png"}], "save_counter": 1},
+        {"image_manifest": [{"path": "blocks.0.images.0", "key": "other.png"}], "save_counter": 2},
+    ]
+    collection.find_one_and_update.side_effect = [None, {"_id": ObjectId(assignment_id), "save_counter": 3}]
+    monkeypatch.setattr(image_store, "get_sizes", AsyncMock(return_value={}))
+    monkeypatch.setattr(image_store, "acquire_images", AsyncMock())
+    monkeypatch.setattr(image_store, "release_images", AsyncMock())
+    monkeypatch.setattr(groups, "recompute_group", AsyncMock())
+
+    result = await update_assignment_in_db(assignment_id, {"id": assignment_id, "blocks": [{"images": [image]}]}, collection)
+
+    assert result["save_counter"] == 3
+    assert [call.args[0]["save_counter"] for call in collection.find_one_and_update.await_args_list] == [1, 2]
+    # not saved attempt releases, what it has acquired, and saved one releases key of version, that it has replaced
+    assert [call.args[0] for call in image_store.acquire_images.await_args_list] == [{"new.png"}, {"new.png"}]
+    assert [call.args[0] for call in image_store.release_images.await_args_list] == [{"new.png"}, {"other.png"}]
+
+
+@pytest.mark.asyncio
+async def test_update_assignment_conflict(monkeypatch):
+    collection = AsyncMock()
+    collection.find_one.return_value = {"image_manifest": [], "save_counter": 1}
+    collection.find_one_and_update.return_value = None
+    monkeypatch.setattr(image_store, "acquire_images", AsyncMock())
+    monkeypatch.setattr(image_store, "release_images", AsyncMock())
+
+    with pytest.raises(HTTPException) as e:
+        await update_assignment_in_db(str(ObjectId()), {"id": "id", "blocks": []}, collection)
+    assert e.value.status_code == 409
+
+    collection.find_one.return_value = None
+    assert await update_assignment_in_db(str(ObjectId()), {"id": "id", "blocks": []}, collection) is None
+
+
+@pytest.mark.asyncio
+async def test_save_coalescer_cancelled_flush_resolves_waiters():
+    coalescer = SaveCoalescer(window_sec=10)
+    write_started = asyncio.Event()
+
+    async def save_():
+        write_started.set()
+        await asyncio.sleep(10)
+
+    save_task = asyncio.create_task(coalescer.save('assignment_id', save_))
+    await asyncio.sleep(0)
+    # e.g. delete request flushes inline, and it's cancelled during write
+    flush_task = asyncio.create_task(coalescer.flush('assignment_id'))
+    await write_started.wait()
+    flush_task.cancel()
+
+    with pytest.raises(asyncio.CancelledError):
+        await flush_task
+    with pytest.raises(HTTPException) as e:
+        await asyncio.wait_for(save_task, timeout=1)
+    assert e.value.status_code == 503
+    assert not coalescer._pending and not coalescer._write_locks
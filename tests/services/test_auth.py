@@ -0,0 +1,95 @@
+import pytest
+from unittest.mock import AsyncMock
+
+import app.core.services.auth as auth
+import app.core.services.database as db
+from app.core.services.cache import TTLCache
+from app.core.services.auth import LoginAttemptLimiter
+
+
+def test_ttl_cache_expires():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl_sec=10, clock=lambda: now[0])
+    cache.set("a", 1)
+
+    now[0] = 9.9
+    assert cache.get("a") == 1
+    assert "a" in cache
+
+    now[0] = 10
+    assert cache.get("a") is None
+    assert "a" not in cache
+    assert len(cache) == 0
+
+
+@pytest.fixture()
+def users(monkeypatch):
+    lookups = []
+    stamp = {"_id": auth.USERS_VERSION_ID, "version": 0}
+
+    async def get_obj_by_fields_(query, collection, filter_cols=None, find_many=False):
+        lookups.append(query["username"])
+        return {"_id": "507f1f77bcf86cd799439011", "username": query["username"], "hashed_password": ""}
+
+    meta_collection = AsyncMock()
+    meta_collection.find_one.side_effect = lambda query: dict(stamp)
+
+    monkeypatch.setattr(db, "get_collection", AsyncMock())
+    monkeypatch.setattr(db, "get_obj_by_fields", get_obj_by_fields_)
+    monkeypatch.setattr(auth, "get_meta_collection", AsyncMock(return_value=meta_collection))
+    monkeypatch.setattr(auth.settings, "app_users_version_check_sec", 0)
+    auth.cached_users.clear()
+    yield lookups, stamp
+    auth.cached_users.clear()
+
+
+@pytest.mark.asyncio
+async def test_get_user_is_cached(users):
+    lookups, stamp = users
+
+    assert (await auth.get_user("admin")).username == "admin"
+    assert (await auth.get_user("admin")).username == "admin"
+    assert lookups == ["admin"]
+
+    # password is checked against stored user
+    await auth.get_user("admin", use_cache=False)
+    assert lookups == ["admin", "admin"]
+
+
+@pytest.mark.asyncio
+async def test_cached_users_are_dropped_on_version_change(users):
+    lookups, stamp = users
+
+    await auth.get_user("admin")
+    stamp["version"] += 1  # user is changed by other worker
+    await auth.get_user("admin")
+
+    assert lookups == ["admin", "admin"]
+
+
+@pytest.mark.asyncio
+async def test_password_hashing_in_pool():
+    hashed_password = await auth.get_password_hash("secret")
+
+    assert await auth.verify_password("secret", hashed_password)
+    assert not await auth.verify_password("wrong", hashed_password)
+
+
+def test_login_attempt_limiter():
+    now = [0.0]
+    limiter = LoginAttemptLimiter(max_attempts=2, window_sec=60, clock=lambda: now[0])
+    key = ("admin", "127.0.0.1")
+
+    limiter.register_failure(key)
+    now[0] = 10
+    limiter.register_failure(key)
+    assert limiter.get_retry_after(key) == 50
+    assert limiter.get_retry_after(("admin", "10.0.0.1")) == 0
+
+    # the first failure leaves window
+    now[0] = 60
+    assert limiter.get_retry_after(key) == 0
+
+    limiter.register_failure(key)
+    limiter.reset(key)
+    assert limiter.get_retry_after(key) == 0
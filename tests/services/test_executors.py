@@ -0,0 +1,49 @@
+import base64
+import hashlib
+import threading
+import pytest
+
+import app.core.services.executors as executors
+from app.core.services.metrics import metrics
+
+
+def test_b64_by_chunks(monkeypatch):
+    monkeypatch.setattr(executors, "B64_CHUNK_CHARS", 8)
+    monkeypatch.setattr(executors, "B64_CHUNK_BYTES", 6)
+    data = bytes(range(256)) * 3 + b"tail"
+    encoded = base64.b64encode(data).decode('utf-8')
+
+    assert executors.b64encode(data) == encoded
+    assert executors.b64decode(encoded) == data
+
+
+def test_b64decode_wrapped(monkeypatch):
+    monkeypatch.setattr(executors, "B64_CHUNK_CHARS", 8)
+    data = bytes(range(256)) * 3 + b"tail"
+
+    # line breaks every 76 characters, as base64.encodebytes makes
+    wrapped = base64.encodebytes(data)
+    assert executors.b64decode(wrapped) == data
+    assert executors.b64decode(wrapped.decode().replace("\n", "\r\n")) == data
+    # not aligned to quantum: decoded at once, with the same error, as b64decode
+    with pytest.raises(ValueError):
+        executors.b64decode(base64.b64encode(data)[:-1])
+
+
+@pytest.mark.asyncio
+async def test_offload(monkeypatch):
+    monkeypatch.setattr(executors.settings, "app_offload_min_size", 100)
+    metrics.reset()
+
+    def md5(data: bytes) -> tuple[str, str]:
+        return hashlib.md5(data).hexdigest(), threading.current_thread().name
+
+    _, thread_name = await executors.offload('md5', md5, b"small", size=5)
+    assert thread_name == threading.current_thread().name
+
+    _, thread_name = await executors.offload('md5', md5, b"x" * 100, size=100)
+    assert thread_name.startswith('offload')
+
+    assert metrics.histograms["loop_busy_sec:md5"].count == 1
+    assert metrics.histograms["offload_sec:md5"].count == 1
+    executors.shutdown_executors()
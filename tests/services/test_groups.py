@@ -0,0 +1,70 @@
+import pytest
+import datetime as dt
+from pymongo.errors import DuplicateKeyError
+from unittest.mock import MagicMock, AsyncMock
+
+import app.core.services.groups as groups
+from app.core.services.groups import get_summary_pipeline, recompute_group, rebuild_groups
+
+
+def aggregate_returning(result):
+    aggregation = MagicMock()
+    aggregation.to_list = AsyncMock(return_value=result)
+    return MagicMock(return_value=aggregation)
+
+
+@pytest.fixture()
+def groups_collection(monkeypatch):
+    groups_collection = AsyncMock()
+    monkeypatch.setattr(groups, "get_groups_collection", AsyncMock(return_value=groups_collection))
+    return groups_collection
+
+
+def test_get_summary_pipeline():
+    pipeline = get_summary_pipeline({"group_id": "group"})
+
+    assert pipeline[:2] == [{"$match": {"group_id": "group"}}, {"$sort": {"group_id": 1, "version": -1}}]
+    assert pipeline[2]["$group"]["_id"] == "$group_id"
+
+
+@pytest.mark.asyncio
+async def test_recompute_group(groups_collection):
+    summary = {"_id": "group", "group_name": "name", "latest_version": 2, "count": 2, "recomputed_at": dt.datetime(2024, 1, 1)}
+    collection = MagicMock()
+    collection.aggregate = aggregate_returning([summary])
+
+    assert await recompute_group("group", collection) == summary
+    assert collection.aggregate.call_args.args[0][-1] == {"$set": {"recomputed_at": "$$NOW"}}
+    # summary isn't replaced by one, that was read earlier
+    groups_collection.replace_one.assert_awaited_once_with(
+        {"_id": "group", "recomputed_at": {"$not": {"$gt": dt.datetime(2024, 1, 1)}}}, summary, upsert=True
+    )
+
+    # summary, that was read later, is saved already: upsert conflicts with it
+    groups_collection.replace_one.side_effect = DuplicateKeyError("duplicate key")
+    assert await recompute_group("group", collection) == summary
+
+    # the last version is deleted
+    collection.aggregate = aggregate_returning([])
+
+    assert await recompute_group("group", collection) is None
+    groups_collection.delete_one.assert_awaited_once_with({"_id": "group"})
+
+    assert await recompute_group(None, collection) is None
+
+
+@pytest.mark.asyncio
+async def test_rebuild_groups(groups_collection):
+    summaries = [{"_id": f"group{i}"} for i in range(3)]
+
+    async def aggregate_(pipeline, **kwargs):
+        for summary in summaries:
+            yield summary
+
+    collection = MagicMock()
+    collection.aggregate = aggregate_
+    groups_collection.delete_many.return_value = MagicMock(deleted_count=1)
+
+    assert await rebuild_groups(collection, batch_size=2) == 3
+    assert [len(call.args[0]) for call in groups_collection.bulk_write.await_args_list] == [2, 1]
+    groups_collection.delete_many.assert_awaited_once_with({"_id": {"$nin": ["group0", "group1", "group2"]}})
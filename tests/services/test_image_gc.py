@@ -0,0 +1,121 @@
+import pytest
+import datetime as dt
+from unittest.mock import AsyncMock, MagicMock
+from pymongo.errors import DuplicateKeyError
+
+import app.core.services.s3 as s3
+import app.core.services.database as db
+import app.core.services.image_store as image_store
+import app.core.services.image_gc as image_gc
+
+
+OLD = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=2)
+
+
+def find_yielding(documents_by_query):
+
+    def find_(query, projection):
+        async def documents():
+            for document in documents_by_query(query):
+                yield document
+        return documents()
+
+    return find_
+
+
+@pytest.fixture()
+def fake_s3_client(make_fake_s3_client, monkeypatch):
+    client = make_fake_s3_client([
+        {"Key": "referenced.png", "Size": 10, "LastModified": OLD},
+        {"Key": "legacy_referenced.png", "Size": 10, "LastModified": OLD},
+        {"Key": "held.png", "Size": 10, "LastModified": OLD},
+        {"Key": "just_uploaded.png", "Size": 10, "LastModified": dt.datetime.now(dt.timezone.utc)},
+        *({"Key": f"orphaned_{i}.png", "Size": 100 + i, "LastModified": OLD} for i in range(3)),
+        {"Key": "assignment_id/orphaned.png", "Size": 1000, "LastModified": OLD},
+    ], page_size=3)
+    monkeypatch.setattr(s3, "DELETE_OBJECTS_BATCH_SIZE", 2)
+    return client
+
+
+@pytest.fixture()
+def images_collection(monkeypatch):
+    collection = MagicMock()
+    collection.find = find_yielding(lambda query: [{"_id": "held.png"}])
+    collection.update_one = AsyncMock()
+    collection.delete_many = AsyncMock()
+    collection.update_many = AsyncMock()
+    monkeypatch.setattr(image_store, "get_images_collection", AsyncMock(return_value=collection))
+    return collection
+
+
+@pytest.fixture()
+def assignments_collection():
+    collection = MagicMock()
+    collection.find = find_yielding(lambda query: (
+        [{"image_manifest": [{"key": "referenced.png"}]}] if query["image_manifest"] else
+        # document without manifest
+        [{"blocks": [{"images": [{"image_location": "s3://images/legacy_referenced.png"}]}]}]
+    ))
+    return collection
+
+
+@pytest.mark.asyncio
+async def test_collect_orphaned_images(fake_s3_client, images_collection, assignments_collection):
+    report = await image_gc.collect_orphaned_images(assignments_collection, bucket_name="images", grace_period_sec=3600)
+
+    assert report == {"scanned": 8, "deleted": 4, "reclaimed_bytes": 100 + 101 + 102 + 1000}
+    assert fake_s3_client.list_requests == 3
+    assert sorted(fake_s3_client.objects) == ["held.png", "just_uploaded.png", "legacy_referenced.png", "referenced.png"]
+    # every listing page is deleted with its own requests, by batches
+    assert sorted(sum(fake_s3_client.delete_requests, [])) == ["assignment_id/orphaned.png", "orphaned_0.png", "orphaned_1.png", "orphaned_2.png"]
+    assert all(len(batch) <= 2 for batch in fake_s3_client.delete_requests)
+    # only store keys are marked as deleting, and their counters are removed, unless someone has acquired them meanwhile
+    marked = [call.args[0]["_id"] for call in images_collection.update_one.await_args_list]
+    assert sorted(marked) == ["orphaned_0.png", "orphaned_1.png", "orphaned_2.png"]
+    deleted_counters = sum((call.args[0]["_id"]["$in"] for call in images_collection.delete_many.await_args_list), [])
+    assert sorted(deleted_counters) == ["orphaned_0.png", "orphaned_1.png", "orphaned_2.png"]
+    assert all(call.args[0]["refcount"] == {"$not": {"$gt": 0}} for call in images_collection.delete_many.await_args_list)
+
+
+@pytest.mark.asyncio
+async def test_collect_orphaned_images_keeps_key_held_during_run(fake_s3_client, images_collection, assignments_collection):
+
+    async def update_one_(query, update, upsert):
+        # save has held orphaned key and uploaded it again after listing
+        if query["_id"] == "orphaned_1.png":
+            raise DuplicateKeyError("duplicate key")
+
+    images_collection.update_one.side_effect = update_one_
+
+    report = await image_gc.collect_orphaned_images(assignments_collection, bucket_name="images", grace_period_sec=3600)
+
+    assert report == {"scanned": 8, "deleted": 3, "reclaimed_bytes": 100 + 102 + 1000}
+    assert "orphaned_1.png" in fake_s3_client.objects
+
+
+@pytest.mark.asyncio
+async def test_collect_orphaned_images_dry_run(fake_s3_client, images_collection, assignments_collection):
+    report = await image_gc.collect_orphaned_images(assignments_collection, bucket_name="images", grace_period_sec=3600, dry_run=True)
+
+    assert report == {"scanned": 8, "deleted": 4, "reclaimed_bytes": 1303}
+    assert len(fake_s3_client.objects) == 8
+    assert fake_s3_client.delete_requests == []
+    images_collection.delete_many.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_acquire_gc_lease(monkeypatch):
+    meta_collection = AsyncMock()
+    monkeypatch.setattr(db, "get_collection", AsyncMock(return_value=meta_collection))
+
+    assert await image_gc.acquire_gc_lease(lease_sec=60, owner="worker_1")
+    query, update = meta_collection.update_one.await_args.args
+    # expired lease, or own one
+    assert query["_id"] == image_gc.GC_LEASE_ID
+    assert query["$or"][1] == {"owner": "worker_1"}
+    assert update["$set"]["owner"] == "worker_1"
+    assert meta_collection.update_one.await_args.kwargs == {"upsert": True}
+
+    # lease of other worker isn't matched, so upsert conflicts with it
+    meta_collection.update_one.side_effect = DuplicateKeyError("duplicate key")
+    assert not await image_gc.acquire_gc_lease(lease_sec=60, owner="worker_2")
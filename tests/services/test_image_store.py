@@ -0,0 +1,113 @@
+import base64
+import datetime as dt
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from pymongo.errors import DuplicateKeyError
+
+import app.core.services.s3 as s3
+import app.core.services.image_store as image_store
+from app.core.services.image_store import get_base64_decoded_size, get_image_key, is_content_addressed, get_keys_diff
+from app.core.services.image_gc import get_orphaned_objects
+
+
+def test_get_base64_decoded_size():
+    for data in (b"", b"a", b"ab", b"abc", b"abcd" * 100):
+        assert get_base64_decoded_size(base64.b64encode(data).decode()) == len(data)
+
+
+def test_image_keys():
+    assert get_image_key("s3://images/hash.png") == "hash.png"
+    assert get_image_key("s3://images/assignment_id/hash.png") == "assignment_id/hash.png"
+    assert is_content_addressed("s3://images/hash.png")
+    assert not is_content_addressed("s3://images/assignment_id/hash.png")
+
+
+def test_get_keys_diff():
+    assert get_keys_diff(old_keys={"a", "b"}, new_keys={"b", "c"}) == ({"c"}, {"a"})
+
+
+def test_get_orphaned_objects():
+    now = dt.datetime.now(dt.timezone.utc)
+    page = [
+        {"Key": "referenced.png", "LastModified": now - dt.timedelta(days=2)},
+        {"Key": "held.png", "LastModified": now - dt.timedelta(days=2)},
+        {"Key": "assignment_id/orphaned.png", "LastModified": now - dt.timedelta(days=2)},
+        {"Key": "just_uploaded.png", "LastModified": now},
+    ]
+
+    orphaned = get_orphaned_objects(page, referenced_keys={"referenced.png"}, held_keys={"held.png"}, older_than=now - dt.timedelta(days=1))
+
+    assert [obj["Key"] for obj in orphaned] == ["assignment_id/orphaned.png"]
+
+
+
+@pytest.mark.asyncio
+async def test_hold_image(monkeypatch):
+    images_collection = AsyncMock()
+    monkeypatch.setattr(image_store, "get_images_collection", AsyncMock(return_value=images_collection))
+
+    # reference is taken before check
+    images_collection.find_one_and_update.return_value = {"_id": "hash.png", "refcount": 2}
+    assert await image_store.hold_image("hash.png")
+    assert images_collection.find_one_and_update.await_args.args[1]["$inc"] == {"refcount": 1}
+
+    # new key, or not referenced object (it can be deleted by GC) is uploaded
+    for previous in (None, {"_id": "hash.png", "refcount": 0}):
+        images_collection.find_one_and_update.return_value = previous
+        assert not await image_store.hold_image("hash.png")
+
+    # object is being deleted: upload waits for deletion
+    monkeypatch.setattr(image_store, "DELETION_POLL_SEC", 0)
+    images_collection.find_one_and_update.return_value = {"_id": "hash.png", "refcount": 0, "deleting": "2024-01-01T10:00:00"}
+    images_collection.count_documents.side_effect = [1, 1, 0]
+    assert not await image_store.hold_image("hash.png")
+    assert images_collection.count_documents.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_release_images_deletes_object_before_counter(monkeypatch):
+    calls = []
+
+    async def find_(query, projection):
+        for key in ("a.png", "b.png"):
+            yield {"_id": key}
+
+    images_collection = MagicMock()
+    images_collection.bulk_write = AsyncMock()
+    images_collection.find = find_
+    def update_one_(query, update, upsert):
+        calls.append("mark")
+        # b.png is acquired by someone else, between find and mark, so upsert conflicts with its counter
+        if query["_id"] == "b.png":
+            raise DuplicateKeyError("duplicate key")
+
+    images_collection.update_one = AsyncMock(side_effect=update_one_)
+    images_collection.delete_many = AsyncMock(side_effect=lambda query: calls.append("delete counters"))
+    images_collection.update_many = AsyncMock(side_effect=lambda query, update: calls.append("unmark"))
+    monkeypatch.setattr(image_store, "get_images_collection", AsyncMock(return_value=images_collection))
+    monkeypatch.setattr(s3, "delete_files", AsyncMock(side_effect=lambda keys, bucket_name: calls.append("delete objects") or len(keys)))
+
+    assert await image_store.release_images(["a.png", "b.png"]) == 1
+
+    s3.delete_files.assert_awaited_once_with(["a.png"], bucket_name=image_store.settings.s3_images_bucket)
+    # counter is deleted only if it's still not referenced, otherwise mark is removed, so holder uploads object again
+    assert calls == ["mark", "mark", "delete objects", "delete counters", "unmark"]
+    assert images_collection.delete_many.await_args.args[0] == {"_id": {"$in": ["a.png"]}, "refcount": {"$not": {"$gt": 0}}}
+
+
+@pytest.mark.asyncio
+async def test_copy_to_store_holds_key(monkeypatch):
+    monkeypatch.setattr(s3, "copy_file", AsyncMock())
+    monkeypatch.setattr(image_store, "register_image", AsyncMock())
+    held_keys = []
+
+    # referenced already: object is reused under reference
+    monkeypatch.setattr(image_store, "hold_image", AsyncMock(return_value=True))
+    assert await image_store.copy_to_store("s3://images/assignment_id/hash.png", held_keys=held_keys) == "s3://images/hash.png"
+    s3.copy_file.assert_not_awaited()
+
+    monkeypatch.setattr(image_store, "hold_image", AsyncMock(return_value=False))
+    await image_store.copy_to_store("s3://images/assignment_id/hash.png", held_keys=held_keys, size=10)
+    s3.copy_file.assert_awaited_once_with(src_key="assignment_id/hash.png", dst_key="hash.png", bucket_name="images")
+    image_store.register_image.assert_awaited_once_with("hash.png", size=10)
+    assert held_keys == ["hash.png", "hash.png"]
@@ -0,0 +1,28 @@
+import pytest
+from unittest.mock import AsyncMock
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+
+import app.core.services.database as db
+from app.core.services.indexes import create_indexes, INDEXES
+
+
+def test_indexes_are_named():
+    names = [index.document['name'] for indexes in INDEXES.values() for index, _ in indexes]
+    assert len(names) == len(set(names))
+
+
+@pytest.mark.asyncio
+async def test_create_indexes_skips_failed(monkeypatch):
+    collection = AsyncMock()
+    collection.create_indexes.side_effect = [OperationFailure("duplicate key"), ["b"]]
+
+    async def get_collection_(db_name, collection_name):
+        return collection
+
+    monkeypatch.setattr(db, 'get_collection', get_collection_)
+
+    indexes = {"users": [(IndexModel("a", name="a", unique=True), "a"), (IndexModel("b", name="b"), "b")]}
+
+    assert await create_indexes(indexes) == 1
+    assert collection.create_indexes.await_count == 2
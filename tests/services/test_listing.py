@@ -0,0 +1,150 @@
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+from bson import ObjectId
+from fastapi import HTTPException
+
+import app.core.services.groups as groups_service
+from app.core.services.listing import (
+    build_assignments_query, encode_cursor, decode_cursor, get_keyset_filter, get_groups_pipeline,
+    list_assignments, list_assignment_groups
+)
+
+
+def find_returning(*results):
+    """Mock of collection.find(...).sort(...)[.limit(...)].to_list(...) chain"""
+    cursors = []
+    for result in results:
+        cursor = MagicMock()
+        cursor.sort.return_value = cursor
+        cursor.limit.return_value = cursor
+        cursor.to_list = AsyncMock(return_value=result)
+        cursors.append(cursor)
+    return MagicMock(side_effect=cursors)
+
+
+def test_build_assignments_query():
+    assert build_assignments_query() == {}
+    assert build_assignments_query(status="Review", author="admin", issue="", name_prefix="Main (v2)") == {
+        "status": "Review", "author": "admin", "name": {"$regex": r"^Main\ \(v2\)"}
+    }
+
+
+def test_cursor():
+    cursor = encode_cursor("2024-01-01T10:00:00", "507f1f77bcf86cd799439011")
+    assert decode_cursor(cursor) == ["2024-01-01T10:00:00", "507f1f77bcf86cd799439011"]
+
+    for invalid in (
+        "not a cursor",
+        encode_cursor("2024-01-01T10:00:00"),
+        # operators and other non-string values aren't passed to query
+        encode_cursor("2024-01-01T10:00:00", {"$ne": None}),
+        encode_cursor(["2024-01-01T10:00:00"], "group0"),
+        encode_cursor(1, None),
+    ):
+        with pytest.raises(HTTPException) as e:
+            decode_cursor(invalid)
+        assert e.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_list_with_invalid_cursor():
+    collection = MagicMock()
+
+    for list_function, cursor in (
+        (list_assignments, encode_cursor("2024-01-01T10:00:00", "not object id")),
+        (list_assignments, encode_cursor("2024-01-01T10:00:00", {"$gt": ""})),
+        (list_assignment_groups, encode_cursor({"$gt": ""}, "group0")),
+    ):
+        with pytest.raises(HTTPException) as e:
+            await list_function(collection, {"author": "admin"}, limit=10, cursor=cursor)
+        assert e.value.status_code == 422
+    collection.find.assert_not_called()
+    collection.aggregate.assert_not_called()
+
+
+def test_get_keyset_filter():
+    assert get_keyset_filter(("updated_at", "_id"), ("2024-01-01", 5)) == {"$or": [
+        {"updated_at": {"$lt": "2024-01-01"}},
+        {"updated_at": "2024-01-01", "_id": {"$lt": 5}},
+    ]}
+
+
+@pytest.mark.asyncio
+async def test_list_assignments_pages():
+    ids = [ObjectId() for _ in range(3)]
+    collection = MagicMock()
+    collection.find = find_returning(
+        [{"_id": ids[0], "updated_at": "3"}, {"_id": ids[1], "updated_at": "2"}, {"_id": ids[2], "updated_at": "1"}],
+        [{"_id": ids[2], "updated_at": "1"}],
+    )
+
+    assignments, next_cursor = await list_assignments(collection, {"status": "Review"}, limit=2)
+
+    assert [assignment["id"] for assignment in assignments] == [str(ids[0]), str(ids[1])]
+    assert decode_cursor(next_cursor) == ["2", str(ids[1])]
+
+    assignments, next_cursor = await list_assignments(collection, {"status": "Review"}, limit=2, cursor=next_cursor)
+
+    assert [assignment["id"] for assignment in assignments] == [str(ids[2])]
+    assert next_cursor is None
+    query, _ = collection.find.call_args.args
+    assert query == {"$and": [
+        {"status": "Review"},
+        {"$or": [{"updated_at": {"$lt": "2"}}, {"updated_at": "2", "_id": {"$lt": ids[1]}}]},
+    ]}
+
+
+def test_get_groups_pipeline():
+    pipeline = get_groups_pipeline({"author": "admin"}, limit=10, after=["2024-01-01", "group"])
+
+    assert pipeline[0] == {"$match": {"author": "admin"}}
+    assert pipeline[-3] == {"$match": {"$or": [{"last_update": {"$lt": "2024-01-01"}}, {"last_update": "2024-01-01", "_id": {"$lt": "group"}}]}}
+    assert pipeline[-1] == {"$limit": 11}
+
+
+@pytest.mark.asyncio
+async def test_list_assignment_groups():
+    latest_ids = [ObjectId(), ObjectId()]
+    collection = MagicMock()
+    aggregation = MagicMock()
+    aggregation.to_list = AsyncMock(return_value=[
+        {"_id": "group2", "group_name": "b", "latest_id": latest_ids[1], "latest_version": 2, "count": 2, "last_update": "2024-01-03T10:00:00"},
+        {"_id": "group1", "group_name": "a", "latest_id": latest_ids[0], "latest_version": 1, "count": 1, "last_update": "2024-01-01T10:00:00"},
+    ])
+    collection.aggregate.return_value = aggregation
+    collection.find = find_returning([
+        {"_id": latest_ids[1], "group_id": "group2", "created_at": "2024-01-02T10:00:00", "updated_at": "2024-01-03T10:00:00"},
+        {"_id": ObjectId(), "group_id": "group2", "created_at": "2024-01-01T10:00:00", "updated_at": "2024-01-02T10:00:00"},
+        {"_id": latest_ids[0], "group_id": "group1", "created_at": "2024-01-01T10:00:00", "updated_at": "2024-01-01T10:00:00"},
+    ])
+
+    groups, next_cursor = await list_assignment_groups(collection, {"author": "admin"}, limit=1)
+
+    # only groups of page are read
+    assert list(groups) == ["group2"]
+    assert collection.find.call_args.args[0] == {"author": "admin", "group_id": {"$in": ["group2"]}}
+    assert decode_cursor(next_cursor) == ["2024-01-03T10:00:00", "group2"]
+    assert groups["group2"]["count"] == 2
+    assert groups["group2"]["last_update"] == "2024-01-03 10:00"
+    assert [assignment["updated_at"] for assignment in groups["group2"]["assignments"]] == ["2024-01-03 10:00", "2024-01-02 10:00"]
+
+
+@pytest.mark.asyncio
+async def test_list_assignment_groups_without_filters_reads_summaries(monkeypatch):
+    latest_id = ObjectId()
+    groups_collection = MagicMock()
+    groups_collection.find = find_returning([
+        {"_id": "group1", "group_name": "a", "latest_id": latest_id, "latest_version": 1, "count": 1, "last_update": "2024-01-01T10:00:00"},
+    ])
+    monkeypatch.setattr(groups_service, "get_groups_collection", AsyncMock(return_value=groups_collection))
+    collection = MagicMock()
+    collection.find = find_returning([{"_id": latest_id, "group_id": "group1", "updated_at": "2024-01-01T10:00:00"}])
+
+    groups, next_cursor = await list_assignment_groups(collection, {}, limit=10, cursor=encode_cursor("2024-01-02T10:00:00", "group0"))
+
+    collection.aggregate.assert_not_called()
+    assert groups_collection.find.call_args.args[0] == {"$or": [
+        {"last_update": {"$lt": "2024-01-02T10:00:00"}}, {"last_update": "2024-01-02T10:00:00", "_id": {"$lt": "group0"}}
+    ]}
+    assert groups["group1"]["latest_id"] == str(latest_id)
+    assert next_cursor is None
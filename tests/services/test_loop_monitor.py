@@ -0,0 +1,39 @@
+import asyncio
+import time
+import pytest
+
+from app.core.services.loop_monitor import LoopMonitor
+from app.core.services.metrics import metrics
+from app.logger import request_id_var, route_var
+
+
+def block_loop(sec: float):
+    time.sleep(sec)
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_captures_blocking_request():
+    metrics.reset()
+    monitor = LoopMonitor(interval_sec=0.02, threshold_sec=0.1, stalls_kept=5)
+    monitor.start()
+
+    async def handle_request():
+        request_id_var.set("request_id")
+        route_var.set("GET /assignment/list")
+        await asyncio.sleep(0.05)
+        block_loop(0.4)
+
+    try:
+        await asyncio.create_task(handle_request())
+        await asyncio.sleep(0.1)
+    finally:
+        monitor.stop()
+
+    # stall is reported once
+    assert len(monitor.stalls) == 1
+    stall = monitor.stalls[0]
+    assert stall["route"] == "GET /assignment/list"
+    assert stall["request_id"] == "request_id"
+    assert "block_loop" in stall["stack"]
+    assert metrics.counters["loop_stalls"] == 1
+    assert monitor.snapshot()["lag"]["max"] >= 0.3
@@ -0,0 +1,185 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from bson import ObjectId
+from fastapi import HTTPException
+
+import app.core.services.image_store as image_store
+from app.core.services.patch import (
+    parse_pointer, build_update, build_conditions, apply_patch, build_update_from_document, is_affecting_images, patch_assignment_in_db
+)
+from app.core.models.assignment import PatchOperation
+
+
+def ops(*operations):
+    return [PatchOperation(**operation) for operation in operations]
+
+
+def test_parse_pointer():
+    assert parse_pointer("/blocks/0/a~1b~0c") == ["blocks", "0", "a/b~c"]
+
+
+def test_build_update():
+    update = build_update(ops(
+        {"op": "replace", "path": "/blocks/0/name", "value": "new"},
+        {"op": "add", "path": "/blocks/1/events/-", "value": {"name": "event"}},
+        {"op": "add", "path": "/blocks/2/events/0", "value": {"name": "first"}},
+        {"op": "remove", "path": "/description"},
+    ))
+
+    assert update == {
+        "$set": {"blocks.0.name": "new"},
+        "$unset": {"description": ""},
+        "$push": {"blocks.1.events": {"name": "event"}, "blocks.2.events": {"$each": [{"name": "first"}], "$position": 0}},
+    }
+
+
+def test_build_conditions():
+    conditions = build_conditions(ops(
+        {"op": "replace", "path": "/blocks/0/name", "value": "new"},
+        {"op": "add", "path": "/blocks/1/events/-", "value": {"name": "event"}},
+        {"op": "add", "path": "/blocks/2/events/5", "value": {"name": "sixth"}},
+        {"op": "add", "path": "/blocks/3/events/0", "value": {"name": "first"}},
+        {"op": "add", "path": "/name", "value": "new"},
+        {"op": "remove", "path": "/description"},
+    ))
+
+    assert conditions == {
+        "blocks.0.name": {"$exists": True},
+        "blocks.1.events": {"$exists": True},
+        # index 5 is in range only when array has 5 items already
+        "blocks.2.events": {"$exists": True},
+        "blocks.2.events.4": {"$exists": True},
+        "blocks.3.events": {"$exists": True},
+        "description": {"$exists": True},
+    }
+
+
+def test_build_update_needs_document():
+    # removal from array
+    assert build_update(ops({"op": "remove", "path": "/blocks/0"})) is None
+    # conflicting paths
+    assert build_update(ops(
+        {"op": "add", "path": "/blocks/0", "value": {}}, {"op": "replace", "path": "/blocks/1/name", "value": "a"}
+    )) is None
+    assert build_update(ops({"op": "move", "from": "/blocks/0", "path": "/blocks/1"})) is None
+
+
+def test_apply_patch():
+    document = {"name": "a", "blocks": [{"name": "b0"}, {"name": "b1"}]}
+
+    apply_patch(document, ops(
+        {"op": "test", "path": "/name", "value": "a"},
+        {"op": "remove", "path": "/blocks/0"},
+        {"op": "add", "path": "/blocks/-", "value": {"name": "b2"}},
+        {"op": "copy", "from": "/blocks/0/name", "path": "/name"},
+        {"op": "move", "from": "/blocks/1", "path": "/blocks/0"},
+    ))
+
+    assert document == {"name": "b1", "blocks": [{"name": "b2"}, {"name": "b1"}]}
+
+    with pytest.raises(HTTPException) as e:
+        apply_patch(document, ops({"op": "test", "path": "/name", "value": "a"}))
+    assert e.value.status_code == 409
+
+
+def test_build_update_from_document():
+    document = {"name": "a", "blocks": [{"name": "b1", "events": []}]}
+
+    update = build_update_from_document(document, ops(
+        {"op": "remove", "path": "/blocks/0"},
+        {"op": "replace", "path": "/blocks/0/name", "value": "b1"},
+        {"op": "remove", "path": "/description"},
+    ))
+
+    assert update == {"$set": {"blocks": [{"name": "b1", "events": []}]}, "$unset": {"description": ""}}
+
+
+def test_is_affecting_images():
+    manifest = [{"path": "blocks.1.events.0.images.0", "key": "hash.png"}]
+
+    assert not is_affecting_images(ops({"op": "replace", "path": "/blocks/0/name", "value": "a"}), manifest)
+    # paths of images are shifted
+    assert is_affecting_images(ops({"op": "add", "path": "/blocks/0", "value": {}}), manifest)
+    assert is_affecting_images(ops({"op": "add", "path": "/blocks/0/events/-", "value": {"images": [{"image_data": "data:"}]}}), manifest)
+    assert is_affecting_images(ops({"op": "replace", "path": "/blocks/0/events/0/images/0/image_description", "value": "a"}), manifest)
+
+
+@pytest.mark.asyncio
+async def test_patch_assignment_without_reading_document(monkeypatch):
+    assignment_id = str(ObjectId())
+    collection = AsyncMock()
+    collection.find_one.return_value = {"_id": ObjectId(assignment_id), "save_counter": 2, "image_manifest": []}
+    collection.update_one.return_value = MagicMock(matched_count=1)
+    monkeypatch.setattr(image_store, "acquire_images", AsyncMock())
+    monkeypatch.setattr(image_store, "release_images", AsyncMock())
+
+    result = await patch_assignment_in_db(
+        assignment_id, save_counter=2, operations=ops({"op": "replace", "path": "/name", "value": "new"}), collection=collection
+    )
+
+    assert result["save_counter"] == 3
+    assert collection.find_one.await_count == 1  # only save_counter and manifest
+    (query, update), (size_query, size_pipeline) = [call.args for call in collection.update_one.await_args_list]
+    assert query == {"_id": ObjectId(assignment_id), "save_counter": 2, "name": {"$exists": True}}
+    assert update["$set"]["name"] == "new"
+    assert update["$inc"] == {"save_counter": 1}
+    # sizes are recomputed by db from saved version only
+    assert size_query == {"_id": ObjectId(assignment_id), "save_counter": 3}
+    assert size_pipeline[0]["$set"].keys() == {"size_doc", "size_total"}
+
+
+@pytest.mark.asyncio
+async def test_patch_assignment_conflict():
+    collection = AsyncMock()
+    collection.find_one.return_value = {"_id": ObjectId(), "save_counter": 5, "image_manifest": []}
+
+    with pytest.raises(HTTPException) as e:
+        await patch_assignment_in_db(
+            str(ObjectId()), save_counter=2, operations=ops({"op": "replace", "path": "/name", "value": "new"}), collection=collection
+        )
+    assert e.value.status_code == 409
+
+    with pytest.raises(HTTPException) as e:
+        await patch_assignment_in_db(
+            str(ObjectId()), save_counter=5, operations=ops({"op": "replace", "path": "/save_counter", "value": 0}), collection=collection
+        )
+    assert e.value.status_code == 422
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("operation, condition", [
+    ({"op": "add", "path": "/blocks/7", "value": {}}, "blocks.6"),  # index out of range
+    ({"op": "add", "path": "/blocks/0/events/-", "value": {}}, "blocks.0.events"),  # missing array
+    ({"op": "replace", "path": "/blocks/0/missing", "value": "a"}, "blocks.0.missing"),
+    ({"op": "remove", "path": "/missing"}, "missing"),
+])
+async def test_patch_assignment_missing_path(monkeypatch, operation, condition):
+    assignment_id = str(ObjectId())
+    collection = AsyncMock()
+    # save_counter is the same after update, so update isn't matched because of path
+    collection.find_one.return_value = {"_id": ObjectId(assignment_id), "save_counter": 2, "image_manifest": []}
+    collection.update_one.return_value = MagicMock(matched_count=0)
+    monkeypatch.setattr(image_store, "acquire_images", AsyncMock())
+    monkeypatch.setattr(image_store, "release_images", AsyncMock())
+
+    with pytest.raises(HTTPException) as e:
+        await patch_assignment_in_db(assignment_id, save_counter=2, operations=ops(operation), collection=collection)
+
+    assert e.value.status_code == 422
+    query, _ = collection.update_one.await_args.args
+    assert query[condition] == {"$exists": True}
+
+
+@pytest.mark.asyncio
+async def test_patch_assignment_saved_concurrently(monkeypatch):
+    collection = AsyncMock()
+    collection.find_one.side_effect = [{"_id": ObjectId(), "save_counter": 2, "image_manifest": []}, {"save_counter": 3}]
+    collection.update_one.return_value = MagicMock(matched_count=0)
+    monkeypatch.setattr(image_store, "acquire_images", AsyncMock())
+    monkeypatch.setattr(image_store, "release_images", AsyncMock())
+
+    with pytest.raises(HTTPException) as e:
+        await patch_assignment_in_db(
+            str(ObjectId()), save_counter=2, operations=ops({"op": "replace", "path": "/name", "value": "new"}), collection=collection
+        )
+    assert e.value.status_code == 409
@@ -0,0 +1,41 @@
+import pytest
+
+import app.core.services.s3 as s3
+
+
+@pytest.fixture()
+def fake_s3_client(make_fake_s3_client):
+    return make_fake_s3_client(
+        [f"assignment_1/{i}.png" for i in range(2500)] + [f"assignment_2/{i}.png" for i in range(10)] + ["assignment_10/0.png"]
+    )
+
+
+def test_parse_s3_uri():
+    assert s3.parse_s3_uri("s3://images/assignment_1/file.png") == ("images", "assignment_1", "file.png")
+    assert s3.get_s3_uri(bucket="images", prefix="assignment_1", object_key="file.png") == "s3://images/assignment_1/file.png"
+
+
+@pytest.mark.asyncio
+async def test_list_files_all_pages(fake_s3_client):
+    files = await s3.list_files(bucket_name="images", prefix="assignment_1/")
+    assert len(files) == 2500
+
+
+@pytest.mark.asyncio
+async def test_delete_folder_in_batches(fake_s3_client):
+    deleted = await s3.delete_folder(bucket_name="images", prefix="assignment_1")
+    assert deleted == 2500
+    assert [len(batch) for batch in fake_s3_client.delete_requests] == [1000, 1000, 500]
+
+
+@pytest.mark.asyncio
+async def test_delete_folders(fake_s3_client):
+    deleted = await s3.delete_folders(bucket_name="images", prefixes=["assignment_1", "assignment_2"])
+    assert deleted == 2510
+    assert sorted(len(batch) for batch in fake_s3_client.delete_requests) == [10, 500, 1000, 1000]
+
+
+@pytest.mark.asyncio
+async def test_delete_folder_empty_prefix(fake_s3_client):
+    with pytest.raises(ValueError):
+        await s3.delete_folder(bucket_name="images", prefix="")
@@ -0,0 +1,73 @@
+import os
+import pytest
+
+import app.core.services.schema as schema
+from app.core.services.schema import (
+    get_schema_snapshot, get_schema_snapshot_async, build_schema_snapshot, resolve_assignment_schema, move_schema_to_store
+)
+from app.core.services.utils import get_hash
+
+
+def test_schema_snapshot_is_rebuilt_on_change(tmp_path):
+    path = tmp_path / "events_mapper.yaml"
+    path.write_text("pageview:\n  - key: event\n    value: pageview\n")
+
+    snapshot = get_schema_snapshot(path=str(path))
+    assert get_schema_snapshot(path=str(path)) is snapshot
+    assert '"pageview"' in snapshot.assignment_ui_schema
+
+    # touched, but not changed
+    os.utime(path, (snapshot.events_mapper_mtime + 10, snapshot.events_mapper_mtime + 10))
+    touched_snapshot = get_schema_snapshot(path=str(path))
+    assert touched_snapshot.assignment_ui_schema_hash == snapshot.assignment_ui_schema_hash
+    assert get_schema_snapshot(path=str(path)) is touched_snapshot
+
+    path.write_text("click:\n  - key: event\n    value: click\n")
+    os.utime(path, (snapshot.events_mapper_mtime + 20, snapshot.events_mapper_mtime + 20))
+    changed_snapshot = get_schema_snapshot(path=str(path))
+    assert changed_snapshot.assignment_ui_schema_hash != snapshot.assignment_ui_schema_hash
+    assert '"click"' in changed_snapshot.assignment_ui_schema
+
+
+@pytest.mark.asyncio
+async def test_resolve_assignment_schema(monkeypatch):
+    stored = {("assignment_ui_schema", "schema_hash"): '{"stored": true}', ("events_mapper", "mapper_hash"): '{}'}
+
+    async def get_schema_(kind, schema_hash):
+        return stored.get((kind, schema_hash))
+
+    monkeypatch.setattr(schema, "get_schema", get_schema_)
+
+    # embedded in document saved before schema store
+    assert await resolve_assignment_schema(
+        {"assignment_ui_schema": '{"embedded": true}', "assignment_ui_schema_hash": "schema_hash", "events_mapper": '{"a": 1}'}
+    ) == ('{"embedded": true}', '{"a": 1}')
+    assert await resolve_assignment_schema(
+        {"assignment_ui_schema_hash": "schema_hash", "events_mapper_hash": "mapper_hash"}
+    ) == ('{"stored": true}', '{}')
+
+
+@pytest.mark.asyncio
+async def test_move_schema_to_store(monkeypatch):
+    stored = {}
+
+    async def put_schema_(kind, schema_hash, data):
+        stored[(kind, schema_hash)] = data
+
+    monkeypatch.setattr(schema, "put_schema", put_schema_)
+
+    result = await move_schema_to_store({"name": "a", "assignment_ui_schema": '{"a": 1}', "events_mapper": None})
+
+    assert result == {"name": "a", "assignment_ui_schema_hash": get_hash('{"a": 1}')}
+    assert stored == {("assignment_ui_schema", get_hash('{"a": 1}')): '{"a": 1}'}
+
+
+@pytest.mark.asyncio
+async def test_get_schema_snapshot_async(tmp_path):
+    path = tmp_path / "events_mapper.yaml"
+    path.write_text("pageview:\n  - key: event\n    value: pageview\n")
+
+    snapshot = await get_schema_snapshot_async(path=str(path))
+
+    assert snapshot == build_schema_snapshot(path.read_text(), path=str(path), mtime=snapshot.events_mapper_mtime)
+    assert get_schema_snapshot(path=str(path)) is snapshot
@@ -0,0 +1,27 @@
+import gzip
+import json
+
+from app.core.services.serialization import dumps, compress, get_accepted_encodings
+
+
+def test_dumps():
+    assert json.loads(dumps({"name": "ТЗ", "blocks": [1, 2]})) == {"name": "ТЗ", "blocks": [1, 2]}
+
+
+def test_get_accepted_encodings():
+    assert get_accepted_encodings("gzip, deflate;q=0.5, br;q=0") == {"gzip", "deflate"}
+    assert get_accepted_encodings(None) == set()
+
+
+def test_compress():
+    body = b'{"a": 1}' * 200
+
+    compressed, encoding = compress(body, accept_encoding="gzip", min_size=1024)
+    assert encoding == "gzip"
+    assert gzip.decompress(compressed) == body
+
+    # br isn't supported
+    assert compress(body, accept_encoding="br, gzip", min_size=1024)[1] == "gzip"
+    assert compress(body, accept_encoding="br", min_size=1024) == (body, None)
+    assert compress(body, accept_encoding="identity", min_size=1024) == (body, None)
+    assert compress(b'{"a": 1}', accept_encoding="gzip", min_size=1024) == (b'{"a": 1}', None)
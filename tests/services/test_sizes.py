@@ -0,0 +1,20 @@
+from app.core.services.sizes import MB, get_images_size, get_size_stage
+
+
+def test_get_images_size_counts_every_image_once():
+    manifest = [
+        {"key": "images/a.png", "path": "blocks.0.images.0", "size": 100},
+        {"key": "images/a.png", "path": "blocks.1.images.0", "size": 100},
+        {"key": "images/b.png", "path": "blocks.1.images.1", "size": 50},
+        {"key": "images/c.png", "path": "blocks.2.images.0"},
+    ]
+    assert get_images_size(manifest) == 150
+    assert get_images_size([]) == 0
+
+
+def test_get_size_stage():
+    stage = get_size_stage(2 * MB)
+    size_doc, size_total = stage["$set"]["size_doc"], stage["$set"]["size_total"]
+
+    assert size_doc == {"$round": [{"$divide": [{"$bsonSize": "$$ROOT"}, MB]}, 2]}
+    assert size_total == {"$round": [{"$divide": [{"$add": [{"$bsonSize": "$$ROOT"}, 2 * MB]}, MB]}, 2]}